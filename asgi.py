@@ -0,0 +1,217 @@
+"""非同步（ASGI）服務模式
+
+    uvicorn asgi:app --workers 2
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+
+路由與 JSON 格式與 stock_api.py 完全相同：所有請求仍由 Flask 的 stock_api.app 處理（asgiref 的 WsgiToAsgi，
+在最多 ASGI_THREADS 個執行緒的執行緒池中同時執行）。差別在於 /api/stock-data 與批次查詢交給 Flask 之前，先以非阻塞的 httpx.AsyncClient
+抓取倉儲與快取還沒有的上游資料並存進倉儲、快取（stock_api.prefetch_requests 列出需要的請求）。
+等待證交所的期間只佔用事件迴圈中的一個協程，不佔用執行緒，一個程序可以同時處理數百個等待中的查詢；
+Flask 處理時資料都已在快取中，只剩合併、指標計算與序列化。
+
+預先抓取只包含已定案的資料；尚未定案的當月、當日資料不保存，仍由 Flask 的執行緒在處理查詢時以同步的客戶端抓取。
+
+同時送往證交所的請求數以 FETCH_CONCURRENCY 為上限；相同的請求經由 stock_api.single_flight 合併，
+同一個程序內與多個 worker 之間都只送出一次。
+串流查詢同樣先預先抓取，Flask 串流時資料都已在快取中；explain、排入背景工作的查詢不預先抓取，照原本的方式處理。
+
+ThreadedWsgiToAsgi 覆寫 asgiref 的 WsgiToAsgiInstance.run_wsgi_app（非公開介面），asgiref 的版本固定在
+requirements.txt。
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+
+import stock_api
+from twse_client import AsyncTWSEClient
+
+try:
+    from asgiref.sync import sync_to_async
+    from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+except ImportError:  # pragma: no cover - 選用套件（非同步模式）
+    WsgiToAsgi = None
+
+# 預先抓取的路由（值為是否為批次查詢）
+PREFETCH_ROUTES = {'/api/stock-data': False, '/api/stock-data/batch': True}
+
+# 預先抓取最多進行的輪數（第一輪可能只是學習交易日曆）
+PREFETCH_ROUNDS = stock_api.PREFETCH_ROUNDS
+
+
+class Prefetcher:
+    """以非阻塞的客戶端抓取查詢需要的上游資料並存進倉儲與快取"""
+
+    def __init__(self, client, concurrency=8, requests_for=stock_api.prefetch_requests,
+                 single_flight=None):
+        self.client = client
+        self.concurrency = concurrency
+        self.requests_for = requests_for
+        self.single_flight = single_flight
+        self._semaphore = None
+        self._inflight = {}
+        self.stats = {'queries': 0, 'requests': 0, 'shared': 0, 'errors': 0}
+
+    async def prefetch(self, data, batch=False):
+        """抓取查詢需要的資料；抓取失敗時停止，由路由重試並在回應中回報"""
+        self.stats['queries'] += 1
+        for _ in range(PREFETCH_ROUNDS):
+            pending = await asyncio.to_thread(self.requests_for, data, batch)
+            if not pending:
+                return
+            outcomes = await asyncio.gather(*(self.fetch(upstream) for upstream in pending),
+                                            return_exceptions=True)
+            if any(isinstance(outcome, Exception) for outcome in outcomes):
+                return
+
+    async def fetch(self, upstream):
+        """抓取一個 UpstreamRequest；key 相同、進行中的請求共用同一個結果"""
+        task = self._inflight.get(upstream.key)
+        if task is None:
+            task = self._inflight[upstream.key] = asyncio.ensure_future(self._download(upstream))
+            task.add_done_callback(lambda _: self._inflight.pop(upstream.key, None))
+        else:
+            self.stats['shared'] += 1
+        # 某個查詢的連線中斷（協程被取消）時，其他等待同一個請求的查詢不受影響
+        return await asyncio.shield(task)
+
+    async def _download(self, upstream):
+        # 與 Flask 執行緒（stock_api.fetch_upstream）、其他 worker 的相同請求合併
+        # 未指定時使用 stock_api 目前的 single_flight（open_storage 可能已換成其他快取目錄）
+        single_flight = self.single_flight or stock_api.single_flight
+        return await single_flight.do_async(upstream.key, partial(self._request, upstream))
+
+    async def _request(self, upstream):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            self.stats['requests'] += 1
+            try:
+                result = await self.client.get_json(upstream.endpoint, upstream.params)
+            except Exception:
+                self.stats['errors'] += 1
+                raise
+        return await asyncio.to_thread(upstream.store, result)
+
+
+def request_data(scope, body):
+    """與 stock_api.request_params 相同的方式解析請求內容；無法解析時回傳 None（交由路由回報錯誤）"""
+    if scope['method'] == 'POST':
+        try:
+            data = json.loads(body or b'null')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    if scope['method'] == 'GET':
+        query = scope.get('query_string', b'').decode('latin-1')
+        return stock_api.query_params(MultiDict(parse_qsl(query, keep_blank_values=True)))
+    return None
+
+
+if WsgiToAsgi is not None:
+    # asgiref 以 @sync_to_async 包裝的 run_wsgi_app 原本的函式（版本固定在 requirements.txt；
+    # 其他版本的結構不同時為 None，由 flask_app 回報，不影響匯入）
+    run_wsgi_app = getattr(WsgiToAsgiInstance.__dict__.get('run_wsgi_app'), 'func', None)
+
+    class ThreadedWsgiInstance(WsgiToAsgiInstance):
+        """在指定的執行緒池中執行 WSGI app 的 WsgiToAsgiInstance"""
+
+        def __init__(self, wsgi_application, executor, duplicate_header_limit=100):
+            super().__init__(wsgi_application, duplicate_header_limit)
+            self.executor = executor
+
+        async def run_wsgi_app(self, body):
+            await sync_to_async(run_wsgi_app, thread_sensitive=False, executor=self.executor)(self, body)
+
+    class ThreadedWsgiToAsgi(WsgiToAsgi):
+        """WsgiToAsgi 預設（thread_sensitive=True）所有請求在同一個執行緒依序執行；改為在執行緒池中同時處理"""
+
+        def __init__(self, wsgi_application, threads=16):
+            super().__init__(wsgi_application)
+            self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+        async def __call__(self, scope, receive, send):
+            await ThreadedWsgiInstance(self.wsgi_application, self.executor, self.duplicate_header_limit)(
+                scope, receive, send)
+
+
+def flask_app():
+    if WsgiToAsgi is None:
+        raise RuntimeError('非同步模式需要安裝 asgiref、httpx 與 uvicorn（pip install asgiref httpx uvicorn）')
+    if not callable(run_wsgi_app):
+        raise RuntimeError('不支援此版本的 asgiref，請安裝 requirements.txt 指定的版本')
+    return ThreadedWsgiToAsgi(stock_api.app, threads=int(os.environ.get('ASGI_THREADS', 16)))
+
+
+class PrefetchMiddleware:
+    """ASGI 應用程式：查詢路由先非同步預先抓取，再交給 app（預設為 stock_api 的 Flask 路由）"""
+
+    def __init__(self, app=None, prefetcher=None):
+        self.app = app
+        self.prefetcher = prefetcher or Prefetcher(
+            AsyncTWSEClient(stock_api.twse_client, pool_size=int(os.environ.get('ASYNC_POOL_SIZE', 100))),
+            concurrency=int(os.environ.get('FETCH_CONCURRENCY', 8))
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if self.app is None:
+            self.app = flask_app()
+        if scope['type'] != 'http' or scope['path'] not in PREFETCH_ROUTES:
+            return await self.app(scope, receive, send)
+
+        # 讀取完整的請求內容，解析後原封不動地轉交給 app
+        messages = []
+        body = b''
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message['type'] != 'http.request':
+                break
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        data = request_data(scope, body)
+        if data is not None and messages[-1]['type'] == 'http.request':
+            try:
+                await self.prefetcher.prefetch(data, PREFETCH_ROUTES[scope['path']])
+            except Exception as e:
+                # 預先抓取只是加速，失敗時照原本的方式由路由處理
+                print(f"Error prefetching {scope['path']}: {e}")
+
+        async def replay():
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        await self.app(scope, replay, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # 盤後預先抓取以背景執行緒執行（同 gunicorn.conf.py）
+                import warmer
+                warmer.start_background()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.prefetcher.client.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = PrefetchMiddleware()
+
+
+def prefetch_metrics():
+    return [('stock_api_async_prefetch',
+             '非同步模式的預先抓取（queries：查詢數；requests：上游請求數；shared：共用進行中請求的次數；errors：失敗次數）',
+             [({'stat': name}, count) for name, count in app.prefetcher.stats.items()])]
+
+stock_api.registry.add_collector(prefetch_metrics)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""批次回補歷史資料到本機倉儲（warehouse）
+
+已載入的月份、日期會自動跳過，中斷後重新執行即可從未完成的部分繼續；
+以 --rate 限制每秒請求數，避免被證交所封鎖；請求同時受所有程序共用的速率控制（rate_governor.py）限制，
+並以較低的優先順序送出，不會佔用線上查詢的額度。只載入已定案的資料（已結束的月份、盤後已公布的日期）。
+
+用法：
+    python backfill.py --stocks 2330,2317 --start 2020-01-01 --end 2024-12-31
+    python backfill.py --stocks 2330 --start 2019-01-01 --datasets price --rate 0.5
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from functools import partial
+
+import stock_api
+from rate_governor import request_priority
+from trading_calendar import iter_months
+from twse_cache import is_day_finalized, is_month_closed, taipei_now
+from warehouse import month_key
+
+DATASETS = {'price': 'STOCK_DAY', 'institutional': 'T86', 'fundamental': 'BWIBBU_d'}
+
+
+class RateLimiter:
+    """每次請求前等待，讓請求間隔不小於 1 / rate 秒"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._last = 0.0
+
+    def wait(self):
+        delay = self._last + self.interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._last = time.monotonic()
+
+
+def plan_backfill(warehouse, stock_codes, start_date, end_date, datasets, now=None):
+    """列出倉儲還沒有的 (資料集, key, 抓取函式)"""
+    now = now or taipei_now()
+    jobs = []
+
+    if 'price' in datasets:
+        for year, month in iter_months(start_date, end_date):
+            if is_month_closed(year, month, now):
+                for stock_code in stock_codes:
+                    jobs.append(('STOCK_DAY', month_key(stock_code, year, month),
+                                 partial(stock_api.fetch_month_prices, stock_code, year, month)))
+
+    # 全市場表逐日載入；假日會記錄為空表，之後不再請求
+    day = start_date
+    while day <= end_date:
+        if day.weekday() < 5 and is_day_finalized(day, now):
+            for data_type in ('institutional', 'fundamental'):
+                if data_type in datasets:
+                    endpoint = DATASETS[data_type]
+                    jobs.append((endpoint, day.strftime('%Y%m%d'),
+                                 partial(stock_api.fetch_market_snapshot, endpoint, day)))
+        day += timedelta(days=1)
+
+    covered = {}
+    for dataset in {dataset for dataset, _, _ in jobs}:
+        covered[dataset] = warehouse.covered(dataset, [key for name, key, _ in jobs if name == dataset])
+    return [job for job in jobs if job[1] not in covered[job[0]]]
+
+
+def run_backfill(jobs, limiter):
+    """依序執行，失敗的項目記錄後繼續；回傳失敗的 (資料集, key, 例外)"""
+    failures = []
+    started = time.time()
+    for i, (dataset, key, fetch) in enumerate(jobs, 1):
+        limiter.wait()
+        try:
+            fetch()
+        except Exception as e:
+            print(f"❌ {dataset} {key}: {e}")
+            failures.append((dataset, key, e))
+        if i % 20 == 0 or i == len(jobs):
+            elapsed = time.time() - started
+            print(f"📦 {i}/{len(jobs)}（{elapsed:.0f} 秒，預估剩餘 {elapsed / i * (len(jobs) - i):.0f} 秒）")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批次回補歷史資料到本機倉儲')
+    parser.add_argument('--stocks', required=True, help='股票代碼，以逗號分隔（股價資料使用）')
+    parser.add_argument('--start', required=True, help='開始日期 YYYY-MM-DD')
+    parser.add_argument('--end', help='結束日期 YYYY-MM-DD（預設為今天）')
+    parser.add_argument('--datasets', default=','.join(DATASETS),
+                        help=f'要載入的資料，以逗號分隔（{", ".join(DATASETS)}）')
+    parser.add_argument('--rate', type=float, default=1.0, help='每秒請求數上限（預設 1）')
+    args = parser.parse_args()
+
+    stock_codes = [code.strip() for code in args.stocks.split(',') if code.strip()]
+    start_date = datetime.strptime(args.start, '%Y-%m-%d')
+    end_date = datetime.strptime(args.end, '%Y-%m-%d') if args.end else taipei_now()
+    datasets = [name.strip() for name in args.datasets.split(',') if name.strip()]
+    unknown = [name for name in datasets if name not in DATASETS]
+    if unknown:
+        parser.error(f'不支援的資料：{", ".join(unknown)}')
+
+    jobs = plan_backfill(stock_api.warehouse, stock_codes, start_date, end_date, datasets)
+    print(f"🚀 需要載入 {len(jobs)} 筆（月份或日期），倉儲位置：{stock_api.warehouse.path}")
+    try:
+        with request_priority('backfill'):
+            failures = run_backfill(jobs, RateLimiter(args.rate))
+    except KeyboardInterrupt:
+        print("⏸️ 已中斷，重新執行會從未完成的部分繼續")
+        return
+
+    print(f"✅ 完成！失敗 {len(failures)} 筆（重新執行即可重試）")
+    print(stock_api.warehouse.stats())
+
+
+if __name__ == '__main__':
+    main()
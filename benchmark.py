@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""效能基準測試（離線）
+
+以 twse_stub.py 的替身伺服器取代證交所，量測：
+
+- 端對端情境：30 / 90 / 365 天的單檔查詢與多檔批次查詢，各自在全新的快取目錄中執行，
+  記錄第一次（cold，全部向替身伺服器請求）、第二次（warm，倉儲與快取命中）與第三次（cached，查詢結果快取命中）
+  的耗時、上游請求數與資料筆數
+- 微基準：StockFrame.ingest（解析並合併）、技術指標與成交量分析、資料列輸出與 JSON 序列化（取多次執行的最佳值）
+
+結果與 benchmark_baseline.json 比較，耗時超過基準的 (1 + tolerance) 倍或上游請求數增加時列為退步並以狀態碼 1 結束。
+基準值與機器有關，換機器或確認改善後以 --update-baseline 重新產生。
+
+用法：
+    python benchmark.py                       # 全部執行並與基準比較
+    python benchmark.py --only 30d,micro      # 只執行部分情境
+    python benchmark.py --latency 0.05 --throttle 20 --fixtures fixtures
+    python benchmark.py --update-baseline
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# 預設容許的耗時退步比例
+DEFAULT_TOLERANCE = 0.25
+
+# 小於這個秒數的差異視為量測誤差
+NOISE_SECONDS = 0.01
+
+FULL_INDICATORS = {'maPeriods': [5, 10, 20, 60, 120, 240], 'extra': ['RSI', 'MACD', 'KD', 'BB']}
+
+BATCH_CODES = ['2330', '2317', '2454', '2308', '2881', '2882', '2303', '1301', '2002', '0050',
+               '1108', '1115', '1122', '1129', '1136', '1143', '1150', '1157', '1164', '1171']
+
+# 端對端情境：(名稱, 路徑, 請求內容)；日期固定在過去，結果不隨執行日期改變
+SCENARIOS = [
+    ('30d', '/api/stock-data', {
+        'stockCode': '2330', 'startDate': '2024-05-01', 'endDate': '2024-05-31',
+        'dataTypes': ['price', 'institutional', 'technical']}),
+    ('90d', '/api/stock-data', {
+        'stockCode': '2330', 'startDate': '2024-04-01', 'endDate': '2024-06-30',
+        'dataTypes': ['price', 'institutional', 'fundamental', 'technical', 'volume']}),
+    ('365d', '/api/stock-data', {
+        'stockCode': '2330', 'startDate': '2023-07-01', 'endDate': '2024-06-30',
+        'dataTypes': ['price', 'technical', 'volume'], 'indicators': FULL_INDICATORS}),
+    ('365d_institutional', '/api/stock-data', {
+        'stockCode': '2330', 'startDate': '2023-07-01', 'endDate': '2024-06-30',
+        'dataTypes': ['price', 'institutional', 'technical']}),
+    ('batch20_90d', '/api/stock-data/batch', {
+        'stockCodes': BATCH_CODES, 'startDate': '2024-04-01', 'endDate': '2024-06-30',
+        'dataTypes': ['price', 'institutional', 'technical', 'volume']}),
+]
+
+MICRO_ROWS = 2000
+MICRO_RECORDS = 5000
+MICRO_REPEAT = 5
+
+
+def run_scenario(path, body):
+    """在目前的程序中執行一個端對端情境（環境變數需已指向替身伺服器與全新的快取目錄）"""
+    import stock_api
+
+    client = stock_api.app.test_client()
+    result = OrderedDict()
+    for phase in ('cold', 'warm', 'cached'):
+        if phase == 'warm':
+            # warm 量測倉儲與快取命中時的完整處理，cached 量測結果快取命中
+            stock_api.result_cache.clear()
+        calls_before = sum(value for _, value in stock_api.UPSTREAM_REQUESTS.samples())
+        started = time.perf_counter()
+        response = client.post(path, json=body)
+        elapsed = time.perf_counter() - started
+        data = response.get_json()
+        if response.status_code != 200 or not data.get('success'):
+            raise RuntimeError(f'{path} 回應 {response.status_code}：{data.get("error")}')
+        result[f'{phase}_seconds'] = round(elapsed, 4)
+        result[f'{phase}_upstream_calls'] = sum(value for _, value in stock_api.UPSTREAM_REQUESTS.samples()) - calls_before
+        result['rows'] = data['count']
+    return result
+
+
+def scenario_in_subprocess(name, base_url, cache_dir):
+    """每個情境在獨立的程序與快取目錄中執行（stock_api 在匯入時讀取設定）"""
+    env = dict(os.environ,
+               TWSE_BASE_URL=base_url,
+               TWSE_CACHE_DIR=os.path.join(cache_dir, name),
+               TWSE_RETRY_BACKOFF='0.05',
+               TWSE_RATE_PER_SECOND='0',
+               LIVE_MAX_CALLS='100000',
+               JOB_MAX_CALLS='100000')
+    env.pop('WAREHOUSE_PATH', None)
+    env.pop('JOB_DIR', None)
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--scenario', name],
+                               env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f'情境 {name} 失敗：\n{completed.stderr[-2000:]}')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def best_of(function, repeat=MICRO_REPEAT):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return round(min(timings), 5)
+
+
+def micro_benchmarks():
+    """解析合併、指標計算、序列化的微基準（資料由替身伺服器的產生器建立，不需要網路）"""
+    from datetime import date, timedelta
+
+    from indicators import parse_indicator_config, technical_indicators, volume_analysis
+    from responses import dumps
+    from stock_frame import StockFrame
+    from twse_stub import _day_row, is_trading_day
+
+    rows = []
+    day = date(2015, 1, 1)
+    while len(rows) < MICRO_ROWS:
+        if is_trading_day(day):
+            volume, turnover, open_, high, low, close, change, transactions = _day_row('2330', day)
+            rows.append((day.isoformat(), {
+                '成交股數': f'{volume:,}', '成交金額': f'{turnover:,}', '開盤價': f'{open_:,.2f}',
+                '最高價': f'{high:,.2f}', '最低價': f'{low:,.2f}', '收盤價': f'{close:,.2f}',
+                '漲跌價差': f'{change:+.2f}', '成交筆數': f'{transactions:,}'}))
+        day += timedelta(days=1)
+
+    def ingest():
+        frame = StockFrame('2330')
+        for date_str, values in rows:
+            frame.ingest(date_str, values)
+        return frame
+
+    frame = ingest()
+    config = parse_indicator_config(FULL_INDICATORS)
+
+    def indicators():
+        technical_indicators(frame, config)
+        volume_analysis(frame)
+
+    indicators()
+    column_order = ['日期', '股票代碼'] + list(frame.columns)
+    big_frame = StockFrame('2330')
+    for i in range(MICRO_RECORDS):
+        big_frame.ingest(f'{1990 + i // 300:04d}-{i % 300 // 25 + 1:02d}-{i % 25 + 1:02d}', rows[i % len(rows)][1])
+
+    def serialize():
+        dumps(big_frame.to_records(column_order))
+
+    return OrderedDict([
+        ('ingest_seconds', best_of(ingest)),
+        ('indicators_seconds', best_of(indicators)),
+        ('serialize_seconds', best_of(serialize)),
+    ])
+
+
+def compare(results, baseline, tolerance):
+    """回傳退步的項目 [(情境, 指標, 基準值, 本次數值)]"""
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            expected = baseline.get(name, {}).get(metric)
+            if expected is None:
+                continue
+            if metric.endswith('_seconds'):
+                worse = value - expected > max(expected * tolerance, NOISE_SECONDS)
+            elif metric.endswith('_upstream_calls'):
+                worse = value > expected
+            else:
+                worse = False
+            if worse:
+                regressions.append((name, metric, expected, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='效能基準測試（離線，使用證交所替身伺服器）')
+    parser.add_argument('--only', help='只執行這些情境（以逗號分隔，micro 為微基準）')
+    parser.add_argument('--latency', type=float, default=0.02, help='替身伺服器每個請求的延遲秒數')
+    parser.add_argument('--jitter', type=float, default=0.0, help='替身伺服器額外的隨機延遲秒數上限')
+    parser.add_argument('--throttle', type=int, default=0, help='替身伺服器每秒請求數上限（0 為不限流）')
+    parser.add_argument('--fixtures', help='已錄製資料的目錄（twse_stub.py record 產生）')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='容許的耗時退步比例')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help='以本次結果覆寫基準值')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        _, path, body = next(scenario for scenario in SCENARIOS if scenario[0] == args.scenario)
+        print(json.dumps(run_scenario(path, body)))
+        return 0
+
+    from twse_stub import StubTWSE, start_server
+
+    selected = set(args.only.split(',')) if args.only else None
+    results = OrderedDict()
+    stub = StubTWSE(args.fixtures, args.latency, args.jitter, args.throttle)
+    server, base_url = start_server(stub)
+    try:
+        with tempfile.TemporaryDirectory(prefix='stock-benchmark-') as cache_dir:
+            for name, _, _ in SCENARIOS:
+                if selected is None or name in selected:
+                    results[name] = scenario_in_subprocess(name, base_url, cache_dir)
+                    print(f'⏱️  {name}: {json.dumps(results[name], ensure_ascii=False)}')
+    finally:
+        server.shutdown()
+    if selected is None or 'micro' in selected:
+        results['micro'] = micro_benchmarks()
+        print(f'⏱️  micro: {json.dumps(results["micro"], ensure_ascii=False)}')
+    if stub.throttled:
+        print(f'🚦 替身伺服器限流 {stub.throttled} 次')
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f'✅ 已更新基準值：{args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('⚠️ 沒有基準值，請先以 --update-baseline 產生')
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for name, metric, expected, value in regressions:
+        print(f'❌ {name}.{metric} 退步：基準 {expected}，本次 {value}')
+    if regressions:
+        return 1
+    print('✅ 沒有效能退步')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+"""pytest 設定：測試使用暫存的快取目錄，不在專案下的 .cache 建立或寫入任何檔案"""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# 測試模組在收集時就會匯入 stock_api（以當時的 TWSE_CACHE_DIR 建立倉儲與快取），必須在那之前設定
+SESSION_CACHE_DIR = tempfile.mkdtemp(prefix='twse-cache-')
+os.environ['TWSE_CACHE_DIR'] = SESSION_CACHE_DIR
+
+# stock_api.open_storage 重新建立的模組變數
+STORAGE_NAMES = ('warehouse', 'snapshot_store', 'month_store', 'indicator_store', 'single_flight',
+                 'trading_calendar', 'WARMER_STATUS_PATH')
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(SESSION_CACHE_DIR, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """每個測試使用自己的快取目錄（tmp_path 下的 cache）；已匯入的 stock_api 改用這個目錄的倉儲與快取"""
+    root = tmp_path / 'cache'
+    monkeypatch.setenv('TWSE_CACHE_DIR', str(root))
+    stock_api = sys.modules.get('stock_api')
+    if stock_api is not None:
+        for name in STORAGE_NAMES:
+            monkeypatch.setattr(stock_api, name, getattr(stock_api, name))
+        stock_api.open_storage(str(root))
+        stock_api.result_cache.clear()
+    return root
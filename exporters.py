@@ -0,0 +1,167 @@
+"""匯出格式：CSV（含 BOM，Excel 可直接開啟）、Parquet、Arrow IPC
+
+每個 writer 依序接收多批資料列（OrderedDict，與 API 回傳的 data 相同；typed 為 True 的 writer
+接收未格式化的數值，見 StockFrame.to_records），
+write() 回傳可以立即送出的位元組，close() 回傳結尾，整份檔案不需要先放在記憶體中。
+Parquet、Arrow 需要選用套件 pyarrow。
+"""
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - 選用套件
+    pa = pq = None
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+}
+
+# 保留為文字的欄位（其餘欄位在 Parquet、Arrow 中轉成數值）
+TEXT_COLUMNS = {'股票代碼', '股利年度', '財報年季'}
+
+# 股數、金額、筆數等整數欄位
+INTEGER_COLUMNS = {
+    '成交股數', '成交金額', '成交筆數',
+    '外資買進', '外資賣出', '外資買賣超', '投信買進', '投信賣出', '投信買賣超',
+    '自營商買賣超', '三大法人買賣超合計'
+}
+
+# Parquet 每個 row group 的列數（太小的 row group 會讓檔案變大、讀取變慢）
+ROW_GROUP_SIZE = 10000
+
+
+class ExportError(Exception):
+    """不支援的匯出格式或缺少選用套件"""
+
+
+class CsvWriter:
+    """與前端「下載 CSV」相同的格式：標題列不加引號，每個值都加引號，缺值為空字串"""
+
+    typed = False
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def header(self):
+        return ('\ufeff' + ','.join(self.columns)).encode('utf-8')
+
+    def write(self, records):
+        lines = []
+        for row in records:
+            values = ('"' + str(row.get(name, '')).replace('"', '""') + '"' for name in self.columns)
+            lines.append('\n' + ','.join(values))
+        return ''.join(lines).encode('utf-8')
+
+    def close(self):
+        return b''
+
+
+class _ChunkSink:
+    """讓 pyarrow 寫入的暫存區，每次寫完一批就取出已產生的位元組"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parse_number(value, integer):
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        return int(value) if integer else float(value)
+    try:
+        number = float(value.replace(',', ''))
+    except ValueError:
+        return None
+    return int(number) if integer else number
+
+
+class ArrowWriter:
+    """Parquet 或 Arrow IPC（stream 格式），欄位依名稱轉為 date32、int64、float64 或 string"""
+
+    typed = True
+
+    def __init__(self, columns, fmt):
+        if pa is None:
+            raise ExportError('伺服器未安裝 pyarrow，無法匯出 Parquet、Arrow 格式')
+        self.columns = columns
+        self.schema = pa.schema([(name, self._type(name)) for name in columns])
+        self.sink = _ChunkSink()
+        self.pending = []
+        if fmt == 'parquet':
+            self.writer = pq.ParquetWriter(pa.PythonFile(self.sink, mode='w'), self.schema)
+            self.batch_rows = ROW_GROUP_SIZE
+        else:
+            self.writer = pa.ipc.new_stream(pa.PythonFile(self.sink, mode='w'), self.schema)
+            self.batch_rows = 1
+
+    @staticmethod
+    def _type(name):
+        if name == '日期':
+            return pa.date32()
+        if name in TEXT_COLUMNS:
+            return pa.string()
+        return pa.int64() if name in INTEGER_COLUMNS else pa.float64()
+
+    def _convert(self, name, values):
+        if name == '日期':
+            return [datetime.strptime(v, '%Y-%m-%d').date() for v in values]
+        if name in TEXT_COLUMNS:
+            return values
+        integer = name in INTEGER_COLUMNS
+        return [_parse_number(v, integer) for v in values]
+
+    def _flush(self):
+        if not self.pending:
+            return
+        arrays = [pa.array(self._convert(name, [row.get(name) for row in self.pending]), type=field.type)
+                  for name, field in zip(self.columns, self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.pending = []
+
+    def header(self):
+        return self.sink.drain()
+
+    def write(self, records):
+        self.pending += records
+        if len(self.pending) >= self.batch_rows:
+            self._flush()
+        return self.sink.drain()
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+        return self.sink.drain()
+
+
+def make_writer(fmt, columns):
+    """依格式建立 writer"""
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f'不支援的匯出格式：{fmt}（可用：{", ".join(EXPORT_FORMATS)}）')
+    if fmt == 'csv':
+        return CsvWriter(columns)
+    return ArrowWriter(columns, fmt)
@@ -0,0 +1,52 @@
+"""上游請求排程器：以有上限的執行緒池平行抓取，再依固定順序合併"""
+import contextvars
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# label: 錯誤訊息用的說明；fetch: 無參數的抓取函式；merge: 接收抓取結果並寫入資料
+FetchTask = namedtuple('FetchTask', ['label', 'fetch', 'merge'])
+
+
+class FetchScheduler:
+    """平行執行獨立的上游請求（每月股價、每日法人/基本面），同時執行數量不超過 max_workers"""
+
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='twse-fetch')
+
+    def _submit(self, fetch):
+        # 在呼叫端的 context 中執行（例如證交所請求的優先順序）
+        return self._executor.submit(contextvars.copy_context().run, fetch)
+
+    def map(self, fetchers):
+        """平行呼叫 fetchers，依原順序回傳 [(結果, 例外)]"""
+        futures = [self._submit(fetch) for fetch in fetchers]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append((future.result(), None))
+            except Exception as e:
+                outcomes.append((None, e))
+        return outcomes
+
+    def run(self, tasks):
+        """抓取所有 FetchTask 後依提交順序合併，確保結果與逐一執行相同；回傳失敗的 (label, 例外)"""
+        return [(task.label, error) for task, error in self.iter_run(tasks) if error is not None]
+
+    def iter_run(self, tasks):
+        """同 run，但每合併完一個 FetchTask 就產出 (task, 例外或 None)
+
+        所有請求一開始就送進執行緒池，呼叫端可在前面的任務合併後立即處理（例如串流輸出），
+        不必等後面的請求完成。
+        """
+        futures = [self._submit(task.fetch) for task in tasks]
+        for task, future in zip(tasks, futures):
+            try:
+                task.merge(future.result())
+                error = None
+            except Exception as e:
+                error = e
+            if error is not None:
+                print(f"Error fetching {task.label}: {error}")
+            yield task, error
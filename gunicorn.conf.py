@@ -0,0 +1,7 @@
+"""gunicorn 設定（Procfile 以 -c gunicorn.conf.py 載入）"""
+
+
+def post_worker_init(worker):
+    # 盤後預先抓取在 web 程序中以背景執行緒執行，所有 worker 中只有取得檔案鎖的一個執行排程
+    import warmer
+    warmer.start_background()
@@ -0,0 +1,537 @@
+"""技術指標計算引擎（NumPy 向量化）
+
+資料表中的數值在合併時已經解析（見 StockFrame.ingest），移動平均以累加和（rolling sum）計算，成本與資料筆數成正比。
+結果存成四捨五入到兩位小數的 float，輸出格式與原本逐列計算的版本完全相同（字串，保留兩位小數）。
+"""
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from twse_cache import JsonFileStore
+
+DEFAULT_MA_PERIODS = (5, 10, 20)
+MAX_MA_PERIOD = 240
+
+# 額外指標與其輸出欄位
+EXTRA_INDICATORS = {
+    'RSI': ['RSI'],
+    'MACD': ['DIF', 'MACD', 'OSC'],
+    'KD': ['K值', 'D值'],
+    'BB': ['布林上軌', '布林中軌', '布林下軌'],
+}
+
+VOLUME_COLUMNS = ['量變化率(%)', '量比', '成交量(億股)']
+VOLUME_PERIOD = 5
+
+RSI_PERIOD = 14
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+KD_PERIOD = 9
+BB_PERIOD, BB_WIDTH = 20, 2
+
+IndicatorConfig = namedtuple('IndicatorConfig', ['ma_periods', 'extra'])
+DEFAULT_CONFIG = IndicatorConfig(DEFAULT_MA_PERIODS, ())
+
+
+def parse_indicator_config(options):
+    """解析請求中的 indicators 設定：{'maPeriods': [5, 10, 20], 'extra': ['RSI', 'MACD', 'KD', 'BB']}"""
+    if not options:
+        return DEFAULT_CONFIG
+
+    ma_periods = options.get('maPeriods', DEFAULT_MA_PERIODS)
+    try:
+        ma_periods = tuple(sorted({int(p) for p in ma_periods}))
+    except (TypeError, ValueError):
+        raise ValueError('maPeriods 必須是整數清單')
+    if any(p < 2 or p > MAX_MA_PERIOD for p in ma_periods):
+        raise ValueError(f'移動平均天數需介於 2 到 {MAX_MA_PERIOD} 之間')
+
+    extra = [name.upper() for name in options.get('extra', [])]
+    unknown = [name for name in extra if name not in EXTRA_INDICATORS]
+    if unknown:
+        raise ValueError(f'不支援的指標：{", ".join(unknown)}（可用：{", ".join(EXTRA_INDICATORS)}）')
+
+    return IndicatorConfig(ma_periods, tuple(name for name in EXTRA_INDICATORS if name in extra))
+
+
+def indicator_columns(config):
+    """技術指標的輸出欄位（依順序）"""
+    columns = [f'MA{p}' for p in config.ma_periods]
+    for name in config.extra:
+        columns += EXTRA_INDICATORS[name]
+    return columns
+
+
+def technical_columns(config):
+    """technical 類別輸出的所有欄位"""
+    return ['漲跌幅(%)'] + indicator_columns(config)
+
+
+def max_window(config):
+    """移動視窗型指標最長需要往前看的列數（含當日）"""
+    windows = list(config.ma_periods) + [VOLUME_PERIOD]
+    if 'BB' in config.extra:
+        windows.append(BB_PERIOD)
+    return max(windows)
+
+
+def warmup_days(config, data_types):
+    """計算指標前需要額外抓取的交易日數，讓查詢區間第一天就有完整的指標值
+
+    遞迴型指標（RSI、MACD、KD）理論上需要無限長的歷史，這裡取足夠收斂的長度。
+    """
+    days = 0
+    if 'technical' in data_types:
+        days = max(config.ma_periods) - 1
+        if 'RSI' in config.extra:
+            days = max(days, RSI_PERIOD * 5)
+        if 'MACD' in config.extra:
+            days = max(days, MACD_SLOW * 3 + MACD_SIGNAL)
+        if 'KD' in config.extra:
+            days = max(days, KD_PERIOD * 4)
+        if 'BB' in config.extra:
+            days = max(days, BB_PERIOD - 1)
+    if 'volume' in data_types:
+        days = max(days, VOLUME_PERIOD)
+    return days
+
+
+def parse_column(values):
+    """欄位值轉成 float 陣列：數值直接使用，證交所的數字字串（如 '1,234.56'）才解析，缺值或無法解析時為 NaN"""
+    try:
+        return np.array([np.nan if value is None else value for value in values], dtype=float)
+    except (TypeError, ValueError):
+        pass
+    parsed = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        if value is None:
+            continue
+        try:
+            parsed[i] = float(value.replace(',', '')) if isinstance(value, str) else value
+        except ValueError:
+            pass
+    return parsed
+
+
+def round_column(values, valid=None):
+    """四捨五入到兩位小數的 float 欄位（輸出時格式化為兩位小數的字串），無效的位置為 None"""
+    if valid is None:
+        valid = ~np.isnan(values)
+    return [round(v, 2) if ok else None for v, ok in zip(values.tolist(), valid.tolist())]
+
+
+def window_valid(values, period):
+    """第 i 列往前 period 列（含）是否都有值"""
+    valid = np.zeros(len(values), dtype=bool)
+    if len(values) < period:
+        return valid
+    missing = np.concatenate(([0], np.cumsum(np.isnan(values))))
+    valid[period - 1:] = (missing[period:] - missing[:-period]) == 0
+    return valid
+
+
+def rolling_sum(values, period, scale):
+    """以整數累加和計算移動加總（values * scale 需為整數），回傳整數陣列；第 i 個為第 i 列結尾的加總"""
+    scaled = np.rint(np.nan_to_num(values) * scale).astype(np.int64)
+    total = np.concatenate(([0], np.cumsum(scaled)))
+    sums = np.zeros(len(values), dtype=np.int64)
+    sums[period - 1:] = total[period:] - total[:-period]
+    return sums
+
+
+def on_grid(values, scale):
+    """values 是否都能以 scale 倍的整數精確表示（價格到分、股數到股）"""
+    finite = values[~np.isnan(values)]
+    scaled = finite * scale
+    return bool(np.all(np.abs(scaled - np.rint(scaled)) < 1e-6)) and bool(np.all(np.abs(scaled) < 2 ** 52))
+
+
+def moving_average(values, period):
+    """移動平均，回傳 (平均值, 是否有效)"""
+    valid = window_valid(values, period)
+    averages = np.full(len(values), np.nan)
+    if not valid.any():
+        return averages, valid
+
+    scale = 100 if on_grid(values, 100) else None
+    if scale is None:
+        # 價格不在 0.01 的格點上時，退回逐窗加總
+        for i in np.flatnonzero(valid):
+            averages[i] = sum(values[i - period + 1:i + 1].tolist()) / period
+        return averages, valid
+
+    sums = rolling_sum(values, period, scale)
+    averages[valid] = sums[valid] / (scale * period)
+
+    # 平均值剛好落在兩位小數的進位邊界時，四捨五入結果取決於浮點加總的誤差，
+    # 這些位置改用與原本相同的逐筆加總，確保輸出完全一致
+    ties = valid & ((2 * sums) % (2 * period) == period)
+    for i in np.flatnonzero(ties):
+        averages[i] = sum(values[i - period + 1:i + 1].tolist()) / period
+
+    return averages, valid
+
+
+def macd(closes, start=0, seed=None):
+    """MACD：DIF = EMA12 - EMA26，MACD = DIF 的 EMA9，OSC = DIF - MACD
+
+    只處理 start 之後有收盤價的列，seed 為 start 前一列的 EMA 狀態；回傳 (DIF, MACD, OSC, 新狀態)。
+    """
+    state = dict(seed or {'count': 0, 'fast': 0.0, 'slow': 0.0, 'signal': 0.0})
+    fast_alpha = 2 / (MACD_FAST + 1)
+    slow_alpha = 2 / (MACD_SLOW + 1)
+    signal_alpha = 2 / (MACD_SIGNAL + 1)
+
+    dif_values = np.full(len(closes), np.nan)
+    signal_values = np.full(len(closes), np.nan)
+    count, fast, slow, signal = state['count'], state['fast'], state['slow'], state['signal']
+    for i in np.flatnonzero(~np.isnan(closes[start:])) + start:
+        close = float(closes[i])
+        if count == 0:
+            fast = slow = close
+        else:
+            fast = fast + fast_alpha * (close - fast)
+            slow = slow + slow_alpha * (close - slow)
+        dif = fast - slow
+        signal = dif if count == 0 else signal + signal_alpha * (dif - signal)
+        count += 1
+
+        # 慢線尚未穩定前不輸出
+        if count >= MACD_SLOW:
+            dif_values[i] = dif
+        if count >= MACD_SLOW + MACD_SIGNAL - 1:
+            signal_values[i] = signal
+
+    state.update(count=count, fast=fast, slow=slow, signal=signal)
+    return dif_values, signal_values, dif_values - signal_values, state
+
+
+def rsi(closes, start=0, seed=None, period=RSI_PERIOD):
+    """RSI（Wilder 平滑）；start、seed 的意義同 macd"""
+    state = dict(seed or {'count': 0, 'prev': 0.0, 'gain': 0.0, 'loss': 0.0})
+    values = np.full(len(closes), np.nan)
+    count, prev, gain, loss = state['count'], state['prev'], state['gain'], state['loss']
+    for i in np.flatnonzero(~np.isnan(closes[start:])) + start:
+        close = float(closes[i])
+        if count > 0:
+            delta = close - prev
+            up, down = max(delta, 0.0), max(-delta, 0.0)
+            if count <= period:
+                # 前 period 天先累加，滿 period 天時取平均
+                gain += up
+                loss += down
+                if count == period:
+                    gain /= period
+                    loss /= period
+            else:
+                gain = (gain * (period - 1) + up) / period
+                loss = (loss * (period - 1) + down) / period
+            if count >= period:
+                values[i] = 100.0 if loss == 0 else 100 - 100 / (1 + gain / loss)
+        prev = close
+        count += 1
+
+    state.update(count=count, prev=prev, gain=gain, loss=loss)
+    return values, state
+
+
+def kd(closes, highs, lows, start=0, seed=None, period=KD_PERIOD):
+    """KD 隨機指標：RSV 取 9 日高低點，K、D 以 1/3 權重平滑，初始值 50
+
+    start 之前的列只用來計算 RSV 的高低點；回傳 (K, D, 新狀態)。
+    """
+    state = dict(seed or {'count': 0, 'k': 50.0, 'd': 50.0})
+    k_values = np.full(len(closes), np.nan)
+    d_values = np.full(len(closes), np.nan)
+
+    positions = np.flatnonzero(~(np.isnan(closes) | np.isnan(highs) | np.isnan(lows)))
+    first_new = bisect_left(positions.tolist(), start)
+    if len(positions) >= period:
+        highest = sliding_window_view(highs[positions], period).max(axis=1)
+        lowest = sliding_window_view(lows[positions], period).min(axis=1)
+        spread = highest - lowest
+        rsv = np.where(spread > 0, (closes[positions][period - 1:] - lowest) / np.where(spread > 0, spread, 1) * 100, 50.0)
+    else:
+        rsv = np.array([])
+
+    count, k, d = state['count'], state['k'], state['d']
+    for j in range(first_new, len(positions)):
+        count += 1
+        if count >= period:
+            # 前導資料足夠時，第 j 個有效列的 RSV 位於 rsv[j - period + 1]
+            value = float(rsv[j - period + 1])
+            k = k * 2 / 3 + value / 3
+            d = d * 2 / 3 + k / 3
+            k_values[positions[j]], d_values[positions[j]] = k, d
+
+    state.update(count=count, k=k, d=d)
+    return k_values, d_values, state
+
+
+def bollinger(closes, period=BB_PERIOD, width=BB_WIDTH):
+    """布林通道：中軌為移動平均，上下軌為中軌 ± width 倍標準差（母體）"""
+    middle, valid = moving_average(closes, period)
+    upper = np.full(len(closes), np.nan)
+    lower = np.full(len(closes), np.nan)
+    if valid.any():
+        windows = sliding_window_view(np.nan_to_num(closes), period)
+        std = windows.std(axis=1)
+        ends = np.flatnonzero(valid)
+        upper[ends] = middle[ends] + width * std[ends - period + 1]
+        lower[ends] = middle[ends] - width * std[ends - period + 1]
+    return upper, middle, lower, valid
+
+
+def read_arrays(frame, config):
+    """一次解析指標需要的欄位"""
+    arrays = {
+        'close': parse_column(frame.column('收盤價')),
+        'change': parse_column(frame.column('漲跌價差')),
+        'volume': parse_column(frame.column('成交股數')),
+    }
+    if 'KD' in config.extra:
+        arrays['high'] = parse_column(frame.column('最高價'))
+        arrays['low'] = parse_column(frame.column('最低價'))
+    return arrays
+
+
+def compute_technical(arrays, config, start=0, seeds=None):
+    """計算漲跌幅、移動平均線與額外指標
+
+    start 之前的列只作為移動視窗的前導資料，seeds 為遞迴型指標在 start 前一列的狀態。
+    回傳 ({欄位: start 之後的值}, 新的 seeds)。
+    """
+    seeds = dict(seeds or {})
+    closes = arrays['close']
+    changes = arrays['change']
+    columns = {}
+
+    # 漲跌幅(%) = 漲跌價差 / (收盤價 - 漲跌價差) × 100
+    base = closes - changes
+    valid = ~np.isnan(base) & (base != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_pct = (changes / base) * 100
+    columns['漲跌幅(%)'] = round_column(change_pct[start:], valid[start:])
+
+    # 移動平均線
+    for period in config.ma_periods:
+        averages, valid = moving_average(closes, period)
+        columns[f'MA{period}'] = round_column(averages[start:], valid[start:])
+
+    if 'RSI' in config.extra:
+        values, seeds['RSI'] = rsi(closes, start, seeds.get('RSI'))
+        columns['RSI'] = round_column(values[start:])
+
+    if 'MACD' in config.extra:
+        *values, seeds['MACD'] = macd(closes, start, seeds.get('MACD'))
+        for name, column in zip(EXTRA_INDICATORS['MACD'], values):
+            columns[name] = round_column(column[start:])
+
+    if 'KD' in config.extra:
+        *values, seeds['KD'] = kd(closes, arrays['high'], arrays['low'], start, seeds.get('KD'))
+        for name, column in zip(EXTRA_INDICATORS['KD'], values):
+            columns[name] = round_column(column[start:])
+
+    if 'BB' in config.extra:
+        upper, middle, lower, valid = bollinger(closes)
+        for name, column in zip(EXTRA_INDICATORS['BB'], (upper, middle, lower)):
+            columns[name] = round_column(column[start:], valid[start:])
+
+    return columns, seeds
+
+
+def compute_volume(arrays, start=0):
+    """計算量變化率、量比（5日平均量）與成交量(億股)，回傳 start 之後的欄位值"""
+    volumes = arrays['volume']
+    has_volume = ~np.isnan(volumes)
+    columns = {}
+
+    # 量變化率（與前一日比較）
+    previous = np.concatenate(([np.nan], volumes[:-1]))
+    change_valid = has_volume & ~np.isnan(previous) & (previous != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vol_change = ((volumes - previous) / previous) * 100
+    columns['量變化率(%)'] = round_column(vol_change[start:], change_valid[start:])
+
+    # 量比 = 今日成交量 / 近5日平均成交量（股數為整數，累加和是精確的）
+    ratio_valid = window_valid(volumes, VOLUME_PERIOD)
+    averages = np.full(len(volumes), np.nan)
+    if on_grid(volumes, 1):
+        averages[ratio_valid] = rolling_sum(volumes, VOLUME_PERIOD, 1)[ratio_valid] / VOLUME_PERIOD
+    else:
+        for i in np.flatnonzero(ratio_valid):
+            averages[i] = sum(volumes[i - VOLUME_PERIOD + 1:i + 1].tolist()) / VOLUME_PERIOD
+    ratio_valid &= averages != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vol_ratio = volumes / averages
+    columns['量比'] = round_column(vol_ratio[start:], ratio_valid[start:])
+
+    # 成交量(億股)：簡化計算，實際應該用實際流通股數
+    columns['成交量(億股)'] = round_column(volumes[start:] / 100000000, has_volume[start:])
+
+    return columns
+
+
+def technical_indicators(frame, config=DEFAULT_CONFIG):
+    """計算漲跌幅、移動平均線與額外指標，寫回資料表"""
+    if len(frame):
+        columns, _ = compute_technical(read_arrays(frame, config), config)
+        for name, values in columns.items():
+            frame.set_column(name, values)
+    return frame
+
+
+def volume_analysis(frame):
+    """計算量變化率、量比（5日平均量）與成交量(億股)，寫回資料表"""
+    if len(frame):
+        for name, values in compute_volume(read_arrays(frame, DEFAULT_CONFIG)).items():
+            frame.set_column(name, values)
+    return frame
+
+
+def context_rows(arrays, start, config):
+    """增量計算時，start 之前需要保留的前導列起點；資料不足時回傳 None"""
+    context = start - max_window(config)
+    if 'KD' in config.extra:
+        valid = ~(np.isnan(arrays['close'][:start]) | np.isnan(arrays['high'][:start]) | np.isnan(arrays['low'][:start]))
+        positions = np.flatnonzero(valid)
+        if len(positions) >= KD_PERIOD - 1:
+            context = min(context, int(positions[len(positions) - (KD_PERIOD - 1)]))
+        else:
+            context = -1
+    return context if context >= 0 else None
+
+
+def history_start(frame, config):
+    """增量計算之後的交易日需要保留的最早日期（移動視窗與 KD 的前導列）；資料不足時回傳第一個日期"""
+    if not len(frame):
+        return None
+    context = context_rows(read_arrays(frame, config), len(frame), config)
+    return frame.dates[context or 0]
+
+
+class IndicatorStateStore(JsonFileStore):
+    """每檔股票、每種指標設定的計算結果與遞迴狀態
+
+    已計算過的交易日直接沿用，查詢區間往後延伸時只計算新增的交易日。
+    """
+
+    @staticmethod
+    def _signature(config):
+        signature = 'ma' + '-'.join(str(p) for p in config.ma_periods)
+        if config.extra:
+            signature += '_' + '-'.join(config.extra)
+        return signature
+
+    def get(self, stock_code, config):
+        return self._read((stock_code, self._signature(config)))
+
+    def put(self, stock_code, config, state):
+        self._write((stock_code, self._signature(config)), state)
+
+
+class MemoryStateStore:
+    """只存在記憶體的指標狀態（例如串流輸出時在各批次之間接續計算）"""
+
+    def __init__(self):
+        self._states = {}
+
+    def get(self, stock_code, config):
+        return self._states.get((stock_code, config))
+
+    def put(self, stock_code, config, state):
+        self._states[(stock_code, config)] = state
+
+
+def input_fingerprints(arrays):
+    """每列指標輸入值（收盤價、漲跌價差、成交股數等）的指紋，沿用 state 前確認輸入資料與計算時相同"""
+    matrix = np.column_stack([arrays[name] for name in sorted(arrays)])
+    matrix = np.where(np.isnan(matrix), -np.inf, matrix)   # NaN 的位元表示不唯一
+    return [zlib.crc32(row.tobytes()) for row in matrix]
+
+
+def _reusable_from(state, frame, output_start, fingerprints):
+    """state 可沿用時回傳第一個新交易日在 frame 中的位置，否則回傳 None"""
+    if not state or not state['dates'] or output_start < state['valid_from'] or 'inputs' not in state:
+        return None
+
+    dates = state['dates']
+    first = bisect_left(frame.dates, state['valid_from'])
+    upto = min(dates[-1], frame.dates[-1])
+    last = bisect_right(frame.dates, upto)
+    if first >= last:
+        return None
+
+    # frame 與 state 重疊的交易日必須完全相同（沒有新增或缺少的列）
+    overlap = frame.dates[first:last]
+    begin = bisect_left(dates, overlap[0])
+    if dates[begin:bisect_right(dates, upto)] != overlap:
+        return None
+    # 重疊的交易日的輸入值也必須相同（例如先前的查詢沒有股價資料時，指標全為空值，不能沿用）
+    if state['inputs'][begin:begin + len(overlap)] != fingerprints[first:last]:
+        return None
+    return last
+
+
+def apply_indicators(frame, data_types, config=DEFAULT_CONFIG, store=None, output_start=None, persist=True):
+    """依 data_types 計算 technical、volume 指標並寫回資料表（frame 需已排序）
+
+    output_start 之前的列只是暖機用的歷史資料。有 store 時沿用先前的計算結果，
+    只對新增的交易日做增量計算；persist 為 False 時（例如部分月份抓取失敗）不更新 store。
+    """
+    want_technical = 'technical' in data_types
+    want_volume = 'volume' in data_types
+    if not len(frame) or not (want_technical or want_volume):
+        return frame
+
+    output_start = output_start or frame.dates[0]
+    arrays = read_arrays(frame, config)
+    # 沒有股價資料（例如只查詢三大法人與技術指標）時指標全為空值，不讀取也不保存 state
+    if np.isnan(arrays['close']).all() and np.isnan(arrays['volume']).all():
+        store = None
+    fingerprints = input_fingerprints(arrays)
+    state = store.get(frame.stock_code, config) if store else None
+    start = _reusable_from(state, frame, output_start, fingerprints)
+    context = context_rows(arrays, start, config) if start is not None and start < len(frame) else 0
+
+    if start is None or context is None:
+        # 沒有可沿用的狀態：整段計算，只保留 output_start 之後的結果
+        columns, seeds = compute_technical(arrays, config)
+        columns.update(compute_volume(arrays))
+        keep = bisect_left(frame.dates, output_start)
+        state = {
+            'valid_from': output_start,
+            'dates': frame.dates[keep:],
+            'inputs': fingerprints[keep:],
+            'columns': {name: values[keep:] for name, values in columns.items()},
+            'seeds': seeds
+        }
+        changed = True
+    elif start < len(frame):
+        # 只計算新增的交易日，前導資料與遞迴狀態接續先前的結果
+        # （複製一份再修改，store 記憶體中的 state 只在 persist 時更新）
+        state = dict(state, columns=dict(state['columns']))
+        sub_arrays = {name: values[context:] for name, values in arrays.items()}
+        columns, seeds = compute_technical(sub_arrays, config, start - context, state['seeds'])
+        columns.update(compute_volume(sub_arrays, start - context))
+        state['dates'] = state['dates'] + frame.dates[start:]
+        state['inputs'] = state['inputs'] + fingerprints[start:]
+        for name, values in columns.items():
+            state['columns'][name] = state['columns'][name] + values
+        state['seeds'] = seeds
+        changed = True
+    else:
+        changed = False
+
+    if store and persist and changed:
+        store.put(frame.stock_code, config, state)
+
+    positions = {date_str: i for i, date_str in enumerate(state['dates'])}
+    lookup = [positions.get(date_str) for date_str in frame.dates]
+    names = (technical_columns(config) if want_technical else []) + (VOLUME_COLUMNS if want_volume else [])
+    for name in names:
+        values = state['columns'][name]
+        frame.set_column(name, [None if i is None else values[i] for i in lookup])
+    return frame
@@ -0,0 +1,216 @@
+"""背景工作佇列
+
+需要大量上游請求的查詢不在 HTTP 請求中等待（避免超過 gunicorn worker 的逾時），
+改為排入背景執行緒依序執行，前端以工作代碼查詢各階段進度並下載結果。
+
+每個工作存成磁碟上的檔案（root/<id>.json 為狀態與查詢內容，root/<id>.result.json 為結果），
+多個 worker 都能查詢狀態與下載結果；程序重新啟動後，resume() 會接續尚未完成的工作
+（已抓取的資料在倉儲與快取中，接續時只需要請求剩下的部分）。
+執行中與排隊中的工作持有 root/<id>.lock 的檔案鎖，避免多個 worker 重複執行同一個工作。
+完成的工作保留 ttl 秒，之後自動清除。
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# 執行中的進度最多每隔幾秒寫入磁碟一次
+SAVE_INTERVAL = 1.0
+
+
+def _timestamp(seconds):
+    return datetime.fromtimestamp(seconds).isoformat(timespec='seconds') if seconds else None
+
+
+def _percent(done, total):
+    return round(done * 100 / total, 1) if total else 100.0
+
+
+class JobQueue:
+    """在背景執行緒執行工作
+
+    runner(params, report) 依查詢內容執行並回傳 (回應內容, HTTP 狀態碼)，
+    執行期間以 report(階段, 完成數, 總數) 回報各階段的進度。
+    """
+
+    def __init__(self, root, max_workers=1, ttl=24 * 3600):
+        self.root = os.path.abspath(root)
+        self.ttl = ttl
+        self.runner = None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()    # 這個程序排入的工作（id -> 狀態）
+        self._locks = {}              # id -> 持有檔案鎖的檔案
+        self._saved = {}              # id -> 上次寫入磁碟的時間
+        self._resumed = False
+
+    def _names(self):
+        """工作目錄中的檔名（目錄在第一次排入工作時才建立）"""
+        try:
+            return os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+
+    def _path(self, job_id, suffix='.json'):
+        return os.path.join(self.root, f'{job_id}{suffix}')
+
+    def result_path(self, job_id):
+        return self._path(job_id, '.result.json')
+
+    def _write(self, path, data):
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def _save(self, job, force=True):
+        now = time.time()
+        if force or now - self._saved.get(job['id'], 0) >= SAVE_INTERVAL:
+            self._saved[job['id']] = now
+            self._write(self._path(job['id']), job)
+
+    def _claim(self, job_id):
+        """取得工作的檔案鎖；其他程序正在執行（或排隊）時回傳 False"""
+        lock_file = open(self._path(job_id, '.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._locks[job_id] = lock_file
+        return True
+
+    def _release(self, job_id):
+        lock_file = self._locks.pop(job_id, None)
+        if lock_file:
+            lock_file.close()
+
+    def submit(self, params, calls=None):
+        """排入工作並回傳工作資訊；params 為查詢內容（需可序列化為 JSON），calls 為預估的上游請求數"""
+        job = {'id': uuid.uuid4().hex[:16], 'status': 'queued', 'params': params, 'calls': calls,
+               'submitted': time.time(), 'started': None, 'finished': None, 'resumed': 0,
+               'stages': OrderedDict(), 'http_status': None, 'error': None}
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            self._expire()
+            self._claim(job['id'])
+            self._jobs[job['id']] = job
+            self._save(job)
+        self._executor.submit(self._run, job)
+        return self.info(job)
+
+    def resume(self):
+        """接續上次程序結束時尚未完成的工作（只在第一次呼叫時掃描），回傳接續的工作代碼"""
+        with self._lock:
+            if self._resumed:
+                return []
+            self._resumed = True
+            resumed = []
+            for name in sorted(self._names()):
+                if not name.endswith('.json') or name.endswith('.result.json'):
+                    continue
+                job = self._load(name[:-len('.json')])
+                if not job or job['status'] not in ('queued', 'running') or job['id'] in self._jobs:
+                    continue
+                if not self._claim(job['id']):
+                    continue
+                job.update(status='queued', started=None, resumed=job.get('resumed', 0) + 1)
+                self._jobs[job['id']] = job
+                self._save(job)
+                resumed.append(job)
+
+        for job in sorted(resumed, key=lambda job: job['submitted']):
+            print(f"Resuming job {job['id']}")
+            self._executor.submit(self._run, job)
+        return [job['id'] for job in resumed]
+
+    def _run(self, job):
+        job['status'] = 'running'
+        job['started'] = time.time()
+        self._save(job)
+
+        def report(stage, done, total):
+            job['stages'][stage] = {'done': done, 'total': total}
+            self._save(job, force=False)
+
+        try:
+            result, job['http_status'] = self.runner(job['params'], report)
+            self._write(self.result_path(job['id']), result)
+            job['status'] = 'done'
+        except Exception as e:
+            print(f"Job {job['id']} failed: {e}")
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        job['finished'] = time.time()
+        with self._lock:
+            self._save(job)
+            self._saved.pop(job['id'], None)
+            self._release(job['id'])
+
+    def _load(self, job_id):
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f, object_pairs_hook=OrderedDict)
+        except (OSError, ValueError):
+            return None
+
+    def _expire(self):
+        """刪除完成超過 ttl 秒的工作"""
+        cutoff = time.time() - self.ttl
+        for name in self._names():
+            if not name.endswith('.json') or name.endswith('.result.json'):
+                continue
+            job_id = name[:-len('.json')]
+            job = self._jobs.get(job_id) or self._load(job_id)
+            if job and job['finished'] and job['finished'] < cutoff:
+                self._jobs.pop(job_id, None)
+                for suffix in ('.json', '.result.json', '.lock'):
+                    try:
+                        os.remove(self._path(job_id, suffix))
+                    except OSError:
+                        pass
+
+    def get(self, job_id):
+        """工作狀態；這個程序執行中的工作讀記憶體（最新進度），其餘讀磁碟"""
+        if not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._load(job_id)
+
+    def position(self, job):
+        """排在前面、尚未開始的工作數（只計算這個程序的佇列）"""
+        with self._lock:
+            return sum(1 for other in self._jobs.values()
+                       if other['status'] == 'queued' and other['submitted'] < job['submitted'])
+
+    def info(self, job):
+        """對外回報的工作資訊（不含結果）：各階段與整體的完成百分比"""
+        stages = job['stages']
+        done = sum(stage['done'] for stage in stages.values())
+        total = sum(stage['total'] for stage in stages.values())
+        info = OrderedDict([
+            ('id', job['id']),
+            ('status', job['status']),
+            ('calls', job['calls']),
+            ('progress', OrderedDict([
+                ('percent', 100.0 if job['status'] == 'done' else _percent(done, total) if total else 0.0),
+                ('stages', OrderedDict((name, _percent(stage['done'], stage['total']))
+                                       for name, stage in stages.items()))
+            ])),
+            ('submittedAt', _timestamp(job['submitted'])),
+            ('startedAt', _timestamp(job['started'])),
+            ('finishedAt', _timestamp(job['finished']))
+        ])
+        if job['status'] == 'queued':
+            info['position'] = self.position(job)
+        if job.get('resumed'):
+            info['resumed'] = job['resumed']
+        if job['error']:
+            info['error'] = job['error']
+        return info
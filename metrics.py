@@ -0,0 +1,169 @@
+"""執行指標（Prometheus 文字格式）
+
+計數器（Counter）與直方圖（Histogram）都以標籤區分，由 render() 輸出 /metrics 的內容。
+stage() 量測各處理階段的耗時：除了記入直方圖，也累計到目前執行緒的請求計時（begin_request() 開始、
+request_timings() 取出），用來產生回應的 Server-Timing 標頭。
+
+指標保存在各程序的記憶體中，多個 gunicorn worker 時每次抓取只會看到其中一個 worker 的數字
+（Prometheus 以 instance 區分時請讓每個 worker 監聽不同的埠，或以 rate() 觀察趨勢）。
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# 預設的延遲直方圖區間（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = OrderedDict()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(str(labels[name]) for name in self.labels), 0)
+
+    def samples(self):
+        """[(標籤值, 數值)]"""
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = OrderedDict()   # 標籤 -> [各區間的次數, 總和, 次數]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            entry = self._values.get(tuple(str(labels[name]) for name in self.labels))
+            return entry[2] if entry else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (bucket_counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    labels = _format_labels(self.labels, key, [('le', _format_value(float(bound)))])
+                    lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", "+Inf")])} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._collectors = []
+
+    def counter(self, name, help_text, labels=()):
+        return self._metrics.setdefault(name, Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._metrics.setdefault(name, Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, collect):
+        """collect() 回傳 [(名稱, 說明, [({標籤: 值}, 數值)])]，於輸出時計算（gauge）"""
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        for collect in self._collectors:
+            for name, help_text, samples in collect():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    'stock_api_stage_seconds', '各處理階段的耗時（plan、fetch、indicators、reorder、serialize）', ['stage'])
+
+_local = threading.local()
+
+
+def begin_request():
+    """開始記錄目前執行緒的請求計時（供 Server-Timing 使用）"""
+    _local.timings = OrderedDict()
+    return _local.timings
+
+
+def request_timings():
+    """目前請求各階段累計的秒數；沒有進行中的請求時回傳 None"""
+    return getattr(_local, 'timings', None)
+
+
+def end_request():
+    _local.timings = None
+
+
+@contextmanager
+def stage(name):
+    """量測一個處理階段的耗時"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = request_timings()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def server_timing(timings, total=None):
+    """Server-Timing 標頭的內容（毫秒）"""
+    entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items()]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
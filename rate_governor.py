@@ -0,0 +1,267 @@
+"""證交所請求的全域速率控制（同一個程序的所有執行緒與多個 gunicorn worker 共用）
+
+證交所對短時間內請求過多的 IP 會暫時封鎖（回傳 HTML 頁面），封鎖期間所有查詢都會失敗：
+
+- 每個端點一個 token bucket：每秒補充 rate 個、最多累積 burst 個
+- 優先順序：interactive（使用者查詢）可以用完整個 bucket；backfill（背景工作、回補、盤後預先抓取）
+  只在 bucket 超過保留量 reserve 時取用，使用者查詢來的時候總有 token 可用
+- 自適應：收到限流回應時所有端點的速率減半並暫停 pause 秒，之後每次成功回應逐步恢復（AIMD），
+  維持在不被限流的最高速率
+- 斷路器：連續 failure_threshold 次失敗後暫停所有請求 cooldown 秒（試探失敗時加倍，最多 max_cooldown），
+  暫停期間的請求立即失敗，不再延長封鎖；之後只放行一個試探請求，成功才恢復
+
+狀態存在 state_path：固定格式的二進位檔，以 mmap 映射到各程序的記憶體，讀寫時以 fcntl 鎖定
+（每次只需一次 flock，不重新開檔、解析與寫回）；state_path 為 None 時只在程序內共用。
+"""
+import asyncio
+import contextvars
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+PRIORITIES = ('interactive', 'backfill')
+
+# 目前執行中的請求的優先順序（FetchScheduler 會把呼叫端的設定帶進執行緒池）
+_priority = contextvars.ContextVar('twse_priority', default='interactive')
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextmanager
+def request_priority(priority):
+    """在這個區塊內送出的證交所請求使用 priority（interactive 或 backfill）"""
+    if priority not in PRIORITIES:
+        raise ValueError(f'不支援的優先順序：{priority}')
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+# 共用狀態檔的格式：標頭（識別碼、端點清單的雜湊與共用的欄位），之後每個端點一個 bucket（是否有值、token 數、更新時間）
+STATE_MAGIC = 0x54575345
+STATE_HEADER = struct.Struct('<IIddqqddqq')
+STATE_BUCKET = struct.Struct('<ddd')
+
+
+class CircuitOpen(Exception):
+    """斷路器開啟中，請求沒有送出"""
+
+
+class RateLimited(Exception):
+    """需要等待的時間超過上限，請求沒有送出"""
+
+
+class RateGovernor:
+    """所有證交所請求共用的速率控制；rates 為 {端點: 每秒請求數上限}"""
+
+    def __init__(self, rates, burst=5, reserve=2, state_path=None, decrease=0.5, recover=0.02,
+                 min_factor=1 / 16, pause=10, failure_threshold=5, cooldown=30, max_cooldown=600,
+                 probe_timeout=30, clock=time.time):
+        self.rates = dict(rates)
+        self.burst = burst
+        self.reserved = min(reserve, burst - 1)
+        self.state_path = state_path
+        self.decrease = decrease
+        self.recover = recover
+        self.min_factor = min_factor
+        self.pause = pause
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._endpoints = sorted(self.rates)
+        self._layout = zlib.crc32(','.join(self._endpoints).encode('utf-8'))
+        self._file = None
+        self._map = None
+        self._pid = None
+        self._memory = None
+
+    def _initial(self):
+        return {
+            'factor': 1.0,              # 速率倍數（限流時減半，成功時逐步恢復到 1）
+            'paused_until': 0.0,        # 限流後暫停到這個時間
+            'buckets': {},              # 端點 -> [token 數, 更新時間]
+            'failures': 0,              # 連續失敗次數
+            'tripped': False,           # 斷路器是否開啟（或試探中）
+            'open_until': 0.0,          # 斷路器開啟到這個時間（試探中為試探的逾時時間）
+            'cooldown': self.cooldown,  # 下一次開啟的秒數
+            'throttled': 0,
+            'rejected': 0
+        }
+
+    @contextmanager
+    def _state(self):
+        """鎖定並讀取狀態，區塊結束時寫回"""
+        with self._lock:
+            if self.state_path is None:
+                if self._memory is None:
+                    self._memory = self._initial()
+                yield self._memory
+                return
+
+            state_file, view = self._shared()
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            try:
+                state = self._load(view)
+                yield state
+                self._dump(view, state)
+            finally:
+                fcntl.flock(state_file, fcntl.LOCK_UN)
+
+    def _shared(self):
+        """開啟並映射共用的狀態檔；fork 後重新開啟（flock 屬於開啟的檔案，共用描述子的程序之間不會互斥）"""
+        if self._map is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+            size = STATE_HEADER.size + STATE_BUCKET.size * len(self._endpoints)
+            state_file = open(self.state_path, 'a+b')
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            try:
+                # 新的檔案（或舊格式、端點不同的檔案）調整成固定大小，識別碼不符時由 _load 重新初始化
+                if os.fstat(state_file.fileno()).st_size != size:
+                    state_file.truncate(size)
+            finally:
+                fcntl.flock(state_file, fcntl.LOCK_UN)
+            self._file, self._map, self._pid = state_file, mmap.mmap(state_file.fileno(), size), os.getpid()
+        return self._file, self._map
+
+    def _load(self, view):
+        (magic, layout, factor, paused_until, failures, tripped, open_until, cooldown, throttled,
+         rejected) = STATE_HEADER.unpack_from(view, 0)
+        if magic != STATE_MAGIC or layout != self._layout:
+            return self._initial()
+        buckets = {}
+        for index, endpoint in enumerate(self._endpoints):
+            present, tokens, updated = STATE_BUCKET.unpack_from(view, STATE_HEADER.size + index * STATE_BUCKET.size)
+            if present:
+                buckets[endpoint] = [tokens, updated]
+        return {'factor': factor, 'paused_until': paused_until, 'buckets': buckets, 'failures': failures,
+                'tripped': bool(tripped), 'open_until': open_until, 'cooldown': cooldown,
+                'throttled': throttled, 'rejected': rejected}
+
+    def _dump(self, view, state):
+        STATE_HEADER.pack_into(view, 0, STATE_MAGIC, self._layout, state['factor'], state['paused_until'],
+                               state['failures'], int(state['tripped']), state['open_until'], state['cooldown'],
+                               state['throttled'], state['rejected'])
+        for index, endpoint in enumerate(self._endpoints):
+            bucket = state['buckets'].get(endpoint)
+            STATE_BUCKET.pack_into(view, STATE_HEADER.size + index * STATE_BUCKET.size,
+                                   *((1.0, *bucket) if bucket else (0.0, 0.0, 0.0)))
+
+    def reserve(self, endpoint, priority='interactive'):
+        """嘗試取得一個 token，回傳 (需要等待的秒數, 是否為斷路器的試探請求)；等待秒數為 0 表示可以送出
+
+        斷路器開啟中拋出 CircuitOpen。
+        """
+        now = self.clock()
+        with self._state() as state:
+            remaining = state['open_until'] - now
+            if remaining > 0:
+                state['rejected'] += 1
+            else:
+                return self._take(state, endpoint, priority, now)
+        raise CircuitOpen(f'證交所請求暫停中（連續失敗或被限流），{remaining:.0f} 秒後再試')
+
+    def _take(self, state, endpoint, priority, now):
+        """從端點的 bucket 取一個 token（backfill 需要保留 reserve 個給使用者查詢）"""
+        # 限流後的暫停期間不累積 token，暫停結束時所有等待中的請求依速率逐一送出
+        wait = state['paused_until'] - now
+        if wait > 0:
+            return wait, False
+
+        rate = self.rates[endpoint] * state['factor']
+        tokens, updated = state['buckets'].get(endpoint, (self.burst, now))
+        tokens = min(self.burst, tokens + max(now - updated, 0) * rate)
+        need = 1 + (self.reserved if priority == 'backfill' else 0)
+        wait = 0.0 if tokens >= need else (need - tokens) / rate
+        if wait == 0:
+            tokens -= 1
+        state['buckets'][endpoint] = [tokens, max(now, updated)]
+
+        # 斷路器開啟時間已過：這個請求是試探，試探結束前其他請求繼續暫停
+        probe = wait == 0 and state['tripped']
+        if probe:
+            state['open_until'] = now + self.probe_timeout
+        return wait, probe
+
+    def acquire(self, endpoint, priority='interactive', max_wait=None, sleep=time.sleep):
+        """等待直到可以送出請求，回傳是否為試探請求；等待時間會超過 max_wait 秒時拋出 RateLimited"""
+        waited = 0.0
+        while True:
+            wait, probe = self.reserve(endpoint, priority)
+            if not wait:
+                return probe
+            if max_wait is not None and waited + wait > max_wait:
+                raise RateLimited(f'{endpoint} 請求需要等待 {waited + wait:.0f} 秒，超過上限 {max_wait} 秒')
+            sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, endpoint, priority='interactive', max_wait=None):
+        """同 acquire，等待與鎖定狀態檔時不阻塞事件迴圈"""
+        waited = 0.0
+        while True:
+            wait, probe = await asyncio.to_thread(self.reserve, endpoint, priority)
+            if not wait:
+                return probe
+            if max_wait is not None and waited + wait > max_wait:
+                raise RateLimited(f'{endpoint} 請求需要等待 {waited + wait:.0f} 秒，超過上限 {max_wait} 秒')
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def report(self, endpoint, ok, throttled=False, probe=False):
+        """回報請求結果：ok 為成功，throttled 為收到限流回應，probe 為 acquire 回傳的是否為試探請求"""
+        now = self.clock()
+        with self._state() as state:
+            if throttled:
+                state['throttled'] += 1
+                # 暫停前已送出的請求陸續回報限流時只降速一次
+                if now >= state['paused_until']:
+                    state['factor'] = max(self.min_factor, state['factor'] * self.decrease)
+                    state['paused_until'] = now + self.pause
+                    state['buckets'] = {endpoint: [0.0, state['paused_until']] for endpoint in self.rates}
+            elif ok:
+                state['factor'] = min(1.0, state['factor'] + self.recover)
+
+            if ok:
+                state['failures'] = 0
+                if state['tripped']:
+                    state.update(tripped=False, open_until=0.0, cooldown=self.cooldown)
+                return
+
+            state['failures'] += 1
+            # 試探失敗，或連續失敗達到門檻：開啟斷路器（已開啟時，開啟前送出的請求失敗不再延長）
+            if probe or (not state['tripped'] and state['failures'] >= self.failure_threshold):
+                state['tripped'] = True
+                state['open_until'] = now + state['cooldown']
+                state['cooldown'] = min(state['cooldown'] * 2, self.max_cooldown)
+                state['failures'] = 0
+
+    def stats(self):
+        """目前的速率倍數、各端點的有效速率與斷路器狀態"""
+        now = self.clock()
+        with self._state() as state:
+            if not state['tripped']:
+                circuit = 'closed'
+            elif now < state['open_until']:
+                circuit = 'open'
+            else:
+                circuit = 'half_open'
+            return {
+                'factor': round(state['factor'], 4),
+                'rates': {endpoint: round(rate * state['factor'], 3) for endpoint, rate in self.rates.items()},
+                'paused_seconds': round(max(state['paused_until'] - now, 0), 1),
+                'circuit': circuit,
+                'open_seconds': round(max(state['open_until'] - now, 0), 1) if circuit == 'open' else 0,
+                'throttled': state['throttled'],
+                'rejected': state['rejected']
+            }
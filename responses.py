@@ -0,0 +1,121 @@
+"""API 回應的序列化、壓縮與快取標頭
+
+- dumps()：有 orjson 時以 orjson 序列化（輸出與 json.dumps(ensure_ascii=False, separators=(',', ':')) 相同），
+  沒有時退回標準函式庫
+- compress()：依 Accept-Encoding 以 brotli（選用套件）或 gzip 壓縮回應
+- set_cache_headers()：ETag（內容雜湊）、Cache-Control 與 Last-Modified，搭配 make_conditional 回傳 304
+- to_columns()：資料列轉成欄位式（欄位名稱只出現一次，每個欄位一個陣列）
+"""
+import gzip
+import hashlib
+import json
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 選用套件
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - 選用套件
+    brotli = None
+
+# 小於這個大小的回應不壓縮（壓縮後的差異不值得 CPU 時間）
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# 可以壓縮的內容類型
+COMPRESSIBLE_TYPES = ('application/json', 'text/csv', 'text/plain', 'text/html', 'application/x-ndjson')
+
+# 資料列的輸出方式：records 為每列一個物件（預設），columns 為每個欄位一個陣列
+ORIENTS = ('records', 'columns')
+
+
+def dumps(data):
+    """序列化成 UTF-8 的 JSON 位元組（保持 dict 的鍵順序）"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def to_columns(records, column_order):
+    """資料列轉成 {欄位: [值, ...]}；缺值為 None，沒有任何值的欄位不輸出"""
+    columns = OrderedDict((name, [row.get(name) for row in records]) for name in column_order)
+    return OrderedDict((name, values) for name, values in columns.items()
+                       if any(value is not None for value in values))
+
+
+def from_columns(columns):
+    """欄位式資料轉回資料列（缺值的欄位不輸出）"""
+    count = len(next(iter(columns.values()), []))
+    return [OrderedDict((name, values[i]) for name, values in columns.items() if values[i] is not None)
+            for i in range(count)]
+
+
+def _accepted(accept_encoding, coding):
+    """Accept-Encoding 是否接受某種編碼（q=0 表示拒絕）"""
+    for part in accept_encoding.split(','):
+        name, *params = [item.strip() for item in part.split(';')]
+        if name.lower() != coding:
+            continue
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def choose_encoding(accept_encoding):
+    """依 Accept-Encoding 選擇壓縮方式（br 優先），不壓縮時回傳 None"""
+    accept_encoding = accept_encoding or ''
+    if brotli is not None and _accepted(accept_encoding, 'br'):
+        return 'br'
+    if _accepted(accept_encoding, 'gzip'):
+        return 'gzip'
+    return None
+
+
+def compress(response, accept_encoding):
+    """壓縮回應內容（串流、檔案回應與已壓縮的回應不處理）"""
+    if (response.direct_passthrough or response.is_streamed or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(accept_encoding)
+    body = response.get_data()
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return response
+
+    if encoding == 'br':
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def content_etag(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def set_cache_headers(response, last_modified=None, max_age=0):
+    """ETag 為內容雜湊（弱 ETag，不同壓縮方式共用）；last_modified 為資料定案的時間時（內容不會再變動）
+    加上 Last-Modified 與 max_age 秒的 Cache-Control，否則要求每次重新驗證"""
+    response.set_etag(content_etag(response.get_data()), weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+        response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
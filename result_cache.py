@@ -0,0 +1,93 @@
+"""查詢結果的記憶體快取
+
+相同的查詢（股票代碼、日期區間、資料類型、指標設定、輸出方式）直接回傳先前序列化好的回應，
+不必重新讀取倉儲、合併資料、計算指標與序列化。
+
+- 總容量以位元組數為上限，超過時依 LRU 淘汰
+- 查詢區間都已定案的結果不會再變動，只會被淘汰；包含尚未定案資料（例如今天）的結果
+  設有到期時間，並以標籤（例如 stock:2330、live）標記，抓到新的當日資料時依標籤失效
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# 每個項目額外計入的大小（鍵、標頭等物件的概略大小）
+ENTRY_OVERHEAD = 512
+
+
+class _Entry:
+    __slots__ = ('value', 'size', 'expires_at', 'tags')
+
+    def __init__(self, value, size, expires_at, tags):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.tags = tags
+
+
+class ResultCache:
+    """以位元組數限制總容量的 LRU 快取（執行緒安全）；max_bytes 為 0 時停用"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key, now=None):
+        """讀取項目，沒有或已到期時回傳 None"""
+        now = now or time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at is not None and now >= entry.expires_at:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry.value
+
+    def put(self, key, value, size, expires_at=None, tags=()):
+        """寫入項目；size 為內容的位元組數，expires_at 為到期時間（time.time()），None 表示不會到期"""
+        size += ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(value, size, expires_at, frozenset(tags))
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, tag):
+        """移除帶有 tag 標籤的項目，回傳移除的數量"""
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if tag in entry.tags]
+            for key in keys:
+                self._remove(key)
+            self._stats['invalidations'] += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(self._stats,
+                        entries=len(self._entries),
+                        bytes=self._bytes,
+                        max_bytes=self.max_bytes,
+                        hit_ratio=round(self._stats['hits'] / lookups, 4) if lookups else None)
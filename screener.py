@@ -0,0 +1,99 @@
+"""全市場選股：依三大法人買賣超與本益比、殖利率、股價淨值比篩選與排序所有上市股票
+
+每個交易日的三大法人（T86）與基本面（BWIBBU_d）全市場表（warehouse.MarketTable）合併成以股票代碼為索引的
+NumPy 陣列，篩選與排序都是整個陣列一次運算，不需要逐檔查詢。期間內的買賣超為加總，
+本益比、殖利率、股價淨值比取期間內最後一個有資料的交易日。
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+from stock_frame import format_column
+
+# 可篩選、排序的欄位：名稱 -> (端點, 倉儲欄位, 輸出欄位, 期間內的彙總方式)
+FIELDS = OrderedDict([
+    ('foreignNet', ('T86', 'foreign_net', '外資買賣超', 'sum')),
+    ('trustNet', ('T86', 'trust_net', '投信買賣超', 'sum')),
+    ('dealerNet', ('T86', 'dealer_net', '自營商買賣超', 'sum')),
+    ('totalNet', ('T86', 'total_net', '三大法人買賣超合計', 'sum')),
+    ('pe', ('BWIBBU_d', 'pe', '本益比', 'last')),
+    ('dividendYield', ('BWIBBU_d', 'dividend_yield', '殖利率(%)', 'last')),
+    ('pb', ('BWIBBU_d', 'pb', '股價淨值比', 'last')),
+])
+
+# 各端點需要讀取的倉儲欄位
+COLUMNS = OrderedDict(
+    (endpoint, [column for field_endpoint, column, _, _ in FIELDS.values() if field_endpoint == endpoint])
+    for endpoint in ('T86', 'BWIBBU_d')
+)
+
+
+def parse_filters(filters):
+    """檢查篩選條件 {欄位: {'min': 下限, 'max': 上限}}，回傳數值化的條件；格式錯誤時拋出 ValueError"""
+    if not isinstance(filters, dict):
+        raise ValueError('filters 必須是 {欄位: {"min": 下限, "max": 上限}}')
+    parsed = OrderedDict()
+    for field, bounds in filters.items():
+        if field not in FIELDS:
+            raise ValueError(f'不支援的篩選欄位：{field}（可用：{", ".join(FIELDS)}）')
+        if not isinstance(bounds, dict) or not bounds or set(bounds) - {'min', 'max'}:
+            raise ValueError(f'{field} 的條件必須是 {{"min": 下限, "max": 上限}}')
+        try:
+            parsed[field] = {bound: float(value) for bound, value in bounds.items()}
+        except (TypeError, ValueError):
+            raise ValueError(f'{field} 的上下限必須是數字')
+    return parsed
+
+
+def combine(tables):
+    """合併各交易日的全市場表 [(端點, MarketTable)]（依日期排序），回傳 (股票代碼, 股票名稱, {欄位: 陣列})"""
+    present = [(endpoint, table, np.asarray(table.codes, dtype=str)) for endpoint, table in tables if table.codes]
+    codes = (np.unique(np.concatenate([table_codes for _, _, table_codes in present])) if present
+             else np.array([], dtype=str))
+    names = np.full(len(codes), '', dtype=object)
+    values = OrderedDict((field, np.full(len(codes), np.nan)) for field in FIELDS)
+
+    for endpoint, table, table_codes in present:
+        index = np.searchsorted(codes, table_codes)
+        names[index] = table.names
+        for field, (field_endpoint, column, _, how) in FIELDS.items():
+            if field_endpoint != endpoint:
+                continue
+            day = np.array(table.columns[column], dtype=float)   # None 轉為 NaN
+            valid = ~np.isnan(day)
+            target = index[valid]
+            if how == 'sum':
+                values[field][target] = np.nan_to_num(values[field][target]) + day[valid]
+            else:
+                values[field][target] = day[valid]
+    return codes, names, values
+
+
+def screen(tables, filters=None, sort_by='foreignNet', descending=True, limit=50):
+    """篩選並排序，回傳 (前 limit 檔的欄位式資料 {輸出欄位: [值, ...]}, 符合條件的股票數)
+
+    有篩選條件的欄位缺值時不符合條件；排序欄位缺值的股票排在最後，相同值依股票代碼排序。
+    """
+    if sort_by not in FIELDS:
+        raise ValueError(f'不支援的排序欄位：{sort_by}（可用：{", ".join(FIELDS)}）')
+    codes, names, values = combine(tables)
+
+    # NaN 的比較結果為 False，缺值的股票自然被排除
+    mask = np.ones(len(codes), dtype=bool)
+    for field, bounds in (filters or {}).items():
+        if 'min' in bounds:
+            mask &= values[field] >= bounds['min']
+        if 'max' in bounds:
+            mask &= values[field] <= bounds['max']
+    selected = np.flatnonzero(mask)
+
+    key = values[sort_by][selected]
+    order = np.lexsort((codes[selected], -key if descending else key, np.isnan(key)))
+    top = selected[order[:limit]]
+
+    columns = OrderedDict([('股票代碼', codes[top].tolist()), ('股票名稱', names[top].tolist())])
+    for field, (_, _, name, how) in FIELDS.items():
+        cast = int if how == 'sum' else float
+        columns[name] = format_column(name, [None if value != value else cast(value)
+                                             for value in values[field][top].tolist()])
+    return columns, len(selected)
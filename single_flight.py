@@ -0,0 +1,218 @@
+"""合併相同的上游請求（single-flight）
+
+多位使用者同時查詢時，常常同時需要同一天的 T86、BWIBBU_d 或同一個 STOCK_DAY 月份。
+SingleFlight.do(key, fetch) 讓 key 相同、同時進行中的呼叫只執行一次 fetch，其他呼叫等待並共用結果：
+
+- 同一個程序內：第一個呼叫者執行，其他執行緒等它完成後取得同一個結果（或同一個例外）
+- 多個 gunicorn worker 之間：執行前先取得 lock_dir 中鎖定檔的位元組範圍鎖（依 key 的雜湊值選位置，
+  不會為每個 key 產生檔案），完成後把結果寫入 lock_dir；等待同一把鎖的其他程序取得鎖後，
+  若結果是在它開始等待之後寫入的，就直接使用，不再請求
+
+do_async(key, fetch) 為非同步模式（asgi.py）使用的版本：fetch 為協程函式，等待鎖與其他呼叫時不阻塞事件迴圈，
+與同一個程序內 do 的呼叫、其他程序之間同樣合併。
+"""
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+# 鎖定檔中的位元組範圍數量（不同 key 落在同一位置的機率很低，碰撞時只是多等一次）
+LOCK_SLOTS = 1 << 20
+
+# 其他程序的結果檔保留秒數（只需要保留到等待中的程序讀取）
+RESULT_TTL = 60
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """同時進行中的相同請求只執行一次；lock_dir 為 None 時只在程序內合併"""
+
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._lock_file = None
+        self._last_cleanup = 0.0
+        self._stats = {'executed': 0, 'shared': 0, 'shared_across_processes': 0}
+
+    def do(self, key, fetch):
+        """執行 fetch()，或等待進行中、key 相同的呼叫並回傳它的結果"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            self._count('shared')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._execute(key, fetch)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    async def do_async(self, key, fetch):
+        """同 do，fetch 為協程函式；等待進行中的呼叫與其他程序的鎖時不阻塞事件迴圈"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            await asyncio.to_thread(call.done.wait)
+            self._count('shared')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = await self._execute_async(key, fetch)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _slot(self, key):
+        return zlib.crc32(key.encode('utf-8')) % LOCK_SLOTS
+
+    def _result_path(self, key):
+        return os.path.join(self.lock_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _execute(self, key, fetch):
+        if not self.lock_dir:
+            self._count('executed')
+            return fetch()
+
+        slot = self._slot(key)
+        result_path = self._result_path(key)
+        waiting_since = time.time()
+        lock_file = self._shared_lock_file()
+        fcntl.lockf(lock_file, fcntl.LOCK_EX, 1, slot)
+        try:
+            shared = self._read_result(result_path, key, waiting_since)
+            if shared is not None:
+                self._count('shared_across_processes')
+                return shared[0]
+
+            self._count('executed')
+            result = fetch()
+            self._write_result(result_path, key, result)
+            return result
+        finally:
+            fcntl.lockf(lock_file, fcntl.LOCK_UN, 1, slot)
+            self._cleanup()
+
+    async def _execute_async(self, key, fetch):
+        if not self.lock_dir:
+            self._count('executed')
+            return await fetch()
+
+        slot = self._slot(key)
+        result_path = self._result_path(key)
+        waiting_since = time.time()
+        lock_file = self._shared_lock_file()
+        acquire = asyncio.ensure_future(asyncio.to_thread(fcntl.lockf, lock_file, fcntl.LOCK_EX, 1, slot))
+        try:
+            await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            # 取消時執行緒仍會取得鎖，取得後立即釋放，避免其他程序永遠等待
+            acquire.add_done_callback(lambda _: fcntl.lockf(lock_file, fcntl.LOCK_UN, 1, slot))
+            raise
+        try:
+            shared = self._read_result(result_path, key, waiting_since)
+            if shared is not None:
+                self._count('shared_across_processes')
+                return shared[0]
+
+            self._count('executed')
+            result = await fetch()
+            self._write_result(result_path, key, result)
+            return result
+        finally:
+            fcntl.lockf(lock_file, fcntl.LOCK_UN, 1, slot)
+            self._cleanup()
+
+    def _shared_lock_file(self):
+        # POSIX 記錄鎖屬於程序，關閉任何一個指向鎖定檔的描述子都會釋放全部的鎖，所以整個程序共用一個
+        with self._lock:
+            if self._lock_file is None:
+                # 目錄在第一次跨程序合併時才建立（匯入模組時不寫入磁碟）
+                os.makedirs(self.lock_dir, exist_ok=True)
+                self._lock_file = open(os.path.join(self.lock_dir, 'single_flight.lock'), 'a+')
+            return self._lock_file
+
+    def _read_result(self, path, key, since):
+        """其他程序在 since 之後寫入的結果，包成 (結果,)；沒有時回傳 None"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('key') != key or entry.get('at', 0) < since:
+            return None
+        return (entry['result'],)
+
+    def _write_result(self, path, key, result):
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'at': time.time(), 'result': result}, f,
+                          ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            # 無法序列化的結果只在程序內共用
+            print(f"Single-flight result for {key} not shared: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _cleanup(self):
+        """刪除過期的結果檔（最多每 RESULT_TTL 秒掃描一次）"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_cleanup < RESULT_TTL:
+                return
+            self._last_cleanup = now
+        for name in os.listdir(self.lock_dir):
+            path = os.path.join(self.lock_dir, name)
+            if name.endswith('.json'):
+                try:
+                    if os.path.getmtime(path) < now - RESULT_TTL:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """執行次數與共用結果的次數（程序內、跨程序）"""
+        with self._lock:
+            return dict(self._stats)
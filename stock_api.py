@@ -1,13 +1,34 @@
-from flask import Flask, request, jsonify, send_file, Response
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context, g
 from flask_cors import CORS
-import requests
 from datetime import datetime, timedelta
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 import csv
 import io
 import time
 import os
 import json
+import re
+from functools import partial
+from itertools import islice
+
+from exporters import EXPORT_FORMATS, ExportError, make_writer
+from fetch_scheduler import FetchScheduler, FetchTask
+from indicators import (DEFAULT_CONFIG, VOLUME_COLUMNS, IndicatorStateStore, MemoryStateStore,
+                        apply_indicators, indicator_columns, parse_indicator_config, technical_columns,
+                        history_start, technical_indicators, volume_analysis, warmup_days)
+from jobs import JobQueue
+from metrics import begin_request, end_request, registry, request_timings, server_timing, stage
+from responses import ORIENTS, compress, dumps, from_columns, set_cache_headers, to_columns
+from rate_governor import request_priority
+from result_cache import ResultCache
+from screener import COLUMNS as SCREENER_COLUMNS, FIELDS as SCREENER_FIELDS, parse_filters, screen
+from single_flight import SingleFlight
+from stock_frame import StockFrame
+from trading_calendar import TradingCalendar, iter_months
+from twse_cache import (MonthBlockStore, SnapshotStore, cache_dir, content_digest, data_ready_time,
+                        is_day_finalized, is_month_closed, next_data_ready_time, taipei_now)
+from twse_client import TWSEUnavailable, client_from_env
+from warehouse import Warehouse, month_key, table_columns
 
 app = Flask(__name__)
 # 允許所有來源的 CORS 請求（生產環境建議限制特定網域）
@@ -15,12 +36,103 @@ CORS(app, resources={
     r"/*": {
         "origins": "*",
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"],
-        "expose_headers": ["Content-Type"],
+        "allow_headers": ["Content-Type", "If-None-Match", "If-Modified-Since"],
+        "expose_headers": ["Content-Type", "Server-Timing", "ETag", "Last-Modified"],
         "supports_credentials": False
     }
 })
 
+def open_storage(root=None):
+    """以快取根目錄 root（預設為 cache_dir()，呼叫時讀取 TWSE_CACHE_DIR）建立倉儲與各種磁碟快取
+
+    匯入模組時以目前的環境變數呼叫一次；目錄與檔案在第一次寫入時才建立。測試或工具程式可以再次呼叫，
+    改用其他目錄。
+    """
+    global warehouse, snapshot_store, month_store, indicator_store, single_flight, trading_calendar
+    global WARMER_STATUS_PATH
+    root = root or cache_dir()
+
+    # 本機歷史資料倉儲：已定案的股價、三大法人、基本面資料（可用 backfill.py 預先載入多年資料）
+    warehouse = Warehouse(os.environ.get('WAREHOUSE_PATH', os.path.join(root, 'warehouse.sqlite3')))
+
+    # 全市場每日快照（T86、BWIBBU_d）快取（舊版快取，讀到時會搬進 warehouse）
+    snapshot_store = SnapshotStore(
+        os.path.join(root, 'snapshots'),
+        max_bytes=int(os.environ.get('SNAPSHOT_CACHE_MAX_MB', 200)) * 1024 * 1024
+    )
+
+    # 個股月資料（STOCK_DAY）快取：當月資料短期有效（已結束的月份存進 warehouse）
+    month_store = MonthBlockStore(
+        os.path.join(root, 'stock_day'),
+        ttl=int(os.environ.get('CURRENT_MONTH_TTL', 3600)),
+        max_bytes=int(os.environ.get('MONTH_CACHE_MAX_MB', 200)) * 1024 * 1024,
+        memory_items=256
+    )
+
+    # 各股票的指標計算結果與遞迴狀態，查詢區間往後延伸時只做增量計算
+    indicator_store = IndicatorStateStore(
+        os.path.join(root, 'indicators'),
+        max_bytes=int(os.environ.get('INDICATOR_CACHE_MAX_MB', 100)) * 1024 * 1024
+    )
+
+    # 合併同時進行中的相同上游請求（同一個程序內的執行緒之間，以及多個 gunicorn worker 之間）
+    single_flight = SingleFlight(os.path.join(root, 'inflight'))
+
+    # 交易日曆：以參考股票的 STOCK_DAY 學習交易日（月資料有快取，幾乎不增加請求）
+    trading_calendar = TradingCalendar(os.path.join(root, 'trading_calendar.json'))
+
+    # 盤後預先抓取（warmer.py）的狀態檔，/health 會回報
+    WARMER_STATUS_PATH = os.environ.get('WARMER_STATUS_PATH', os.path.join(root, 'warmer_status.json'))
+
+open_storage()
+CALENDAR_REFERENCE_STOCK = os.environ.get('CALENDAR_REFERENCE_STOCK', '2330')
+
+# 查詢結果的記憶體快取：相同查詢直接回傳序列化好的回應（總容量上限，0 表示停用）
+result_cache = ResultCache(int(os.environ.get('RESULT_CACHE_MAX_MB', 64)) * 1024 * 1024)
+# 包含尚未定案資料的結果最多保留的秒數（其他 worker 抓到的新資料最晚在這之後反映）
+RESULT_CACHE_LIVE_TTL = int(os.environ.get('RESULT_CACHE_LIVE_TTL', 300))
+
+# 上游請求排程器（同時進行的請求數量上限）
+scheduler = FetchScheduler(max_workers=int(os.environ.get('FETCH_CONCURRENCY', 8)))
+
+# 背景工作：請求數較多的查詢依序在背景執行，狀態與結果存在磁碟（同時執行的工作數量上限）
+jobs = JobQueue(
+    os.environ.get('JOB_DIR', os.path.join(cache_dir(), 'jobs')),
+    max_workers=int(os.environ.get('JOB_CONCURRENCY', 1)),
+    ttl=int(os.environ.get('JOB_RESULT_TTL_HOURS', 24)) * 3600
+)
+
+# 所有抓取函式共用的證交所客戶端
+twse_client = client_from_env()
+
+# 執行指標（/metrics）；各處理階段的耗時由 metrics.stage 記錄
+UPSTREAM_REQUESTS = registry.counter(
+    'twse_upstream_requests_total', '向證交所的請求次數（每次重試分開計算）', ['endpoint', 'outcome'])
+UPSTREAM_SECONDS = registry.histogram(
+    'twse_upstream_request_seconds', '向證交所請求的延遲', ['endpoint'])
+CACHE_LOOKUPS = registry.counter(
+    'stock_api_cache_lookups_total', '資料查找次數（source 為命中的倉儲或快取，miss 表示需要向證交所請求）',
+    ['dataset', 'source'])
+ROWS_SERVED = registry.counter('stock_api_rows_served_total', '回傳的資料列數', ['kind'])
+ERRORS = registry.counter(
+    'stock_api_errors_total', '錯誤次數（fetch：重試後仍抓取失敗；bad_request、no_data、exception：HTTP 400、404、500）',
+    ['cause'])
+HTTP_REQUESTS = registry.counter('stock_api_http_requests_total', 'HTTP 請求次數', ['route', 'status'])
+HTTP_SECONDS = registry.histogram('stock_api_http_request_seconds', 'HTTP 請求的處理時間', ['route'])
+
+def record_upstream(endpoint, elapsed, ok):
+    UPSTREAM_REQUESTS.inc(endpoint=endpoint, outcome='ok' if ok else 'error')
+    UPSTREAM_SECONDS.observe(elapsed, endpoint=endpoint)
+
+twse_client.listeners.append(record_upstream)
+
+# 全市場每日表的查詢參數
+MARKET_SNAPSHOT_PARAMS = {
+    'T86': {'selectType': 'ALLBUT0999', 'response': 'json'},
+    'BWIBBU_d': {'selectType': 'ALL', 'response': 'json'},
+    'MI_INDEX': {'type': 'ALLBUT0999', 'response': 'json'}
+}
+
 def parse_roc_date(roc_date_str):
     """轉換民國日期為西元日期"""
     parts = roc_date_str.split('/')
@@ -33,273 +145,1458 @@ def format_date(date):
     """格式化日期為 YYYY-MM-DD"""
     return date.strftime('%Y-%m-%d')
 
-@app.route('/api/stock-data', methods=['POST'])
+# 定義欄位順序（按類別分組）
+COLUMN_ORDER = [
+    # 基本資訊
+    '日期', '股票代碼',
+
+    # 價格資料
+    '開盤價', '最高價', '最低價', '收盤價', '漲跌價差', '漲跌幅(%)',
+
+    # 成交量基本資料
+    '成交股數', '成交金額', '成交筆數',
+
+    # 成交量分析
+    '成交量(億股)', '量變化率(%)', '量比',
+
+    # 技術指標（依 indicators 設定展開，預設為 MA5、MA10、MA20）
+    'MA*',
+
+    # 三大法人 - 外資
+    '外資買進', '外資賣出', '外資買賣超',
+
+    # 三大法人 - 投信
+    '投信買進', '投信賣出', '投信買賣超',
+
+    # 三大法人 - 自營商與合計
+    '自營商買賣超', '三大法人買賣超合計',
+
+    # 基本面指標
+    '本益比', '殖利率(%)', '股價淨值比', '股利年度', '財報年季'
+]
+
+def column_order_for(config):
+    """依指標設定展開欄位順序"""
+    column_order = []
+    for col in COLUMN_ORDER:
+        column_order += indicator_columns(config) if col == 'MA*' else [col]
+    return column_order
+
+# 各資料類型輸出的欄位（技術指標欄位依 indicators 設定）
+DATA_TYPE_COLUMNS = {
+    'price': ['開盤價', '最高價', '最低價', '收盤價', '漲跌價差', '成交股數', '成交金額', '成交筆數'],
+    'volume': VOLUME_COLUMNS,
+    'institutional': ['外資買進', '外資賣出', '外資買賣超', '投信買進', '投信賣出', '投信買賣超',
+                      '自營商買賣超', '三大法人買賣超合計'],
+    'fundamental': ['本益比', '殖利率(%)', '股價淨值比', '股利年度', '財報年季']
+}
+
+def export_columns(data_types, config, selected=None):
+    """匯出的欄位：依欄位順序列出 data_types 會產生的欄位，selected 為使用者選擇的欄位"""
+    available = {'日期', '股票代碼'}
+    for data_type in data_types:
+        available.update(technical_columns(config) if data_type == 'technical' else DATA_TYPE_COLUMNS.get(data_type, []))
+    if selected:
+        unknown = [name for name in selected if name not in available]
+        if unknown:
+            raise ExportError(f'不支援的欄位：{", ".join(unknown)}（請確認 dataTypes 與 indicators 設定）')
+        available = set(selected)
+    return [name for name in column_order_for(config) if name in available]
+
+# 批次查詢一次最多的股票數量
+BATCH_MAX_STOCKS = int(os.environ.get('BATCH_MAX_STOCKS', 50))
+
+# 准入控制：依查詢計畫中仍需向證交所請求的次數（扣除倉儲、快取已有的部分）決定處理方式，
+# 不限制日期範圍。請求數不超過 LIVE_MAX_CALLS 時立即處理，超過時排入背景工作（回傳 202），
+# 超過 JOB_MAX_CALLS 時拒絕
+def live_call_budget(governor, seconds):
+    """速率限制下 seconds 秒內可送出的請求數（burst 加上最慢端點的速率乘以秒數）；不限制速率時為 60"""
+    if governor is None:
+        return 60
+    return int(governor.burst + min(governor.rates.values()) * seconds)
+
+# 立即處理的查詢等待速率限制的時間上限（秒），須小於 gunicorn 的 --timeout（Procfile 設為 60 秒）。
+# 預設 30 秒（每秒 2 次、burst 5 時為 65 次）：原本 30 天上限的股價、三大法人、基本面查詢在冷快取時
+# 最多約 52 次請求，仍立即處理；這些請求分屬不同端點的速率額度，實際等待時間遠短於 30 秒
+LIVE_MAX_SECONDS = float(os.environ.get('LIVE_MAX_SECONDS', 30))
+LIVE_MAX_CALLS = int(os.environ.get('LIVE_MAX_CALLS', live_call_budget(twse_client.governor, LIVE_MAX_SECONDS)))
+JOB_MAX_CALLS = int(os.environ.get('JOB_MAX_CALLS', 3000))
+
+def check_query_cost(plan):
+    """檢查查詢需要的上游請求數；超過上限時回傳錯誤訊息"""
+    if plan['calls'] > JOB_MAX_CALLS:
+        return (f'此查詢需要向證交所請求 {plan["calls"]} 次，超過上限 {JOB_MAX_CALLS} 次，'
+                f'請縮短查詢區間或減少股票數量')
+    return None
+
+def needs_job(plan):
+    """請求數較多的查詢排入背景工作，避免超過 worker 的逾時"""
+    return plan['calls'] > LIVE_MAX_CALLS
+
+# 背景工作保存的查詢內容（程序重新啟動後依此重新執行）
+JOB_PARAMS = ('stockCode', 'stockCodes', 'startDate', 'endDate', 'dataTypes', 'indicators', 'explain', 'orient')
+
+def job_response(data, plan):
+    """將查詢排入背景工作，回傳 202 與查詢狀態、下載結果的網址"""
+    job = jobs.submit({key: data[key] for key in JOB_PARAMS if key in data}, plan['calls'])
+    return json_response({
+        'success': True,
+        'queued': True,
+        'job': job,
+        'statusUrl': f'/api/jobs/{job["id"]}',
+        'resultUrl': f'/api/jobs/{job["id"]}/result',
+        'message': f'此查詢需要向證交所請求 {plan["calls"]} 次，已排入背景處理'
+    }, 202)
+
+def no_data_message(start_date, end_date):
+    return f'查詢期間 {start_date.strftime("%Y-%m-%d")} 至 {end_date.strftime("%Y-%m-%d")} 無資料。可能原因：1) 股票代碼不存在 2) 查詢日期為週末或假日 3) 日期太新（資料通常延遲1-2天）4) 股票已下市'
+
+def json_response(response_data, status=200):
+    """手動序列化以保持 OrderedDict 的順序（有 orjson 時使用 orjson）"""
+    with stage('serialize'):
+        body = dumps(response_data)
+
+    return Response(
+        body,
+        status=status,
+        mimetype='application/json',
+        headers={'Content-Type': 'application/json; charset=utf-8'}
+    )
+
+# 整段區間的資料都已定案時，瀏覽器與 CDN 可以直接使用快取的秒數
+HISTORICAL_MAX_AGE = int(os.environ.get('HISTORICAL_MAX_AGE', 7 * 24 * 3600))
+
+def query_response(response_data, status, end_date, cache_key=None):
+    """查詢結果的回應：加上 ETag，GET 請求的 If-None-Match、If-Modified-Since 相符時回傳 304
+
+    查詢區間的最後一天已定案（且沒有抓取失敗）時內容不會再變動，加上 Last-Modified 與長效的 Cache-Control；
+    包含今天等尚未定案的資料時要求每次重新驗證。cache_key 不為 None 時，成功且沒有抓取失敗的結果存進結果快取。
+    """
+    response = json_response(response_data, status)
+    if status == 200:
+        historical = is_day_finalized(end_date) and not response_data.get('warnings')
+        set_cache_headers(response, data_ready_time(end_date) if historical else None, HISTORICAL_MAX_AGE)
+        if cache_key is not None and not response_data.get('warnings'):
+            remember_result(cache_key, response, response_data['count'], historical)
+        response.make_conditional(request)
+    return response
+
+# 結果快取保存的回應標頭
+CACHED_HEADERS = ('Content-Type', 'ETag', 'Cache-Control', 'Last-Modified')
+
+def result_key(kind, stock_codes, start_date, end_date, data_types, config, orient):
+    """結果快取的鍵：正規化的查詢內容（資料類型不分順序、不重複）"""
+    return (kind, tuple(stock_codes), start_date.date(), end_date.date(), tuple(sorted(set(data_types))),
+            config, orient)
+
+def remember_result(key, response, rows, historical):
+    """序列化好的回應存進結果快取
+
+    區間都已定案的結果不會再變動；否則最多保留到下一次盤後資料公布，並以 live、stock:代碼 標記，
+    抓到新的當日資料時失效。
+    """
+    body = response.get_data()
+    headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+    expires_at, tags = None, ()
+    if not historical:
+        now = taipei_now()
+        ttl = min(RESULT_CACHE_LIVE_TTL, (next_data_ready_time(now) - now).total_seconds())
+        expires_at = time.time() + ttl
+        tags = ['live'] + [f'stock:{code}' for code in key[1]]
+    result_cache.put(key, (body, headers, rows), len(body), expires_at, tags)
+
+def cached_query_response(key):
+    """結果快取中有相同查詢時直接回傳（GET 的 If-None-Match、If-Modified-Since 相符時為 304），沒有時回傳 None"""
+    cached = result_cache.get(key)
+    CACHE_LOOKUPS.inc(dataset='result', source='memory' if cached else 'miss')
+    if cached is None:
+        return None
+    body, headers, rows = cached
+    ROWS_SERVED.inc(rows, kind=key[0])
+    response = Response(body, status=200, headers=headers)
+    return response.make_conditional(request)
+
+def use_result_cache(data):
+    """explain 與串流模式的回應不使用結果快取（查詢計畫反映當下的快取狀態）"""
+    return not data.get('explain') and not wants_stream(data)
+
+def parse_orient(data):
+    """資料列的輸出方式：records（預設，每列一個物件）或 columns（每個欄位一個陣列）"""
+    orient = data.get('orient') or 'records'
+    if orient not in ORIENTS:
+        raise ValueError(f'不支援的 orient：{orient}（可用：{", ".join(ORIENTS)}）')
+    return orient
+
+def orient_data(response_data, orient, config=DEFAULT_CONFIG):
+    """orient 為 columns 時將 data（批次查詢為每檔股票的 data）轉成 {欄位: [值, ...]}，欄位名稱只出現一次"""
+    if orient != 'columns':
+        return response_data
+    column_order = column_order_for(config)
+    entries = response_data['results'].values() if 'results' in response_data else [response_data]
+    for entry in entries:
+        if isinstance(entry.get('data'), list):
+            entry['data'] = to_columns(entry['data'], column_order)
+    return response_data
+
+def warmup_start(start_date, data_types, config):
+    """計算指標需要的歷史資料起點（交易日數換算為日曆天，預留週末與連假）"""
+    days = warmup_days(config, data_types)
+    if not days:
+        return start_date
+    return start_date - timedelta(days=int(days * 1.5) + 10)
+
+def month_cached(stock_codes, year, month):
+    """哪些股票的這個月份已在倉儲或快取中（不需要請求 STOCK_DAY）"""
+    keys = {month_key(stock_code, year, month): stock_code for stock_code in stock_codes}
+    cached = {keys[key] for key in warehouse.covered('STOCK_DAY', keys)}
+    cached.update(stock_code for stock_code in stock_codes
+                  if stock_code not in cached and month_store.get(stock_code, year, month) is not None)
+    return cached
+
+def days_cached(endpoint, days):
+    """days 中已在倉儲中的日期數"""
+    return len(warehouse.covered(endpoint, [day.strftime('%Y%m%d') for day in days]))
+
+@stage('plan')
+def plan_query(stock_codes, start_date, end_date, data_types, price_start=None):
+    """查詢計畫：估算每種資料來源需要的上游請求數（扣除倉儲、快取已有的部分），選用請求數最少的來源
+
+    股價可以逐月抓個股的 STOCK_DAY（每檔股票每月一次），或逐日抓全市場的 MI_INDEX（每個交易日一次），
+    每個月份分別比較：多檔股票的短區間用 MI_INDEX 較省，單一股票的長區間用 STOCK_DAY 較省。
+    三大法人（T86）、基本面（BWIBBU_d）只有逐日的全市場表。回傳的計畫可直接放進回應的 explain 欄位。
+    """
+    plan = OrderedDict()
+    price_start = price_start or start_date
+    # 尚未學習交易日曆的月份，逐日抓取前需要先以參考股票的 STOCK_DAY 學習（倉儲、快取已有時不需請求，同 pending_requests）
+    calendar_months = {(year, month) for year, month in trading_calendar.missing_months(price_start, end_date, taipei_now())
+                       if cached_month_prices(CALENDAR_REFERENCE_STOCK, year, month)[0] is None}
+    calendar_needed = set()
+
+    if 'price' in data_types:
+        months = []
+        for first, last in month_chunks(price_start, end_date):
+            days = trading_calendar.trading_days(first, last)
+            monthly = len(stock_codes) - len(month_cached(stock_codes, first.year, first.month))
+            daily = len(days) - days_cached('MI_INDEX', days)
+            if daily and (first.year, first.month) in calendar_months:
+                daily += 1
+            source = 'MI_INDEX' if daily < monthly else 'STOCK_DAY'
+            if source == 'MI_INDEX':
+                calendar_needed.add((first.year, first.month))
+            months.append(OrderedDict([
+                ('month', first.strftime('%Y-%m')),
+                ('start', format_date(first)),
+                ('end', format_date(last)),
+                ('source', source),
+                ('calls', min(monthly, daily)),
+                ('alternatives', OrderedDict([('STOCK_DAY', monthly), ('MI_INDEX', daily)]))
+            ]))
+        plan['price'] = OrderedDict([('calls', sum(month['calls'] for month in months)), ('months', months)])
+
+    days = trading_calendar.trading_days(start_date, end_date)
+    for data_type, endpoint in (('institutional', 'T86'), ('fundamental', 'BWIBBU_d')):
+        if data_type in data_types:
+            cached = days_cached(endpoint, days)
+            plan[data_type] = OrderedDict([('source', endpoint), ('calls', len(days) - cached), ('cached', cached)])
+            calendar_needed.update(month for month in calendar_months
+                                   if (start_date.year, start_date.month) <= month <= (end_date.year, end_date.month))
+
+    plan['calendar'] = OrderedDict([('source', 'STOCK_DAY'), ('calls', len(calendar_needed))])
+    plan['calls'] = sum(entry['calls'] for entry in plan.values() if isinstance(entry, dict))
+    return plan
+
+def plan_stock_stages(targets, start_date, end_date, data_types, price_start=None, plan=None):
+    """依查詢計畫規劃期間內所有的上游請求，依資料類型分成階段 {階段: [FetchTask]}
+
+    price_start 為股價資料的起點（預設同 start_date）。
+    """
+    plan = plan or plan_query(list(targets), start_date, end_date, data_types, price_start)
+    stages = OrderedDict()
+
+    # 獲取股價資料（每個月份依計畫選用 STOCK_DAY 或 MI_INDEX）
+    if 'price' in data_types:
+        tasks = stages['price'] = []
+        for month in plan['price']['months']:
+            first = datetime.strptime(month['start'], '%Y-%m-%d')
+            last = datetime.strptime(month['end'], '%Y-%m-%d')
+            if month['source'] == 'MI_INDEX':
+                tasks += plan_market_price_data(targets, first, last)
+            else:
+                for stock_code, frame in targets.items():
+                    tasks += plan_price_data(stock_code, first, last, frame)
+
+    # 獲取三大法人資料
+    if 'institutional' in data_types:
+        stages['institutional'] = plan_institutional_data(targets, start_date, end_date)
+
+    # 獲取基本面指標
+    if 'fundamental' in data_types:
+        stages['fundamental'] = plan_fundamental_data(targets, start_date, end_date)
+
+    return stages
+
+def plan_stock_data(targets, start_date, end_date, data_types, price_start=None, plan=None):
+    """同 plan_stock_stages，但依序列出所有階段的 FetchTask"""
+    stages = plan_stock_stages(targets, start_date, end_date, data_types, price_start, plan)
+    return [task for tasks in stages.values() for task in tasks]
+
+def collect_stock_data(targets, start_date, end_date, data_types, config=DEFAULT_CONFIG, plan=None,
+                       progress=None):
+    """抓取多檔股票的資料；targets 為 {股票代碼: StockFrame}，回傳抓取失敗的 (label, 例外)
+
+    全市場的每日表（T86、BWIBBU_d）每天只抓一次，再分給每一檔股票。
+    股價資料會往前多抓計算指標所需的歷史，讓查詢區間第一天就有完整的 MA20 等指標。
+    plan 為 plan_query 的結果（沒有時自動規劃）；progress(階段, 完成數, 總數) 回報每個階段的進度。
+    """
+    with stage('fetch'):
+        stages = plan_stock_stages(targets, start_date, end_date, data_types,
+                                   warmup_start(start_date, data_types, config), plan)
+        tasks = [task for stage_tasks in stages.values() for task in stage_tasks]
+
+        # 所有月份、日期的請求平行抓取，再依上面的順序合併
+        if progress is None:
+            fetch_errors = scheduler.run(tasks)
+        else:
+            for name, stage_tasks in stages.items():
+                progress(name, 0, len(stage_tasks))
+            stage_of = [(name, i + 1) for name, stage_tasks in stages.items() for i in range(len(stage_tasks))]
+            fetch_errors = []
+            for (name, done), (task, error) in zip(stage_of, scheduler.iter_run(tasks)):
+                if error is not None:
+                    fetch_errors.append((task.label, error))
+                progress(name, done, len(stages[name]))
+
+    ERRORS.inc(len(fetch_errors), cause='fetch')
+    return fetch_errors
+
+def finalize_stock_data(frame, data_types, config=DEFAULT_CONFIG, start_date=None, persist=True):
+    """排序、計算指標、去掉暖機用的歷史資料，並依欄位順序輸出每一列"""
+    # 按日期排序
+    frame.sort()
+    output_start = format_date(start_date) if start_date else None
+
+    # 計算技術指標與成交量分析（沿用先前的計算結果，只算新增的交易日）
+    with stage('indicators'):
+        apply_indicators(frame, data_types, config, indicator_store, output_start, persist)
+    if output_start:
+        frame.drop_before(output_start)
+
+    # 重新排序欄位，按類別組織（日期最左邊）
+    # 嚴格按照定義的順序輸出欄位，不添加未定義的欄位，以確保順序完全一致
+    with stage('reorder'):
+        return frame.to_records(column_order_for(config))
+
+def month_chunks(start_date, end_date):
+    """將查詢區間依月份切成 [(起日, 迄日)]"""
+    chunks = []
+    for year, month in iter_months(start_date, end_date):
+        first = max(start_date, datetime(year, month, 1))
+        next_month = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+        chunks.append((first, min(end_date, next_month - timedelta(days=1))))
+    return chunks
+
+def ndjson_line(event):
+    return dumps(event) + b'\n'
+
+def wants_stream(data):
+    """前端以 stream: true 或 Accept: application/x-ndjson 選擇串流模式"""
+    return bool(data.get('stream')) or 'application/x-ndjson' in request.headers.get('Accept', '')
+
+def iter_stock_events(targets, start_date, end_date, data_types, config=DEFAULT_CONFIG, fetch_errors=None,
+                      typed=False):
+    """依月份抓取 targets 的資料，逐一產出 progress（每完成一個請求）與 rows（每檔股票每月一批）事件
+
+    所有請求一開始就平行送出，每個月份的請求合併完就計算指標並產出該月的資料列，
+    不等整段區間抓完。抓取失敗的 (label, 例外) 會加入 fetch_errors。
+    typed 為 True 時資料列的數值欄位不格式化成字串（見 StockFrame.to_records）。
+    """
+    fetch_errors = [] if fetch_errors is None else fetch_errors
+    price_start = warmup_start(start_date, data_types, config)
+    chunks = []
+    for chunk_start, chunk_end in month_chunks(start_date, end_date):
+        tasks = plan_stock_data(targets, chunk_start, chunk_end, data_types, None if chunks else price_start)
+        chunks.append((chunk_start, tasks))
+
+    # 批次之間以記憶體中的狀態接續計算指標，全部成功後才寫回 indicator_store
+    states = MemoryStateStore()
+    for stock_code in targets:
+        state = indicator_store.get(stock_code, config)
+        if state:
+            states.put(stock_code, config, state)
+
+    column_order = column_order_for(config)
+    total = sum(len(tasks) for _, tasks in chunks)
+    results = scheduler.iter_run([task for _, tasks in chunks for task in tasks])
+    done = 0
+
+    for chunk_start, tasks in chunks:
+        for task, error in islice(results, len(tasks)):
+            done += 1
+            if error is not None:
+                fetch_errors.append((task.label, error))
+            yield {'type': 'progress', 'done': done, 'total': total, 'label': task.label}
+
+        since = format_date(chunk_start)
+        for stock_code, frame in targets.items():
+            frame.sort()
+            apply_indicators(frame, data_types, config, states, since)
+            records = frame.to_records(column_order, since, typed)
+            if records:
+                yield {'type': 'rows', 'stockCode': stock_code, 'data': records, 'count': len(records)}
+            # 已輸出的列只保留之後計算指標需要的前導資料，長區間的記憶體用量不隨區間增加
+            keep_from = history_start(frame, config)
+            if keep_from:
+                frame.drop_before(keep_from)
+
+    if not fetch_errors:
+        for stock_code in targets:
+            state = states.get(stock_code, config)
+            if state:
+                indicator_store.put(stock_code, config, state)
+
+def stream_stock_data(stock_code, start_date, end_date, data_types, config=DEFAULT_CONFIG):
+    """以 NDJSON 逐行輸出查詢結果，事件依序為 start、progress、rows（每月一批）、end"""
+    yield ndjson_line({'type': 'start', 'stockCode': stock_code})
+
+    try:
+        fetch_errors = []
+        count = 0
+        for event in iter_stock_events({stock_code: StockFrame(stock_code)}, start_date, end_date,
+                                       data_types, config, fetch_errors):
+            if event['type'] == 'rows':
+                count += event['count']
+            yield ndjson_line(event)
+
+        ROWS_SERVED.inc(count, kind='stream')
+        end_event = {'type': 'end', 'success': count > 0, 'count': count}
+        if not count:
+            end_event['error'] = no_data_message(start_date, end_date)
+        if fetch_errors:
+            end_event['warnings'] = [f'{label}: {error}' for label, error in fetch_errors]
+        yield ndjson_line(end_event)
+
+    except Exception as e:
+        yield ndjson_line({'type': 'error', 'success': False, 'error': str(e)})
+
+def query_stock_data(stock_code, start_date, end_date, data_types, config=DEFAULT_CONFIG, plan=None, explain=False,
+                     progress=None):
+    """查詢單一股票，回傳 (回應內容, HTTP 狀態碼)；立即處理與背景工作共用"""
+    frame = StockFrame(stock_code)
+    fetch_errors = collect_stock_data({stock_code: frame}, start_date, end_date, data_types, config, plan,
+                                      progress)
+    ordered_data = finalize_stock_data(frame, data_types, config, start_date, not fetch_errors)
+    if progress:
+        progress('indicators', 1, 1)
+
+    # 如果沒有資料，返回更詳細的錯誤訊息
+    if len(ordered_data) == 0:
+        return {
+            'success': False,
+            'error': no_data_message(start_date, end_date),
+            'debug_info': {
+                'stock_code': stock_code,
+                'start_date': start_date.strftime('%Y-%m-%d'),
+                'end_date': end_date.strftime('%Y-%m-%d'),
+                'data_types': data_types,
+                'fetch_errors': [f'{label}: {error}' for label, error in fetch_errors],
+                'plan': plan
+            }
+        }, 404
+
+    # 使用 json.dumps 並確保保持鍵的順序
+    response_data = {
+        'success': True,
+        'data': ordered_data,
+        'count': len(ordered_data)
+    }
+    ROWS_SERVED.inc(len(ordered_data), kind='single')
+
+    # 部分月份或日期抓取失敗時告知前端，而不是默默少掉資料
+    if fetch_errors:
+        response_data['warnings'] = [f'{label}: {error}' for label, error in fetch_errors]
+
+    # explain: true 時附上查詢計畫（各資料類型選用的來源與請求數）
+    if explain:
+        response_data['explain'] = plan
+
+    return response_data, 200
+
+@app.route('/api/stock-data', methods=['GET', 'POST'])
 def get_stock_data():
     try:
-        data = request.json
+        # GET（查詢字串）的回應可由瀏覽器、CDN 快取，並支援 If-None-Match / If-Modified-Since
+        data = request_params()
         stock_code = data.get('stockCode')
         start_date = datetime.strptime(data.get('startDate'), '%Y-%m-%d')
         end_date = datetime.strptime(data.get('endDate'), '%Y-%m-%d')
         data_types = data.get('dataTypes', [])
+        config = parse_indicator_config(data.get('indicators'))
+        try:
+            orient = parse_orient(data)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        # 串流模式逐月輸出資料列（每列一個物件），無法轉成欄位式輸出
+        if orient != 'records' and wants_stream(data):
+            return jsonify({
+                'success': False,
+                'error': f'串流模式只支援 orient=records（收到 {orient}）'
+            }), 400
 
-        # 計算日期範圍，避免請求過大
-        days_diff = (end_date - start_date).days
+        # 相同的查詢直接回傳快取的結果
+        cache_key = None
+        if use_result_cache(data):
+            cache_key = result_key('single', [stock_code], start_date, end_date, data_types, config, orient)
+            cached = cached_query_response(cache_key)
+            if cached is not None:
+                return cached
 
-        # 如果包含三大法人資料，限制更嚴格（因為需要逐日請求）
-        if 'institutional' in data_types and days_diff > 30:
+        # 依實際需要的上游請求數決定立即處理或排入背景工作（倉儲、快取已有的資料不計）
+        plan = plan_query([stock_code], start_date, end_date, data_types,
+                          warmup_start(start_date, data_types, config))
+        error = check_query_cost(plan)
+        if error:
             return jsonify({
                 'success': False,
-                'error': '查詢三大法人資料時，日期範圍不能超過 30 天（建議 7-14 天）'
+                'error': error
             }), 400
-        elif days_diff > 90:
+        query = partial(query_stock_data, stock_code, start_date, end_date, data_types, config, plan,
+                        bool(data.get('explain')))
+        if needs_job(plan):
+            # 單一股票的工作不帶 stockCodes（GET 的查詢字串會同時產生 stockCode 與 stockCodes）
+            return job_response({key: value for key, value in data.items() if key != 'stockCodes'}, plan)
+
+        # 串流模式：邊抓邊輸出，前端可即時顯示進度與已完成的月份
+        if wants_stream(data):
+            return Response(
+                stream_with_context(stream_stock_data(stock_code, start_date, end_date, data_types, config)),
+                mimetype='application/x-ndjson',
+                headers={'Content-Type': 'application/x-ndjson; charset=utf-8',
+                         'Cache-Control': 'no-cache',
+                         'X-Accel-Buffering': 'no'}
+            )
+
+        response_data, status = query()
+        return query_response(orient_data(response_data, orient, config), status, end_date, cache_key)
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def query_stock_data_batch(stock_codes, start_date, end_date, data_types, config=DEFAULT_CONFIG, plan=None,
+                           explain=False, progress=None):
+    """查詢多檔股票，回傳 (回應內容, HTTP 狀態碼)；立即處理與背景工作共用"""
+    targets = OrderedDict((stock_code, StockFrame(stock_code)) for stock_code in stock_codes)
+    fetch_errors = collect_stock_data(targets, start_date, end_date, data_types, config, plan, progress)
+
+    results = OrderedDict()
+    total = 0
+    for i, (stock_code, frame) in enumerate(targets.items()):
+        ordered_data = finalize_stock_data(frame, data_types, config, start_date, not fetch_errors)
+        if progress:
+            progress('indicators', i + 1, len(targets))
+        if not ordered_data:
+            results[stock_code] = {
+                'success': False,
+                'error': no_data_message(start_date, end_date)
+            }
+            continue
+
+        results[stock_code] = {
+            'success': True,
+            'data': ordered_data,
+            'count': len(ordered_data)
+        }
+        total += len(ordered_data)
+
+    response_data = {
+        'success': True,
+        'results': results,
+        'count': total
+    }
+    ROWS_SERVED.inc(total, kind='batch')
+    if fetch_errors:
+        response_data['warnings'] = [f'{label}: {error}' for label, error in fetch_errors]
+    if explain:
+        response_data['explain'] = plan
+
+    return response_data, 200
+
+@app.route('/api/stock-data/batch', methods=['GET', 'POST'])
+def get_stock_data_batch():
+    """一次查詢多檔股票，全市場的每日表只抓一次"""
+    try:
+        data = request_params()
+        stock_codes = list(OrderedDict.fromkeys(str(code).strip() for code in data.get('stockCodes', [])))
+        start_date = datetime.strptime(data.get('startDate'), '%Y-%m-%d')
+        end_date = datetime.strptime(data.get('endDate'), '%Y-%m-%d')
+        data_types = data.get('dataTypes', [])
+        config = parse_indicator_config(data.get('indicators'))
+        try:
+            orient = parse_orient(data)
+        except ValueError as e:
             return jsonify({
                 'success': False,
-                'error': '日期範圍不能超過 90 天，請縮短查詢區間'
+                'error': str(e)
             }), 400
-        
-        collected_data = []
-        
-        # 獲取股價資料
-        if 'price' in data_types:
-            collected_data = fetch_price_data(stock_code, start_date, end_date, collected_data)
-        
-        # 獲取三大法人資料
-        if 'institutional' in data_types:
-            collected_data = fetch_institutional_data(stock_code, start_date, end_date, collected_data)
 
-        # 獲取基本面指標
-        if 'fundamental' in data_types:
-            collected_data = fetch_fundamental_data(stock_code, start_date, end_date, collected_data)
+        if not stock_codes:
+            return jsonify({
+                'success': False,
+                'error': '請提供 stockCodes（股票代碼清單）'
+            }), 400
+        if len(stock_codes) > BATCH_MAX_STOCKS:
+            return jsonify({
+                'success': False,
+                'error': f'一次最多查詢 {BATCH_MAX_STOCKS} 檔股票'
+            }), 400
 
-        # 按日期排序
-        collected_data.sort(key=lambda x: x['日期'])
+        cache_key = None
+        if use_result_cache(data):
+            cache_key = result_key('batch', stock_codes, start_date, end_date, data_types, config, orient)
+            cached = cached_query_response(cache_key)
+            if cached is not None:
+                return cached
 
-        # 如果沒有資料，返回更詳細的錯誤訊息
-        if len(collected_data) == 0:
+        plan = plan_query(stock_codes, start_date, end_date, data_types,
+                          warmup_start(start_date, data_types, config))
+        error = check_query_cost(plan)
+        if error:
             return jsonify({
                 'success': False,
-                'error': f'查詢期間 {start_date.strftime("%Y-%m-%d")} 至 {end_date.strftime("%Y-%m-%d")} 無資料。可能原因：1) 股票代碼不存在 2) 查詢日期為週末或假日 3) 日期太新（資料通常延遲1-2天）4) 股票已下市',
-                'debug_info': {
-                    'stock_code': stock_code,
-                    'start_date': start_date.strftime('%Y-%m-%d'),
-                    'end_date': end_date.strftime('%Y-%m-%d'),
-                    'data_types': data_types
-                }
-            }), 404
+                'error': error
+            }), 400
 
-        # 計算技術指標
-        if 'technical' in data_types:
-            collected_data = calculate_technical_indicators(collected_data)
+        query = partial(query_stock_data_batch, stock_codes, start_date, end_date, data_types, config, plan,
+                        bool(data.get('explain')))
+        if needs_job(plan):
+            return job_response(data, plan)
 
-        # 計算成交量分析
-        if 'volume' in data_types:
-            collected_data = calculate_volume_analysis(collected_data)
+        response_data, status = query()
+        return query_response(orient_data(response_data, orient, config), status, end_date, cache_key)
 
-        # 重新排序欄位，按類別組織（日期最左邊）
-        ordered_data = []
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-        # 定義欄位順序（按類別分組）
-        column_order = [
-            # 基本資訊
-            '日期', '股票代碼',
+def prefetch_requests(data, batch=False):
+    """非同步模式（asgi.py）交給路由處理前先抓取的上游請求：倉儲與快取還沒有、且已定案的資料
 
-            # 價格資料
-            '開盤價', '最高價', '最低價', '收盤價', '漲跌價差', '漲跌幅(%)',
+    逐日抓取的月份需要先以參考股票的 STOCK_DAY 學習交易日曆，這時只回傳這些請求，抓完後再呼叫一次取得其餘的請求。
+    explain、排入背景工作或超過上限的查詢與參數有誤的請求回傳空清單，照原本的方式由路由處理。
+    """
+    if data.get('explain'):
+        return []
+    try:
+        if batch:
+            stock_codes = list(OrderedDict.fromkeys(str(code).strip() for code in data.get('stockCodes', [])))
+        else:
+            stock_codes = [str(data['stockCode'])]
+        start_date = datetime.strptime(data.get('startDate'), '%Y-%m-%d')
+        end_date = datetime.strptime(data.get('endDate'), '%Y-%m-%d')
+        data_types = data.get('dataTypes', [])
+        config = parse_indicator_config(data.get('indicators'))
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return []
+    if not stock_codes or len(stock_codes) > BATCH_MAX_STOCKS:
+        return []
 
-            # 成交量基本資料
-            '成交股數', '成交金額', '成交筆數',
+    price_start = warmup_start(start_date, data_types, config)
+    plan = plan_query(stock_codes, start_date, end_date, data_types, price_start)
+    if check_query_cost(plan) or needs_job(plan):
+        return []
+    return pending_requests(stock_codes, start_date, end_date, data_types, price_start, plan)
 
-            # 成交量分析
-            '成交量(億股)', '量變化率(%)', '量比',
+def pending_requests(stock_codes, start_date, end_date, data_types, price_start, plan):
+    """查詢計畫中倉儲與快取還沒有、且已定案的資料的上游請求；需要先學習交易日曆時只回傳參考股票的請求"""
+    # 逐日抓取的範圍：MI_INDEX 的月份、三大法人與基本面的整段區間
+    daily_ranges = [(datetime.strptime(month['start'], '%Y-%m-%d'), datetime.strptime(month['end'], '%Y-%m-%d'))
+                    for month in plan.get('price', {}).get('months', []) if month['source'] == 'MI_INDEX']
+    if 'institutional' in data_types or 'fundamental' in data_types:
+        daily_ranges.append((start_date, end_date))
 
-            # 技術指標
-            'MA5', 'MA10', 'MA20',
+    needed = {month for first, last in daily_ranges for month in iter_months(first, last)}
+    calendar = [month_prices_request(CALENDAR_REFERENCE_STOCK, year, month)
+                for year, month in trading_calendar.missing_months(price_start, end_date, taipei_now())
+                if (year, month) in needed and cached_month_prices(CALENDAR_REFERENCE_STOCK, year, month)[0] is None]
+    if calendar:
+        return calendar
 
-            # 三大法人 - 外資
-            '外資買進', '外資賣出', '外資買賣超',
+    pending = []
+    for month in plan.get('price', {}).get('months', []):
+        first = datetime.strptime(month['start'], '%Y-%m-%d')
+        last = datetime.strptime(month['end'], '%Y-%m-%d')
+        if month['source'] == 'MI_INDEX':
+            pending += missing_snapshot_requests('MI_INDEX', get_trading_days(first, last))
+        else:
+            cached = month_cached(stock_codes, first.year, first.month)
+            pending += [month_prices_request(stock_code, first.year, first.month)
+                        for stock_code in stock_codes if stock_code not in cached]
+    for data_type, endpoint in (('institutional', 'T86'), ('fundamental', 'BWIBBU_d')):
+        if data_type in data_types:
+            pending += missing_snapshot_requests(endpoint, get_trading_days(start_date, end_date))
+    return pending
 
-            # 三大法人 - 投信
-            '投信買進', '投信賣出', '投信買賣超',
+# 預先抓取最多進行的輪數（第一輪可能只是學習交易日曆）
+PREFETCH_ROUNDS = 3
 
-            # 三大法人 - 自營商與合計
-            '自營商買賣超', '三大法人買賣超合計',
+def fetch_upstream(upstream):
+    """送出一個 UpstreamRequest 並保存結果（同時間相同的請求只送出一次）"""
+    return single_flight.do(upstream.key,
+                            lambda: upstream.store(twse_client.get_json(upstream.endpoint, upstream.params)))
 
-            # 基本面指標
-            '本益比', '殖利率(%)', '股價淨值比', '股利年度', '財報年季'
-        ]
+def prefetch_query(stock_codes, start_date, end_date, data_types, config):
+    """先抓取查詢需要、倉儲與快取還沒有的已定案資料，回傳失敗的 [(請求, 例外)]"""
+    price_start = warmup_start(start_date, data_types, config)
+    for _ in range(PREFETCH_ROUNDS):
+        plan = plan_query(stock_codes, start_date, end_date, data_types, price_start)
+        pending = pending_requests(stock_codes, start_date, end_date, data_types, price_start, plan)
+        if not pending:
+            break
+        outcomes = scheduler.map([partial(fetch_upstream, upstream) for upstream in pending])
+        failures = [(upstream.key, error) for upstream, (_, error) in zip(pending, outcomes) if error is not None]
+        if failures:
+            return failures
+    return []
 
-        for row in collected_data:
-            ordered_row = OrderedDict()
+def missing_snapshot_requests(endpoint, days):
+    """days 中已定案、倉儲與快取都還沒有的全市場表的上游請求（尚未定案的日期不保存，由路由抓取）"""
+    days = [day for day in days if is_day_finalized(day)]
+    covered = warehouse.covered(endpoint, [day.strftime('%Y%m%d') for day in days])
+    return [market_snapshot_request(endpoint, day) for day in days
+            if day.strftime('%Y%m%d') not in covered and snapshot_store.get(endpoint, day.strftime('%Y%m%d')) is None]
 
-            # 嚴格按照定義的順序添加欄位（如果存在）
-            for col in column_order:
-                if col in row:
-                    ordered_row[col] = row[col]
+def run_job(params, report):
+    """執行背景工作：params 為單一或批次查詢的請求內容，回傳 (回應內容, HTTP 狀態碼)
 
-            # 注意：我們不添加未定義的欄位，以確保順序完全一致
+    每次執行都重新規劃，重新啟動後接續的工作只需要請求倉儲、快取還沒有的部分。
+    背景工作的證交所請求優先順序較低（backfill），不會佔用使用者查詢的請求額度。
+    """
+    with request_priority('backfill'):
+        start_date = datetime.strptime(params.get('startDate'), '%Y-%m-%d')
+        end_date = datetime.strptime(params.get('endDate'), '%Y-%m-%d')
+        data_types = params.get('dataTypes', [])
+        config = parse_indicator_config(params.get('indicators'))
+        explain = bool(params.get('explain'))
+        orient = parse_orient(params)
 
-            ordered_data.append(ordered_row)
+        if 'stockCodes' in params:
+            stock_codes = list(OrderedDict.fromkeys(str(code).strip() for code in params['stockCodes']))
+            plan = plan_query(stock_codes, start_date, end_date, data_types,
+                              warmup_start(start_date, data_types, config))
+            response_data, status = query_stock_data_batch(stock_codes, start_date, end_date, data_types, config, plan,
+                                                           explain, report)
+        else:
+            stock_code = params.get('stockCode')
+            plan = plan_query([stock_code], start_date, end_date, data_types,
+                              warmup_start(start_date, data_types, config))
+            response_data, status = query_stock_data(stock_code, start_date, end_date, data_types, config, plan,
+                                                     explain, report)
+        return orient_data(response_data, orient, config), status
 
-        # 使用 json.dumps 並確保保持鍵的順序
-        response_data = {
-            'success': True,
-            'data': ordered_data,
-            'count': len(ordered_data)
-        }
+jobs.runner = run_job
+
+@app.before_request
+def resume_jobs():
+    """第一個請求時接續上次程序結束時尚未完成的背景工作（只在 web 程序執行，warmer、backfill 不會接手）"""
+    jobs.resume()
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """直接排入背景工作（不論請求數多寡），內容與 /api/stock-data（stockCode）或批次查詢（stockCodes）相同"""
+    try:
+        data = request.json
+        stock_codes = data.get('stockCodes') or ([data['stockCode']] if data.get('stockCode') else [])
+        stock_codes = list(OrderedDict.fromkeys(str(code).strip() for code in stock_codes))
+        start_date = datetime.strptime(data.get('startDate'), '%Y-%m-%d')
+        end_date = datetime.strptime(data.get('endDate'), '%Y-%m-%d')
+        data_types = data.get('dataTypes', [])
+        config = parse_indicator_config(data.get('indicators'))
+
+        if not stock_codes:
+            return jsonify({
+                'success': False,
+                'error': '請提供 stockCode 或 stockCodes（股票代碼清單）'
+            }), 400
+        if len(stock_codes) > BATCH_MAX_STOCKS:
+            return jsonify({
+                'success': False,
+                'error': f'一次最多查詢 {BATCH_MAX_STOCKS} 檔股票'
+            }), 400
+
+        plan = plan_query(stock_codes, start_date, end_date, data_types,
+                          warmup_start(start_date, data_types, config))
+        error = check_query_cost(plan)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+
+        return job_response(data, plan)
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def find_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return None, (jsonify({
+            'success': False,
+            'error': f'找不到工作 {job_id}（可能已過期）'
+        }), 404)
+    return job, None
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """背景工作的狀態與各階段進度（price、institutional、fundamental、indicators 的完成百分比）"""
+    job, error = find_job(job_id)
+    if error:
+        return error
+
+    response_data = {
+        'success': job['status'] != 'failed',
+        'job': jobs.info(job)
+    }
+    if job['status'] == 'done':
+        response_data['resultUrl'] = f'/api/jobs/{job_id}/result'
+    return json_response(response_data)
+
+def job_records(result):
+    """背景工作結果中的所有資料列（批次查詢依股票順序串接，欄位式的結果轉回資料列）"""
+    entries = result['results'].values() if 'results' in result else [result]
+    records = []
+    for entry in entries:
+        data = entry.get('data', [])
+        records += from_columns(data) if isinstance(data, dict) else data
+    return records
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """下載背景工作的結果：預設為與同步查詢相同的 JSON，format=csv、parquet、arrow 時輸出檔案"""
+    job, error = find_job(job_id)
+    if error:
+        return error
+    if job['status'] != 'done':
+        return json_response({
+            'success': False,
+            'error': '工作尚未完成' if job['status'] != 'failed' else f'工作失敗：{job["error"]}',
+            'job': jobs.info(job)
+        }, 409)
+
+    fmt = request.args.get('format', 'json').lower()
+    if fmt == 'json':
+        response = send_file(jobs.result_path(job_id), mimetype='application/json')
+        response.status_code = job['http_status']
+        return response
+
+    params = job['params']
+    try:
+        config = parse_indicator_config(params.get('indicators'))
+        writer = make_writer(fmt, export_columns(params.get('dataTypes', []), config))
+    except ExportError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 501 if 'pyarrow' in str(e) else 400
+
+    with open(jobs.result_path(job_id), 'r', encoding='utf-8') as f:
+        result = json.load(f, object_pairs_hook=OrderedDict)
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    return Response(
+        writer.header() + writer.write(job_records(result)) + writer.close(),
+        headers={'Content-Type': mimetype,
+                 'Content-Disposition': f'attachment; filename="job_{job_id}.{extension}"'}
+    )
 
-        # 手動序列化以保持 OrderedDict 的順序
-        json_str = json.dumps(response_data, ensure_ascii=False, separators=(',', ':'))
+def request_params():
+    """POST 讀取 JSON；GET 讀取查詢字串（清單以逗號分隔，布林值為 true / 1），方便直接以連結下載或快取"""
+    if request.method == 'POST':
+        return request.json or {}
+    return query_params(request.args)
+
+def query_params(args):
+    """查詢字串（MultiDict）轉成與 POST 的 JSON 相同格式的請求內容"""
+    def split(name):
+        return [item for item in args.get(name, '').split(',') if item]
+
+    def flag(name):
+        return args.get(name, '').lower() in ('1', 'true')
+
+    data = {
+        'stockCode': args.get('stockCode'),
+        'stockCodes': split('stockCodes') or split('stockCode'),
+        'startDate': args.get('startDate'),
+        'endDate': args.get('endDate'),
+        'dataTypes': split('dataTypes'),
+        'columns': split('columns'),
+        'format': args.get('format', 'csv'),
+        'orient': args.get('orient'),
+        'explain': flag('explain'),
+        'stream': flag('stream')
+    }
+    if args.get('maPeriods') or args.get('extra'):
+        data['indicators'] = {'maPeriods': split('maPeriods') or list(DEFAULT_CONFIG.ma_periods),
+                              'extra': split('extra')}
+    return data
+
+def export_stock_data(writer, targets, start_date, end_date, data_types, config):
+    """依序輸出檔頭、每月一批的資料列與檔尾
+
+    開始輸出後才抓取失敗時拋出 ExportError 中斷輸出（不送出檔尾），下載以失敗結束，不會得到缺少資料的檔案。
+    """
+    yield writer.header()
+    fetch_errors = []
+    for event in iter_stock_events(targets, start_date, end_date, data_types, config, fetch_errors, writer.typed):
+        abort_on_fetch_errors(fetch_errors)
+        if event['type'] == 'rows':
+            ROWS_SERVED.inc(event['count'], kind='export')
+            chunk = writer.write(event['data'])
+            if chunk:
+                yield chunk
+    abort_on_fetch_errors(fetch_errors)
+    yield writer.close()
+
+def abort_on_fetch_errors(fetch_errors):
+    if fetch_errors:
+        label, error = fetch_errors[0]
+        print(f"Export aborted, {label}: {error}")
+        raise ExportError(f'匯出中斷，{label} 抓取失敗：{error}')
+
+@app.route('/api/export', methods=['GET', 'POST'])
+def export_data():
+    """直接由伺服器輸出 CSV（含 BOM）、Parquet 或 Arrow 檔案，可選擇欄位，邊抓邊輸出"""
+    try:
+        data = request_params()
+        stock_codes = data.get('stockCodes') or ([data['stockCode']] if data.get('stockCode') else [])
+        stock_codes = list(OrderedDict.fromkeys(str(code).strip() for code in stock_codes))
+        start_date = datetime.strptime(data.get('startDate'), '%Y-%m-%d')
+        end_date = datetime.strptime(data.get('endDate'), '%Y-%m-%d')
+        data_types = data.get('dataTypes', [])
+        config = parse_indicator_config(data.get('indicators'))
+        fmt = (data.get('format') or 'csv').lower()
+
+        if not stock_codes:
+            return jsonify({
+                'success': False,
+                'error': '請提供 stockCodes（股票代碼清單）'
+            }), 400
+        if len(stock_codes) > BATCH_MAX_STOCKS:
+            return jsonify({
+                'success': False,
+                'error': f'一次最多查詢 {BATCH_MAX_STOCKS} 檔股票'
+            }), 400
+
+        # 匯出不排入背景工作，只檢查請求數上限
+        error = check_query_cost(plan_query(stock_codes, start_date, end_date, data_types,
+                                            warmup_start(start_date, data_types, config)))
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+
+        try:
+            columns = export_columns(data_types, config, data.get('columns'))
+            writer = make_writer(fmt, columns)
+        except ExportError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 501 if 'pyarrow' in str(e) else 400
+
+        # 開始輸出前先抓齊已定案的資料，抓取失敗時回傳錯誤，而不是輸出缺少資料的檔案
+        failures = prefetch_query(stock_codes, start_date, end_date, data_types, config)
+        if failures:
+            unavailable = all(isinstance(error, TWSEUnavailable) for _, error in failures)
+            return jsonify({
+                'success': False,
+                'error': f'證交所資料抓取失敗，未匯出：{failures[0][1]}',
+                'fetch_errors': [f'{key}: {error}' for key, error in failures]
+            }), 503 if unavailable else 502
+
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        name = '-'.join(stock_codes) if len(stock_codes) <= 3 else f'{len(stock_codes)}stocks'
+        filename = f'{name}_{start_date.strftime("%Y%m%d")}_{end_date.strftime("%Y%m%d")}.{extension}'
+        targets = OrderedDict((stock_code, StockFrame(stock_code)) for stock_code in stock_codes)
 
         return Response(
-            json_str,
-            mimetype='application/json',
-            headers={'Content-Type': 'application/json; charset=utf-8'}
+            stream_with_context(export_stock_data(writer, targets, start_date, end_date, data_types, config)),
+            headers={'Content-Type': mimetype,
+                     'Content-Disposition': f'attachment; filename="{filename}"',
+                     'X-Accel-Buffering': 'no'}
         )
-        
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# 選股預設與最多回傳的股票數，以及期間最多包含的交易日數（每個交易日讀取兩張全市場表）
+SCREENER_DEFAULT_LIMIT = 50
+SCREENER_MAX_LIMIT = int(os.environ.get('SCREENER_MAX_LIMIT', 2000))
+SCREENER_MAX_DAYS = int(os.environ.get('SCREENER_MAX_DAYS', 120))
+
+def screener_params(args):
+    """選股的查詢字串（MultiDict）轉成與 POST 的 JSON 相同格式；篩選條件寫成 欄位.min、欄位.max（如 pe.max=15）"""
+    filters = {}
+    for name, value in args.items():
+        field, _, bound = name.rpartition('.')
+        if field and bound in ('min', 'max'):
+            filters.setdefault(field, {})[bound] = value
+    data = {key: args.get(key) for key in ('date', 'startDate', 'endDate', 'sortBy', 'order', 'limit', 'orient')}
+    data['filters'] = filters
+    return data
+
+def parse_screener_query(data):
+    """檢查選股的請求內容，回傳 (開始日期, 結束日期, 篩選條件, 排序欄位, 是否遞減, 股票數, 輸出方式)；
+    格式錯誤時拋出 ValueError"""
+    if data.get('date'):
+        start_date = end_date = datetime.strptime(data['date'], '%Y-%m-%d')
+    elif data.get('startDate') and data.get('endDate'):
+        start_date = datetime.strptime(data['startDate'], '%Y-%m-%d')
+        end_date = datetime.strptime(data['endDate'], '%Y-%m-%d')
+    else:
+        raise ValueError('請提供 date（單日）或 startDate、endDate（期間）')
+    if start_date > end_date:
+        raise ValueError('startDate 不可晚於 endDate')
+
+    filters = parse_filters(data.get('filters') or {})
+    sort_by = data.get('sortBy') or 'foreignNet'
+    if sort_by not in SCREENER_FIELDS:
+        raise ValueError(f'不支援的排序欄位：{sort_by}（可用：{", ".join(SCREENER_FIELDS)}）')
+    order = (data.get('order') or 'desc').lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError('order 必須是 asc 或 desc')
+    try:
+        limit = int(data.get('limit') or SCREENER_DEFAULT_LIMIT)
+    except (TypeError, ValueError):
+        raise ValueError('limit 必須是整數')
+    if not 1 <= limit <= SCREENER_MAX_LIMIT:
+        raise ValueError(f'limit 必須介於 1 到 {SCREENER_MAX_LIMIT}')
+    return start_date, end_date, filters, sort_by, order == 'desc', limit, parse_orient(data)
+
+def market_table(endpoint, date):
+    """某日全市場表的 MarketTable（選股使用）；已在倉儲的日期直接讀取數值欄位，不解析原始資料列"""
+    table = warehouse.snapshot_columns(endpoint, date.strftime('%Y%m%d'), SCREENER_COLUMNS[endpoint])
+    if table is not None:
+        CACHE_LOOKUPS.inc(dataset=endpoint, source='warehouse')
+        return table
+    return table_columns(endpoint, fetch_market_snapshot(endpoint, date))
+
+def screener_calls(start_date, end_date, days):
+    """選股需要的上游請求數（不送出請求）：倉儲與快取都還沒有的已定案日期、尚未定案的日期，
+    以及學習交易日曆需要的月份（同 plan_query）"""
+    live = sum(1 for day in days if not is_day_finalized(day))
+    calendar = len(trading_calendar.missing_months(start_date, end_date, taipei_now()))
+    return calendar + sum(len(missing_snapshot_requests(endpoint, days)) + live for endpoint in SCREENER_COLUMNS)
+
+def query_screener(days, filters, sort_by, descending, limit, orient='records'):
+    """對 days 的全市場表選股，回傳 (回應內容, HTTP 狀態碼)"""
+    loads = [(endpoint, day) for day in days for endpoint in SCREENER_COLUMNS]
+    with stage('fetch'):
+        outcomes = scheduler.map([partial(market_table, endpoint, day) for endpoint, day in loads])
+
+    tables, fetch_errors = [], []
+    for (endpoint, day), (table, error) in zip(loads, outcomes):
+        if error is None:
+            tables.append((endpoint, table))
+        else:
+            print(f"Error fetching {endpoint} for {day.strftime('%Y%m%d')}: {error}")
+            fetch_errors.append(f'{endpoint} {format_date(day)}: {error}')
+
+    if not any(table.codes for _, table in tables):
+        return {
+            'success': False,
+            'error': '查詢期間沒有全市場資料。可能原因：1) 查詢日期為週末或假日 2) 日期太新（盤後資料尚未公布）',
+            'debug_info': {'fetch_errors': fetch_errors}
+        }, 404
+
+    with stage('screen'):
+        columns, matched = screen(tables, filters, sort_by, descending, limit)
+    count = len(columns['股票代碼'])
+    response_data = {
+        'success': True,
+        'startDate': format_date(days[0]),
+        'endDate': format_date(days[-1]),
+        'tradingDays': len(days),
+        'sortBy': sort_by,
+        'order': 'desc' if descending else 'asc',
+        'matched': matched,
+        'data': columns if orient == 'columns' else from_columns(columns),
+        'count': count
+    }
+    ROWS_SERVED.inc(count, kind='screener')
+    if fetch_errors:
+        response_data['warnings'] = fetch_errors
+    return response_data, 200
+
+@app.route('/api/screener', methods=['GET', 'POST'])
+def get_screener():
+    """全市場選股：依期間內的外資、投信、自營商、三大法人買賣超加總與最後一日的本益比、殖利率、股價淨值比
+    篩選（filters）與排序（sortBy、order），回傳前 limit 檔；取代逐檔呼叫 /api/stock-data 再自行排名"""
+    try:
+        data = (request.json or {}) if request.method == 'POST' else screener_params(request.args)
+        try:
+            start_date, end_date, filters, sort_by, descending, limit, orient = parse_screener_query(data)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+
+        cache_key = ('screener', (), start_date.date(), end_date.date(),
+                     tuple(sorted((field, tuple(sorted(bounds.items()))) for field, bounds in filters.items())),
+                     sort_by, descending, limit, orient)
+        cached = cached_query_response(cache_key)
+        if cached is not None:
+            return cached
+
+        # 檢查上限時不向證交所請求：先看日曆天數，再以已知的交易日曆推估（尚未學習的月份以週一到週五計）
+        if (end_date - start_date).days >= SCREENER_MAX_DAYS * 2:
+            return jsonify({
+                'success': False,
+                'error': f'選股期間超過 {SCREENER_MAX_DAYS * 2} 天（上限 {SCREENER_MAX_DAYS} 個交易日）'
+            }), 400
+        days = trading_calendar.trading_days(start_date, end_date)
+        if len(days) > SCREENER_MAX_DAYS:
+            return jsonify({
+                'success': False,
+                'error': f'選股期間包含約 {len(days)} 個交易日，超過上限 {SCREENER_MAX_DAYS} 個交易日'
+            }), 400
+
+        # 全市場表的請求數超過立即處理的上限時拒絕（可先以 backfill.py 載入倉儲）
+        calls = screener_calls(start_date, end_date, days)
+        if calls > LIVE_MAX_CALLS:
+            return jsonify({
+                'success': False,
+                'error': (f'此選股需要向證交所請求 {calls} 次，超過上限 {LIVE_MAX_CALLS} 次，'
+                          f'請縮短期間或先以 backfill.py 載入三大法人與基本面資料')
+            }), 400
+
+        # 通過檢查後才學習交易日曆（排除假日），再抓取全市場表
+        days = get_trading_days(start_date, end_date)
+        response_data, status = query_screener(days, filters, sort_by, descending, limit, orient)
+        return query_response(response_data, status, end_date, cache_key)
+
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
-def fetch_price_data(stock_code, start_date, end_date, collected_data):
+def fetch_price_data(stock_code, start_date, end_date, frame):
     """獲取每日股價資料"""
+    scheduler.run(plan_price_data(stock_code, start_date, end_date, frame))
+    return frame
+
+def price_values(row):
+    """STOCK_DAY 格式的資料列轉為欄位（字串，由 StockFrame.ingest 解析）"""
+    return {
+        '成交股數': row[1],
+        '成交金額': row[2],
+        '開盤價': row[3],
+        '最高價': row[4],
+        '最低價': row[5],
+        '收盤價': row[6],
+        '漲跌價差': row[7],
+        '成交筆數': row[8]
+    }
+
+def plan_price_data(stock_code, start_date, end_date, frame):
+    """規劃股價資料的請求（每月一次）"""
+    tasks = []
     current = start_date
-    
+
     while current <= end_date:
         year = current.year
         month = current.month
-        date_param = f"{year}{month:02d}01"
-        
-        url = f"https://www.twse.com.tw/exchangeReport/STOCK_DAY?response=json&date={date_param}&stockNo={stock_code}"
-        
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=10)
-            result = response.json()
-            
-            if result.get('stat') == 'OK' and result.get('data'):
-                for row in result['data']:
-                    row_date = parse_roc_date(row[0])
-                    
-                    if start_date <= row_date <= end_date:
-                        date_str = format_date(row_date)
-                        
-                        # 找到或建立該日期的資料
-                        existing_row = next((d for d in collected_data if d['日期'] == date_str), None)
-                        if not existing_row:
-                            existing_row = OrderedDict()
-                            existing_row['日期'] = date_str
-                            existing_row['股票代碼'] = stock_code
-                            collected_data.append(existing_row)
-                        
-                        existing_row.update({
-                            '成交股數': row[1],
-                            '成交金額': row[2],
-                            '開盤價': row[3],
-                            '最高價': row[4],
-                            '最低價': row[5],
-                            '收盤價': row[6],
-                            '漲跌價差': row[7],
-                            '成交筆數': row[8]
-                        })
-            
-            # 移除延遲，提升速度
-            
-        except Exception as e:
-            print(f"Error fetching price data for {year}-{month:02d}: {e}")
-        
+
+        def merge(rows):
+            for row in rows:
+                row_date = parse_roc_date(row[0])
+
+                if start_date <= row_date <= end_date:
+                    frame.ingest(format_date(row_date), price_values(row))
+
+        tasks.append(FetchTask(
+            f'price data for {year}-{month:02d}',
+            partial(fetch_month_prices, stock_code, year, month),
+            merge
+        ))
+
         # 移到下個月
         if current.month == 12:
             current = datetime(current.year + 1, 1, 1)
         else:
             current = datetime(current.year, current.month + 1, 1)
-    
-    return collected_data
 
-def fetch_institutional_data(stock_code, start_date, end_date, collected_data):
-    """獲取三大法人買賣超資料"""
-    current = start_date
-    
-    while current <= end_date:
-        # 跳過週末
-        if current.weekday() < 5:  # 0-4 是週一到週五
-            date_param = current.strftime('%Y%m%d')
-            url = f"https://www.twse.com.tw/rwd/zh/fund/T86?date={date_param}&selectType=ALLBUT0999&response=json"
-            
-            try:
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                }
-                response = requests.get(url, headers=headers, timeout=10)
-                result = response.json()
-                
-                if result.get('stat') == 'OK' and result.get('data'):
-                    # 找到對應股票的資料
-                    stock_data = next((row for row in result['data'] if row[0] == stock_code), None)
-                    
-                    if stock_data:
-                        date_str = format_date(current)
-                        
-                        existing_row = next((d for d in collected_data if d['日期'] == date_str), None)
-                        if not existing_row:
-                            existing_row = OrderedDict()
-                            existing_row['日期'] = date_str
-                            existing_row['股票代碼'] = stock_code
-                            collected_data.append(existing_row)
-                        
-                        existing_row.update({
-                            '外資買進': stock_data[2],   # 外陸資買進股數(不含外資自營商)
-                            '外資賣出': stock_data[3],   # 外陸資賣出股數(不含外資自營商)
-                            '外資買賣超': stock_data[4], # 外陸資買賣超股數(不含外資自營商)
-                            '投信買進': stock_data[8],   # 投信買進股數
-                            '投信賣出': stock_data[9],   # 投信賣出股數
-                            '投信買賣超': stock_data[10], # 投信買賣超股數
-                            '自營商買賣超': stock_data[11], # 自營商買賣超股數
-                            '三大法人買賣超合計': stock_data[18] # 三大法人買賣超股數
-                        })
-
-                # 移除延遲，提升速度
-                
-            except Exception as e:
-                print(f"Error fetching institutional data for {date_param}: {e}")
-        
-        current += timedelta(days=1)
-    
-    return collected_data
+    return tasks
 
-def fetch_fundamental_data(stock_code, start_date, end_date, collected_data):
-    """獲取基本面指標（本益比、殖利率、股價淨值比）"""
-    current = start_date
+def plan_market_price_data(targets, start_date, end_date):
+    """規劃股價資料的請求（每個交易日一次 MI_INDEX，整張表分給 targets 中的每檔股票）"""
+    tasks = []
+    stock_codes = list(targets)
 
-    while current <= end_date:
-        date_param = current.strftime('%Y%m%d')
-        url = f"https://www.twse.com.tw/rwd/zh/afterTrading/BWIBBU_d?date={date_param}&selectType=ALL&response=json"
+    for current in get_trading_days(start_date, end_date):
+        date_str = format_date(current)
 
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=10)
-            result = response.json()
+        def merge(table, date_str=date_str):
+            for stock_code, frame in targets.items():
+                row = table.get(stock_code)
+                if row:
+                    frame.ingest(date_str, price_values(row))
+
+        tasks.append(FetchTask(
+            f'market price data for {current.strftime("%Y%m%d")}',
+            partial(fetch_market_snapshot, 'MI_INDEX', current, stock_codes),
+            merge
+        ))
+
+    return tasks
+
+def cached_month_prices(stock_code, year, month):
+    """倉儲或快取中的個股單月 STOCK_DAY 資料列，回傳 (資料列, 來源)；都沒有時為 (None, None)"""
+    rows = warehouse.month_rows(stock_code, year, month)
+    if rows is not None:
+        return rows, 'warehouse'
+
+    rows = month_store.get(stock_code, year, month)
+    if rows is None:
+        return None, None
+    # 已結束的月份不會再變動，存進倉儲
+    if is_month_closed(year, month):
+        warehouse.put_month(stock_code, year, month, rows)
+    return rows, 'month_cache'
+
+def fetch_month_prices(stock_code, year, month):
+    """獲取個股單月的 STOCK_DAY 資料列，優先讀取倉儲與快取；同時間相同月份的請求只送出一次"""
+    rows, source = cached_month_prices(stock_code, year, month)
+    CACHE_LOOKUPS.inc(dataset='STOCK_DAY', source=source or 'miss')
+    if rows is not None:
+        return rows
+    return single_flight.do(month_prices_request(stock_code, year, month).key,
+                            partial(download_month_prices, stock_code, year, month))
+
+# 一個上游請求：single-flight 的鍵、端點、查詢參數，以及把證交所回應存進倉儲或快取的函式（回傳解析後的資料）
+UpstreamRequest = namedtuple('UpstreamRequest', ['key', 'endpoint', 'params', 'store'])
+
+def month_prices_request(stock_code, year, month):
+    """個股單月 STOCK_DAY 的上游請求"""
+    return UpstreamRequest(f'STOCK_DAY:{stock_code}:{year}{month:02d}', 'STOCK_DAY',
+                           {'response': 'json', 'date': f'{year}{month:02d}01', 'stockNo': stock_code},
+                           partial(store_month_prices, stock_code, year, month))
+
+def download_month_prices(stock_code, year, month):
+    """向證交所請求個股單月的 STOCK_DAY 資料列並存進倉儲或快取"""
+    # 等待其他請求期間，資料可能已經寫入倉儲或快取
+    rows, _ = cached_month_prices(stock_code, year, month)
+    if rows is not None:
+        return rows
+
+    upstream = month_prices_request(stock_code, year, month)
+    return upstream.store(twse_client.get_json(upstream.endpoint, upstream.params))
+
+def store_month_prices(stock_code, year, month, result):
+    """證交所的 STOCK_DAY 回應存進倉儲或快取，回傳資料列"""
+    rows = []
+    if result.get('stat') == 'OK' and result.get('data'):
+        rows = result['data']
+
+    # 已結束的月份不會再變動，存進倉儲
+    if is_month_closed(year, month):
+        warehouse.put_month(stock_code, year, month, rows)
+    elif month_store.put(stock_code, year, month, rows):
+        # 當月資料有變動，包含這檔股票尚未定案資料的查詢結果失效
+        result_cache.invalidate(f'stock:{stock_code}')
+    return rows
+
+def cached_market_snapshot(endpoint, date_param, finalized, stock_codes=None):
+    """倉儲或快取中的某日全市場表，回傳 (表, 來源)；都沒有時為 (None, None)
+
+    stock_codes 為需要的股票代碼時，倉儲只讀取這些股票的資料列（不必解析整個市場上千列）。
+    """
+    table = warehouse.snapshot(endpoint, date_param, stock_codes)
+    if table is not None:
+        return table, 'warehouse'
+
+    table = snapshot_store.get(endpoint, date_param)
+    if table is None:
+        return None, None
+    if finalized:
+        warehouse.put_snapshot(endpoint, date_param, table)
+    return table, 'snapshot_cache'
+
+def fetch_market_snapshot(endpoint, date, stock_codes=None):
+    """獲取某日全市場表（依股票代碼索引），已定案的日期優先讀取倉儲；同時間相同日期的請求只送出一次
+
+    stock_codes 為需要的股票代碼時，讀取倉儲的結果只包含這些股票（向證交所請求時仍回傳整張表）。
+    """
+    date_param = date.strftime('%Y%m%d')
+    table, source = cached_market_snapshot(endpoint, date_param, is_day_finalized(date), stock_codes)
+    CACHE_LOOKUPS.inc(dataset=endpoint, source=source or 'miss')
+    if table is not None:
+        return table
+    return single_flight.do(market_snapshot_request(endpoint, date).key,
+                            partial(download_market_snapshot, endpoint, date))
+
+def market_snapshot_request(endpoint, date):
+    """某日全市場表的上游請求"""
+    date_param = date.strftime('%Y%m%d')
+    return UpstreamRequest(f'{endpoint}:{date_param}', endpoint, dict(MARKET_SNAPSHOT_PARAMS[endpoint], date=date_param),
+                           partial(store_market_snapshot, endpoint, date))
 
-            if result.get('stat') == 'OK' and result.get('data'):
+def download_market_snapshot(endpoint, date):
+    """向證交所請求某日全市場表，已定案的日期存進倉儲"""
+    date_param = date.strftime('%Y%m%d')
+    table, _ = cached_market_snapshot(endpoint, date_param, is_day_finalized(date))
+    if table is not None:
+        return table
+
+    upstream = market_snapshot_request(endpoint, date)
+    return upstream.store(twse_client.get_json(upstream.endpoint, upstream.params))
+
+# 尚未定案的全市場表最近一次抓到的內容雜湊 {端點: (日期, 雜湊)}（不保存表，只用來判斷查詢結果是否需要失效）
+live_snapshot_digests = {}
+
+def live_snapshot_changed(endpoint, date_param, table):
+    """記錄尚未定案的全市場表的內容雜湊，回傳與同一天前一次抓到的內容是否不同"""
+    digest = content_digest(table)
+    previous = live_snapshot_digests.get(endpoint)
+    live_snapshot_digests[endpoint] = (date_param, digest)
+    return previous != (date_param, digest)
+
+def store_market_snapshot(endpoint, date, result):
+    """證交所的全市場表回應（依股票代碼索引）存進倉儲，回傳表；尚未定案的日期不保存"""
+    date_param = date.strftime('%Y%m%d')
+    finalized = is_day_finalized(date)
+
+    # 非交易日證交所會回傳非 OK 的 stat，以空表記錄，避免重複查詢
+    table = {}
+    if result.get('stat') == 'OK' and endpoint == 'MI_INDEX':
+        table = parse_market_prices(result, date)
+    elif result.get('stat') == 'OK' and result.get('data'):
+        table = {row[0].strip(): row for row in result['data']}
+
+    if finalized:
+        warehouse.put_snapshot(endpoint, date_param, table)
+    elif table and live_snapshot_changed(endpoint, date_param, table):
+        # 尚未定案的當日資料有變動，包含尚未定案資料的查詢結果失效
+        result_cache.invalidate('live')
+
+    return table
+
+def parse_market_prices(result, date):
+    """MI_INDEX 的「每日收盤行情」表轉成與 STOCK_DAY 相同格式的資料列 {股票代碼: row}"""
+    for table in result.get('tables', []):
+        fields = table.get('fields') or []
+        if '證券代號' in fields and '收盤價' in fields:
+            break
+    else:
+        return {}
+
+    column = {name: i for i, name in enumerate(fields)}
+    roc_date = f'{date.year - 1911}/{date.month:02d}/{date.day:02d}'
+    prices = {}
+    for row in table.get('data', []):
+        # 漲跌(+/-) 欄位是 HTML（如 <p style= color:red>+</p>），平盤為空白，除權息為 X
+        sign = re.sub(r'<[^>]*>', '', row[column['漲跌(+/-)']]).strip() or ' '
+        prices[row[column['證券代號']].strip()] = [
+            roc_date,
+            row[column['成交股數']],
+            row[column['成交金額']],
+            row[column['開盤價']],
+            row[column['最高價']],
+            row[column['最低價']],
+            row[column['收盤價']],
+            sign + row[column['漲跌價差']],
+            row[column['成交筆數']]
+        ]
+    return prices
+
+def get_trading_days(start_date, end_date):
+    """列出期間內的交易日，尚未學習的月份先以參考股票的 STOCK_DAY 補齊日曆"""
+    today = taipei_now()
+    months = trading_calendar.missing_months(start_date, end_date, today)
+    outcomes = scheduler.map([
+        partial(fetch_month_prices, CALENDAR_REFERENCE_STOCK, year, month)
+        for year, month in months
+    ])
+    for (year, month), (rows, error) in zip(months, outcomes):
+        if error is None:
+            trading_calendar.learn_month(year, month, rows, today)
+
+    return trading_calendar.trading_days(start_date, end_date)
+
+def fetch_institutional_data(stock_code, start_date, end_date, frame):
+    """獲取三大法人買賣超資料"""
+    scheduler.run(plan_institutional_data({stock_code: frame}, start_date, end_date))
+    return frame
+
+def plan_institutional_data(targets, start_date, end_date):
+    """規劃三大法人資料的請求（每個交易日一次，整張表分給 targets 中的每檔股票）"""
+    tasks = []
+    stock_codes = list(targets)
+
+    # 只查詢交易日（跳過週末、國定假日與颱風假）
+    for current in get_trading_days(start_date, end_date):
+        date_str = format_date(current)
+
+        def merge(table, date_str=date_str):
+            for stock_code, frame in targets.items():
                 # 找到對應股票的資料
-                stock_data = next((row for row in result['data'] if row[0] == stock_code), None)
+                stock_data = table.get(stock_code)
 
                 if stock_data:
-                    date_str = format_date(current)
+                    frame.ingest(date_str, {
+                        '外資買進': stock_data[2],   # 外陸資買進股數(不含外資自營商)
+                        '外資賣出': stock_data[3],   # 外陸資賣出股數(不含外資自營商)
+                        '外資買賣超': stock_data[4], # 外陸資買賣超股數(不含外資自營商)
+                        '投信買進': stock_data[8],   # 投信買進股數
+                        '投信賣出': stock_data[9],   # 投信賣出股數
+                        '投信買賣超': stock_data[10], # 投信買賣超股數
+                        '自營商買賣超': stock_data[11], # 自營商買賣超股數
+                        '三大法人買賣超合計': stock_data[18] # 三大法人買賣超股數
+                    })
+
+        tasks.append(FetchTask(
+            f'institutional data for {current.strftime("%Y%m%d")}',
+            partial(fetch_market_snapshot, 'T86', current, stock_codes),
+            merge
+        ))
+
+    return tasks
+
+def fetch_fundamental_data(stock_code, start_date, end_date, frame):
+    """獲取基本面指標（本益比、殖利率、股價淨值比）"""
+    scheduler.run(plan_fundamental_data({stock_code: frame}, start_date, end_date))
+    return frame
 
-                    existing_row = next((d for d in collected_data if d['日期'] == date_str), None)
-                    if not existing_row:
-                        existing_row = OrderedDict()
-                        existing_row['日期'] = date_str
-                        existing_row['股票代碼'] = stock_code
-                        collected_data.append(existing_row)
+def plan_fundamental_data(targets, start_date, end_date):
+    """規劃基本面指標的請求（每個交易日一次，整張表分給 targets 中的每檔股票）"""
+    tasks = []
+    stock_codes = list(targets)
 
-                    existing_row.update({
+    for current in get_trading_days(start_date, end_date):
+        date_str = format_date(current)
+
+        def merge(table, date_str=date_str):
+            for stock_code, frame in targets.items():
+                # 找到對應股票的資料
+                stock_data = table.get(stock_code)
+
+                if stock_data:
+                    frame.ingest(date_str, {
                         '殖利率(%)': stock_data[2],      # 殖利率(%)
                         '股利年度': stock_data[3],        # 股利年度
                         '本益比': stock_data[4],          # 本益比
@@ -307,99 +1604,21 @@ def fetch_fundamental_data(stock_code, start_date, end_date, collected_data):
                         '財報年季': stock_data[6]         # 財報年/季
                     })
 
-        except Exception as e:
-            print(f"Error fetching fundamental data for {date_param}: {e}")
-
-        current += timedelta(days=1)
-
-    return collected_data
-
-def calculate_technical_indicators(collected_data):
-    """計算技術指標（移動平均線、漲跌幅）"""
-    if not collected_data:
-        return collected_data
-
-    # 需要有收盤價才能計算
-    for i, row in enumerate(collected_data):
-        # 計算漲跌幅百分比
-        if '收盤價' in row and '漲跌價差' in row:
-            try:
-                close = float(row['收盤價'].replace(',', ''))
-                change = float(row['漲跌價差'].replace(',', ''))
-                if close - change != 0:
-                    change_pct = (change / (close - change)) * 100
-                    row['漲跌幅(%)'] = f"{change_pct:.2f}"
-            except (ValueError, ZeroDivisionError):
-                pass
-
-        # 計算移動平均線（5日、10日、20日）
-        if '收盤價' in row:
-            for period in [5, 10, 20]:
-                if i >= period - 1:
-                    prices = []
-                    for j in range(i - period + 1, i + 1):
-                        if '收盤價' in collected_data[j]:
-                            try:
-                                price = float(collected_data[j]['收盤價'].replace(',', ''))
-                                prices.append(price)
-                            except ValueError:
-                                pass
-
-                    if len(prices) == period:
-                        ma = sum(prices) / period
-                        row[f'MA{period}'] = f"{ma:.2f}"
-
-    return collected_data
-
-def calculate_volume_analysis(collected_data):
+        tasks.append(FetchTask(
+            f'fundamental data for {current.strftime("%Y%m%d")}',
+            partial(fetch_market_snapshot, 'BWIBBU_d', current, stock_codes),
+            merge
+        ))
+
+    return tasks
+
+def calculate_technical_indicators(frame, config=DEFAULT_CONFIG):
+    """計算技術指標（漲跌幅、移動平均線，以及選用的 RSI、MACD、KD、布林通道）"""
+    return technical_indicators(frame, config)
+
+def calculate_volume_analysis(frame):
     """計算成交量分析（量變化率、量比）"""
-    if not collected_data:
-        return collected_data
-
-    for i, row in enumerate(collected_data):
-        # 計算量變化率（與前一日比較）
-        if i > 0 and '成交股數' in row and '成交股數' in collected_data[i-1]:
-            try:
-                current_vol = float(row['成交股數'].replace(',', ''))
-                prev_vol = float(collected_data[i-1]['成交股數'].replace(',', ''))
-                if prev_vol != 0:
-                    vol_change = ((current_vol - prev_vol) / prev_vol) * 100
-                    row['量變化率(%)'] = f"{vol_change:.2f}"
-            except (ValueError, ZeroDivisionError):
-                pass
-
-        # 計算量比（5日平均量）
-        if '成交股數' in row and i >= 4:
-            volumes = []
-            for j in range(i - 4, i + 1):
-                if '成交股數' in collected_data[j]:
-                    try:
-                        vol = float(collected_data[j]['成交股數'].replace(',', ''))
-                        volumes.append(vol)
-                    except ValueError:
-                        pass
-
-            if len(volumes) == 5:
-                avg_vol = sum(volumes) / 5
-                try:
-                    current_vol = float(row['成交股數'].replace(',', ''))
-                    if avg_vol != 0:
-                        vol_ratio = current_vol / avg_vol
-                        row['量比'] = f"{vol_ratio:.2f}"
-                except (ValueError, ZeroDivisionError):
-                    pass
-
-        # 計算換手率（需要流通股數，這裡暫時使用成交股數/10億作為簡化）
-        # 注意：真實換手率需要從其他API獲取實際流通股數
-        if '成交股數' in row:
-            try:
-                volume = float(row['成交股數'].replace(',', ''))
-                # 這是簡化計算，實際應該用實際流通股數
-                row['成交量(億股)'] = f"{volume / 100000000:.2f}"
-            except ValueError:
-                pass
-
-    return collected_data
+    return volume_analysis(frame)
 
 @app.route('/')
 def home():
@@ -407,13 +1626,110 @@ def home():
         'message': '台股資料抓取 API',
         'version': '2.0',
         'endpoints': {
-            '/api/stock-data': 'POST - 獲取股票資料'
+            '/api/stock-data': 'GET/POST - 獲取股票資料',
+            '/api/stock-data/batch': 'GET/POST - 一次獲取多檔股票資料',
+            '/api/jobs': 'POST - 將查詢排入背景工作',
+            '/api/jobs/<job_id>': 'GET - 背景工作的狀態與各階段進度',
+            '/api/jobs/<job_id>/result': 'GET - 下載背景工作的結果（JSON、CSV、Parquet、Arrow）',
+            '/api/export': 'GET/POST - 匯出 CSV、Parquet、Arrow 檔案',
+            '/api/screener': 'GET/POST - 依法人買賣超、本益比、殖利率、股價淨值比篩選與排序全市場股票',
+            '/health': 'GET - 健康檢查（上游延遲、請求合併、結果快取、速率控制與 warmer 狀態）',
+            '/metrics': 'GET - Prometheus 格式的執行指標'
         }
     })
 
+def warmer_status():
+    """讀取 warmer.py 最近一次執行的狀態；沒有狀態檔（warmer 未啟動）時 configured 為 false"""
+    try:
+        with open(WARMER_STATUS_PATH, 'r', encoding='utf-8') as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return {'configured': False, 'stale': False}
+
+    # 超過預定時間仍未執行，表示 warmer 可能已停止
+    status['configured'] = True
+    next_run = status.get('next_run')
+    status['stale'] = bool(next_run) and taipei_now() > datetime.strptime(next_run, '%Y-%m-%d %H:%M:%S') + timedelta(minutes=10)
+    return status
+
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    begin_request()
+
+# 依狀態碼記錄的錯誤原因
+ERROR_CAUSES = {400: 'bad_request', 404: 'no_data', 500: 'exception', 502: 'upstream', 503: 'upstream_unavailable'}
+
+@app.after_request
+def record_request(response):
+    """記錄請求次數與處理時間，並以 Server-Timing 標頭回報各階段的耗時（串流回應只包含開始輸出前的階段）"""
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUESTS.inc(route=route, status=response.status_code)
+    HTTP_SECONDS.observe(elapsed, route=route)
+    if response.status_code in ERROR_CAUSES:
+        ERRORS.inc(cause=ERROR_CAUSES[response.status_code])
+
+    response.headers['Server-Timing'] = server_timing(request_timings() or {}, elapsed)
+    response.headers['Timing-Allow-Origin'] = '*'
+    end_request()
+    return response
+
+@app.after_request
+def compress_response(response):
+    """依 Accept-Encoding 壓縮回應（brotli 或 gzip；比 record_request 先執行，壓縮時間計入總耗時）"""
+    with stage('compress'):
+        return compress(response, request.headers.get('Accept-Encoding'))
+
+def cache_hit_ratios():
+    """各資料集的快取命中率（dataset=result 為查詢結果快取）、請求合併的次數與結果快取的用量（/metrics 輸出時計算）"""
+    lookups = {}
+    results = result_cache.stats()
+    for (dataset, source), count in CACHE_LOOKUPS.samples():
+        hits, total = lookups.get(dataset, (0, 0))
+        lookups[dataset] = (hits + (count if source != 'miss' else 0), total + count)
+    return [
+        ('stock_api_cache_hit_ratio', '倉儲與快取的命中率',
+         [({'dataset': dataset}, hits / total) for dataset, (hits, total) in lookups.items() if total]),
+        ('stock_api_single_flight_calls', '上游請求合併（executed：實際執行；shared：共用其他請求的結果）',
+         [({'result': name}, count) for name, count in single_flight.stats().items()]),
+        ('stock_api_result_cache', '查詢結果快取（entries：項目數；bytes：使用的記憶體；evictions、invalidations：移除的項目數）',
+         [({'stat': name}, results[name]) for name in ('entries', 'bytes', 'evictions', 'invalidations')])
+    ]
+
+registry.add_collector(cache_hit_ratios)
+
+def rate_governor_metrics():
+    """證交所請求速率控制的狀態（/metrics 輸出時讀取）"""
+    if twse_client.governor is None:
+        return []
+    stats = twse_client.governor.stats()
+    return [
+        ('twse_rate_governor_rate', '各端點目前的每秒請求數上限（被限流後降低，逐步恢復）',
+         [({'endpoint': endpoint}, rate) for endpoint, rate in stats['rates'].items()]),
+        ('twse_rate_governor_circuit_open', '斷路器是否開啟（1 為暫停所有證交所請求）',
+         [({}, 1 if stats['circuit'] == 'open' else 0)]),
+        ('twse_rate_governor_events', '被限流的次數（throttled）與斷路器開啟時拒絕的請求數（rejected）',
+         [({'event': name}, stats[name]) for name in ('throttled', 'rejected')])
+    ]
+
+registry.add_collector(rate_governor_metrics)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 文字格式的執行指標"""
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/health')
 def health():
-    return jsonify({'status': 'healthy'})
+    return jsonify({
+        'status': 'healthy',
+        'upstream': twse_client.latency_stats(),
+        'single_flight': single_flight.stats(),
+        'result_cache': result_cache.stats(),
+        'rate_governor': twse_client.governor.stats() if twse_client.governor else None,
+        'warmer': warmer_status()
+    })
 
 if __name__ == '__main__':
     # 從環境變數讀取 PORT，Railway 會自動設定
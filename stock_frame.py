@@ -0,0 +1,166 @@
+"""以日期為索引、按欄位存放的股票資料表"""
+from bisect import bisect_left
+from collections import OrderedDict
+
+
+_format_integer = '{:,}'.format
+_format_price = '{:,.2f}'.format
+_format_decimal = '{:.2f}'.format
+
+
+def _format_change(value):
+    return ('+' if value > 0 else '-' if value < 0 else ' ') + _format_decimal(abs(value))
+
+
+# 證交所數值欄位的原始格式：(是否為整數, 格式化函式)
+# 資料進來時解析一次存成 int / float，輸出時才格式化回相同的字串
+NUMBER_FORMATS = {
+    '成交股數': (True, _format_integer),
+    '成交金額': (True, _format_integer),
+    '成交筆數': (True, _format_integer),
+    '開盤價': (False, _format_price),
+    '最高價': (False, _format_price),
+    '最低價': (False, _format_price),
+    '收盤價': (False, _format_price),
+    '漲跌價差': (False, _format_change),
+    '外資買進': (True, _format_integer),
+    '外資賣出': (True, _format_integer),
+    '外資買賣超': (True, _format_integer),
+    '投信買進': (True, _format_integer),
+    '投信賣出': (True, _format_integer),
+    '投信買賣超': (True, _format_integer),
+    '自營商買賣超': (True, _format_integer),
+    '三大法人買賣超合計': (True, _format_integer),
+    '本益比': (False, _format_decimal),
+    '殖利率(%)': (False, _format_decimal),
+    '股價淨值比': (False, _format_decimal),
+}
+
+
+def parse_value(name, text):
+    """將證交所的字串轉成數值；格式化後無法還原成原字串時（--、X0.00、不同的小數位數等）保留原字串"""
+    spec = NUMBER_FORMATS.get(name)
+    if spec is None or not isinstance(text, str):
+        return text
+    integer, format_value = spec
+    try:
+        value = int(text.replace(',', '')) if integer else float(text.replace(',', ''))
+    except ValueError:
+        return text
+    return value if format_value(value) == text else text
+
+
+def format_column(name, values):
+    """輸出欄位值：字串與缺值原樣輸出，數值依欄位格式化（技術指標等其他欄位的 float 為兩位小數）"""
+    spec = NUMBER_FORMATS.get(name)
+    if spec is None:
+        return [_format_decimal(v) if v.__class__ is float else v if v is None or v.__class__ is str else str(v)
+                for v in values]
+    format_number = spec[1]
+    return [v if v is None or v.__class__ is str else format_number(v) for v in values]
+
+
+class StockFrame:
+    """單一股票的資料表
+
+    每個欄位存成一個與 dates 等長的 list（缺值為 None），並以 日期 -> 列位置 的索引合併資料，
+    所有抓取函式寫入、指標計算讀取都不需要逐列搜尋。
+    """
+
+    def __init__(self, stock_code):
+        self.stock_code = stock_code
+        self.dates = []                  # 'YYYY-MM-DD'
+        self.index = {}                  # 日期 -> 列位置
+        self.columns = OrderedDict()     # 欄位 -> [值, ...]
+
+    def __len__(self):
+        return len(self.dates)
+
+    def _row(self, date_str):
+        """找到或建立該日期的列"""
+        position = self.index.get(date_str)
+        if position is None:
+            position = len(self.dates)
+            self.index[date_str] = position
+            self.dates.append(date_str)
+            for values in self.columns.values():
+                values.append(None)
+        return position
+
+    def merge(self, date_str, values):
+        """將某日的欄位寫入資料表"""
+        position = self._row(date_str)
+        for name, value in values.items():
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = [None] * len(self.dates)
+            column[position] = value
+
+    def ingest(self, date_str, values):
+        """將證交所的字串欄位解析成數值後寫入（每個值只解析一次，輸出時再格式化回原本的字串）"""
+        self.merge(date_str, {name: parse_value(name, text) for name, text in values.items()})
+
+    def sort(self):
+        """按日期排序所有欄位"""
+        if all(self.dates[i] <= self.dates[i + 1] for i in range(len(self.dates) - 1)):
+            return
+        order = sorted(range(len(self.dates)), key=self.dates.__getitem__)
+        self.dates = [self.dates[i] for i in order]
+        self.index = {date_str: i for i, date_str in enumerate(self.dates)}
+        for name, values in self.columns.items():
+            self.columns[name] = [values[i] for i in order]
+
+    def drop_before(self, date_str):
+        """刪除某日期之前的列（例如只用來暖機的歷史資料），frame 需已排序"""
+        keep = 0
+        while keep < len(self.dates) and self.dates[keep] < date_str:
+            keep += 1
+        if not keep:
+            return
+        self.dates = self.dates[keep:]
+        self.index = {d: i for i, d in enumerate(self.dates)}
+        for name, values in self.columns.items():
+            self.columns[name] = values[keep:]
+
+    def column(self, name):
+        """取得欄位值（沒有這個欄位時回傳全為 None 的 list）"""
+        values = self.columns.get(name)
+        return values if values is not None else [None] * len(self.dates)
+
+    def set_column(self, name, values):
+        self.columns[name] = list(values)
+
+    def to_records(self, column_order, since=None, typed=False):
+        """依欄位順序輸出每一列（日期、股票代碼之外，缺值的欄位不輸出）
+
+        數值欄位格式化成證交所的字串格式；typed 為 True 時直接輸出數值（匯出 Parquet、Arrow 時使用）。
+        since 為日期字串時只輸出該日（含）之後的列，frame 需已排序。
+        """
+        first = bisect_left(self.dates, since) if since else 0
+        columns = []
+        for name in column_order:
+            values = self.columns.get(name)
+            if values is not None:
+                values = values[first:] if typed else format_column(name, values[first:])
+            columns.append((name, values))
+
+        records = []
+        for i, date_str in enumerate(self.dates[first:]):
+            row = OrderedDict()
+            for name, values in columns:
+                if name == '日期':
+                    row[name] = date_str
+                elif name == '股票代碼':
+                    row[name] = self.stock_code
+                elif values is not None and values[i] is not None:
+                    row[name] = values[i]
+            records.append(row)
+        return records
+
+    @classmethod
+    def from_records(cls, records):
+        """由 list-of-dict 建立資料表（每列需有 日期、股票代碼）"""
+        frame = cls(records[0]['股票代碼'] if records else None)
+        for row in records:
+            frame.merge(row['日期'], {k: v for k, v in row.items() if k not in ('日期', '股票代碼')})
+        return frame
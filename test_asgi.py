@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""測試非同步模式的預先抓取（不連網，以假的客戶端與 ASGI app 代替）"""
+import asyncio
+import json
+import time
+
+from asgi import PrefetchMiddleware, Prefetcher, ThreadedWsgiToAsgi, request_data
+from single_flight import SingleFlight
+from stock_api import UpstreamRequest
+
+
+class FakeClient:
+    def __init__(self, fail=()):
+        self.calls = []
+        self.fail = fail
+
+    async def get_json(self, endpoint, params):
+        self.calls.append((endpoint, params['date']))
+        await asyncio.sleep(0.01)
+        if params['date'] in self.fail:
+            raise ValueError('throttled')
+        return {'stat': 'OK', 'date': params['date']}
+
+    async def aclose(self):
+        pass
+
+
+def fake_requests(stored, rounds):
+    """第一輪回傳交易日曆的請求，之後回傳其餘尚未保存的請求"""
+    def requests_for(data, batch):
+        rounds.append(batch)
+        dates = ['20240101'] if len(rounds) == 1 else ['20240102', '20240103']
+        return [UpstreamRequest(f'T86:{date}', 'T86', {'date': date}, stored.append)
+                for date in dates if {'stat': 'OK', 'date': date} not in stored]
+    return requests_for
+
+
+def call(app, scope, body=b''):
+    """以一個請求呼叫 ASGI app，回傳 app 收到的請求內容"""
+    chunks = [body[:5], body[5:]]
+
+    async def receive():
+        chunk = chunks.pop(0)
+        return {'type': 'http.request', 'body': chunk, 'more_body': bool(chunks)}
+
+    async def send(message):
+        pass
+
+    asyncio.run(app(scope, receive, send))
+
+
+def test_prefetch_then_forwards_request():
+    stored, rounds, seen = [], [], []
+
+    async def inner(scope, receive, send):
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        # 交給路由時資料已經保存，請求內容原封不動
+        seen.append((scope['path'], len(stored), body))
+
+    client = FakeClient()
+    app = PrefetchMiddleware(inner, Prefetcher(client, concurrency=2, requests_for=fake_requests(stored, rounds),
+                                               single_flight=SingleFlight()))
+    body = json.dumps({'stockCodes': ['2330', '2317'], 'startDate': '2024-01-01', 'endDate': '2024-01-03'}).encode()
+    call(app, {'type': 'http', 'method': 'POST', 'path': '/api/stock-data/batch', 'headers': []}, body)
+
+    assert seen == [('/api/stock-data/batch', 3, body)]
+    assert rounds == [True, True, True]
+    assert [date for _, date in client.calls] == ['20240101', '20240102', '20240103']
+
+    # 其他路由不預先抓取
+    call(app, {'type': 'http', 'method': 'GET', 'path': '/health', 'headers': []})
+    assert len(rounds) == 3 and seen[-1][0] == '/health'
+
+    # 串流查詢同樣先預先抓取
+    stored.clear()
+    call(app, {'type': 'http', 'method': 'POST', 'path': '/api/stock-data',
+               'headers': [(b'accept', b'application/x-ndjson')]}, body)
+    assert len(rounds) == 5 and seen[-1] == ('/api/stock-data', 2, body)
+
+
+def test_shared_requests_and_failures():
+    stored, rounds = [], []
+    client = FakeClient(fail={'20240101'})
+    flight = SingleFlight()
+    prefetcher = Prefetcher(client, requests_for=fake_requests(stored, rounds), single_flight=flight)
+
+    async def run():
+        upstream = UpstreamRequest('T86:20240102', 'T86', {'date': '20240102'}, stored.append)
+        await asyncio.gather(*(prefetcher.fetch(upstream) for _ in range(5)))
+        # 抓取失敗時停止，交由路由處理
+        await prefetcher.prefetch({'stockCode': '2330'})
+
+    asyncio.run(run())
+    assert client.calls == [('T86', '20240102'), ('T86', '20240101')]
+    assert prefetcher.stats == {'queries': 1, 'requests': 2, 'shared': 4, 'errors': 1}
+    assert rounds == [False]
+    assert flight.stats()['executed'] == 2
+
+
+def test_request_data_matches_route_parsing():
+    scope = {'method': 'GET', 'query_string': b'stockCode=2330&startDate=2024-01-01&dataTypes=price,technical&extra=RSI'}
+    data = request_data(scope, b'')
+    assert data['stockCode'] == '2330'
+    assert data['dataTypes'] == ['price', 'technical']
+    assert data['indicators'] == {'maPeriods': [5, 10, 20], 'extra': ['RSI']}
+    assert request_data({'method': 'POST'}, b'not json') is None
+    assert request_data({'method': 'POST'}, b'[]') is None
+
+
+def test_flask_requests_run_in_parallel():
+    def slow_app(environ, start_response):
+        time.sleep(0.3)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [environ['PATH_INFO'].encode()]
+
+    app = ThreadedWsgiToAsgi(slow_app, threads=4)
+    sent = []
+
+    async def request(path):
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            sent.append(message.get('body'))
+
+        await app({'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'http_version': '1.1',
+                   'headers': [], 'server': ('localhost', 80)}, receive, send)
+
+    async def run():
+        await asyncio.gather(request('/a'), request('/b'))
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    # 兩個各需 0.3 秒的請求同時處理，不是依序執行
+    assert time.perf_counter() - started < 0.5
+    assert b'/a' in sent and b'/b' in sent
+
+
+if __name__ == '__main__':
+    test_prefetch_then_forwards_request()
+    test_shared_requests_and_failures()
+    test_request_data_matches_route_parsing()
+    test_flask_requests_run_in_parallel()
+    print("✅ 非同步模式測試完成！")
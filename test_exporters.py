@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""測試匯出格式"""
+import io
+from collections import OrderedDict
+
+import exporters
+import stock_api
+from exporters import ExportError, make_writer
+from twse_client import TWSEError, TWSEUnavailable
+
+COLUMNS = ['日期', '股票代碼', '收盤價', '成交股數', '財報年季']
+BATCHES = [
+    [OrderedDict([('日期', '2024-01-02'), ('股票代碼', '2330'), ('收盤價', '593.00'), ('成交股數', '1,234'),
+                  ('財報年季', '112/3')])],
+    [OrderedDict([('日期', '2024-01-03'), ('股票代碼', '2330'), ('收盤價', '--')]),
+     OrderedDict([('日期', '2024-01-04'), ('股票代碼', '2330'), ('財報年季', 'say "hi"')])],
+]
+
+
+def export(fmt):
+    writer = make_writer(fmt, COLUMNS)
+    return writer.header() + b''.join(writer.write(batch) for batch in BATCHES) + writer.close()
+
+
+def test_csv_matches_browser_download():
+    # 與前端 convertToCSV 相同：BOM、標題不加引號、每個值加引號、缺值為空字串
+    assert export('csv').decode('utf-8') == (
+        '\ufeff日期,股票代碼,收盤價,成交股數,財報年季\n'
+        '"2024-01-02","2330","593.00","1,234","112/3"\n'
+        '"2024-01-03","2330","--","",""\n'
+        '"2024-01-04","2330","","","say ""hi"""'
+    )
+
+
+def test_arrow_and_parquet_are_typed():
+    if exporters.pa is None:
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    for table in (pa.ipc.open_stream(export('arrow')).read_all(), pq.read_table(io.BytesIO(export('parquet')))):
+        assert table.column_names == COLUMNS
+        assert str(table.schema.field('日期').type) == 'date32[day]'
+        assert table.column('收盤價').to_pylist() == [593.0, None, None]
+        assert table.column('成交股數').to_pylist() == [1234, None, None]
+        assert table.column('財報年季').to_pylist() == ['112/3', None, 'say "hi"']
+
+
+def test_unknown_format_is_rejected():
+    try:
+        make_writer('xls', COLUMNS)
+    except ExportError:
+        return
+    raise AssertionError('應該拒絕不支援的格式')
+
+
+def test_export_fails_before_streaming_when_fetch_fails():
+    original = stock_api.prefetch_query
+    params = {'stockCodes': ['2330'], 'startDate': '2024-01-02', 'endDate': '2024-01-31', 'dataTypes': ['price']}
+    try:
+        client = stock_api.app.test_client()
+        stock_api.prefetch_query = lambda *args: [('STOCK_DAY:2330:20240101', TWSEError('HTTP 500'))]
+        response = client.post('/api/export', json=params)
+        assert response.status_code == 502
+        assert response.get_json()['fetch_errors'] == ['STOCK_DAY:2330:20240101: HTTP 500']
+
+        # 斷路器開啟、請求額度用完（請求沒有送出）為 503
+        stock_api.prefetch_query = lambda *args: [('STOCK_DAY:2330:20240101', TWSEUnavailable('circuit open'))]
+        assert client.post('/api/export', json=params).status_code == 503
+    finally:
+        stock_api.prefetch_query = original
+
+
+def test_export_aborts_when_fetch_fails_mid_stream():
+    original = stock_api.iter_stock_events
+
+    def events(targets, start_date, end_date, data_types, config, fetch_errors, typed):
+        yield {'type': 'rows', 'count': 1, 'data': BATCHES[0]}
+        fetch_errors.append(('2330 2024-02', TWSEError('HTTP 500')))
+        yield {'type': 'progress'}
+
+    writer = make_writer('csv', COLUMNS)
+    chunks = []
+    try:
+        stock_api.iter_stock_events = events
+        for chunk in stock_api.export_stock_data(writer, {}, None, None, [], None):
+            chunks.append(chunk)
+    except ExportError as e:
+        assert '2330 2024-02' in str(e)
+    else:
+        raise AssertionError('抓取失敗時應中斷輸出')
+    finally:
+        stock_api.iter_stock_events = original
+    # 已輸出檔頭與第一批資料，但沒有檔尾
+    assert len(chunks) == 2
+
+
+if __name__ == '__main__':
+    test_csv_matches_browser_download()
+    test_arrow_and_parquet_are_typed()
+    test_unknown_format_is_rejected()
+    test_export_fails_before_streaming_when_fetch_fails()
+    test_export_aborts_when_fetch_fails_mid_stream()
+    print("✅ 匯出格式測試完成！")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""測試上游請求排程器"""
+import threading
+import time
+
+from fetch_scheduler import FetchScheduler, FetchTask
+
+
+def test_merge_order_is_deterministic():
+    scheduler = FetchScheduler(max_workers=4)
+    merged = []
+
+    def slow(value):
+        # 越前面的任務越慢，合併順序仍需與提交順序相同
+        time.sleep(0.01 * (5 - value))
+        return value
+
+    tasks = [FetchTask(f'task {i}', lambda i=i: slow(i), merged.append) for i in range(5)]
+    assert scheduler.run(tasks) == []
+    assert merged == [0, 1, 2, 3, 4]
+
+
+def test_concurrency_is_bounded():
+    scheduler = FetchScheduler(max_workers=3)
+    lock = threading.Lock()
+    state = {'running': 0, 'peak': 0}
+
+    def fetch():
+        with lock:
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+        time.sleep(0.02)
+        with lock:
+            state['running'] -= 1
+
+    started = time.time()
+    scheduler.map([fetch] * 9)
+    assert state['peak'] == 3
+    # 9 個 20ms 的請求，3 個並行約需 60ms，遠小於逐一執行的 180ms
+    assert time.time() - started < 0.15
+
+
+def test_errors_are_reported():
+    scheduler = FetchScheduler(max_workers=2)
+    merged = []
+
+    def boom():
+        raise ValueError('timeout')
+
+    tasks = [FetchTask('ok', lambda: 1, merged.append), FetchTask('bad', boom, merged.append)]
+    errors = scheduler.run(tasks)
+    assert merged == [1]
+    assert [label for label, _ in errors] == ['bad']
+
+
+def test_iter_run_yields_before_later_tasks_finish():
+    scheduler = FetchScheduler(max_workers=2)
+    release = threading.Event()
+    merged = []
+
+    tasks = [FetchTask('fast', lambda: 1, merged.append),
+             FetchTask('slow', lambda: release.wait(1) and 2, merged.append)]
+    results = scheduler.iter_run(tasks)
+
+    # 第一個任務合併後即可處理，第二個請求仍在進行中
+    task, error = next(results)
+    assert task.label == 'fast' and error is None and merged == [1]
+    release.set()
+    assert [(task.label, error) for task, error in results] == [('slow', None)]
+    assert merged == [1, 2]
+
+
+if __name__ == '__main__':
+    test_merge_order_is_deterministic()
+    test_concurrency_is_bounded()
+    test_errors_are_reported()
+    test_iter_run_yields_before_later_tasks_finish()
+    print("✅ 排程器測試完成！")
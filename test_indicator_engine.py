@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""差異測試：向量化指標引擎的輸出需與原本逐列計算的版本完全相同"""
+import random
+import tempfile
+from collections import OrderedDict
+
+import indicators
+from indicators import (IndicatorConfig, IndicatorStateStore, apply_indicators, parse_indicator_config,
+                        technical_indicators, volume_analysis)
+from stock_frame import StockFrame
+
+
+# ===== 原本的實作（自 stock_api.py 複製，作為對照組）=====
+
+def calculate_technical_indicators(collected_data):
+    """計算技術指標（移動平均線、漲跌幅）"""
+    if not collected_data:
+        return collected_data
+
+    # 需要有收盤價才能計算
+    for i, row in enumerate(collected_data):
+        # 計算漲跌幅百分比
+        if '收盤價' in row and '漲跌價差' in row:
+            try:
+                close = float(row['收盤價'].replace(',', ''))
+                change = float(row['漲跌價差'].replace(',', ''))
+                if close - change != 0:
+                    change_pct = (change / (close - change)) * 100
+                    row['漲跌幅(%)'] = f"{change_pct:.2f}"
+            except (ValueError, ZeroDivisionError):
+                pass
+
+        # 計算移動平均線（5日、10日、20日）
+        if '收盤價' in row:
+            for period in [5, 10, 20]:
+                if i >= period - 1:
+                    prices = []
+                    for j in range(i - period + 1, i + 1):
+                        if '收盤價' in collected_data[j]:
+                            try:
+                                price = float(collected_data[j]['收盤價'].replace(',', ''))
+                                prices.append(price)
+                            except ValueError:
+                                pass
+
+                    if len(prices) == period:
+                        ma = sum(prices) / period
+                        row[f'MA{period}'] = f"{ma:.2f}"
+
+    return collected_data
+
+
+def calculate_volume_analysis(collected_data):
+    """計算成交量分析（量變化率、量比）"""
+    if not collected_data:
+        return collected_data
+
+    for i, row in enumerate(collected_data):
+        # 計算量變化率（與前一日比較）
+        if i > 0 and '成交股數' in row and '成交股數' in collected_data[i-1]:
+            try:
+                current_vol = float(row['成交股數'].replace(',', ''))
+                prev_vol = float(collected_data[i-1]['成交股數'].replace(',', ''))
+                if prev_vol != 0:
+                    vol_change = ((current_vol - prev_vol) / prev_vol) * 100
+                    row['量變化率(%)'] = f"{vol_change:.2f}"
+            except (ValueError, ZeroDivisionError):
+                pass
+
+        # 計算量比（5日平均量）
+        if '成交股數' in row and i >= 4:
+            volumes = []
+            for j in range(i - 4, i + 1):
+                if '成交股數' in collected_data[j]:
+                    try:
+                        vol = float(collected_data[j]['成交股數'].replace(',', ''))
+                        volumes.append(vol)
+                    except ValueError:
+                        pass
+
+            if len(volumes) == 5:
+                avg_vol = sum(volumes) / 5
+                try:
+                    current_vol = float(row['成交股數'].replace(',', ''))
+                    if avg_vol != 0:
+                        vol_ratio = current_vol / avg_vol
+                        row['量比'] = f"{vol_ratio:.2f}"
+                except (ValueError, ZeroDivisionError):
+                    pass
+
+        # 計算換手率（需要流通股數，這裡暫時使用成交股數/10億作為簡化）
+        if '成交股數' in row:
+            try:
+                volume = float(row['成交股數'].replace(',', ''))
+                row['成交量(億股)'] = f"{volume / 100000000:.2f}"
+            except ValueError:
+                pass
+
+    return collected_data
+
+
+# ===== 測試資料 =====
+
+def make_rows(seed, count=300):
+    """產生隨機資料：包含停牌（--）、除權息（X0.00）、缺少股價的日期、零成交量與大量整數價"""
+    rng = random.Random(seed)
+    rows = []
+    price = rng.choice([12.35, 98.7, 590.0, 1005.0])
+    for day in range(count):
+        row = OrderedDict([('日期', f'2024-{day // 28 + 1:02d}-{day % 28 + 1:02d}'), ('股票代碼', '2330')])
+        roll = rng.random()
+        if roll < 0.03:
+            # 只有法人資料的日期
+            rows.append(row)
+            continue
+
+        tick = 0.05 if price < 100 else (0.5 if price < 1000 else 5)
+        change = round(rng.randint(-6, 6) * tick, 2)
+        price = max(round(price + change, 2), tick)
+        volume = rng.choice([0, rng.randint(1, 10 ** 9), rng.randint(1, 5000) * 1000])
+
+        row['收盤價'] = '--' if roll < 0.05 else f'{price:,.2f}'
+        row['漲跌價差'] = 'X0.00' if roll < 0.08 else f'{change:+.2f}'
+        row['最高價'] = f'{price + tick:,.2f}'
+        row['最低價'] = f'{max(price - tick, 0):,.2f}'
+        row['成交股數'] = '--' if roll < 0.04 else f'{volume:,}'
+        rows.append(row)
+    return rows
+
+
+def make_tie_rows():
+    """平均值剛好落在兩位小數進位邊界的資料（例如 10 日均價 xx.xx5）"""
+    closes = ['10.01', '10.00', '10.00', '10.00', '10.00', '10.00', '10.00', '10.00', '10.00', '10.04',
+              '0.15', '0.25', '0.35', '0.45', '0.55', '0.65', '0.75', '0.85', '0.95', '1.05',
+              '1.15', '1.25', '1.35', '1.45', '2.50', '2.51', '2.52', '2.53', '2.54', '2.55']
+    return [OrderedDict([('日期', f'2024-01-{i + 1:02d}'), ('股票代碼', '2330'),
+                         ('收盤價', close), ('漲跌價差', '+0.05'), ('成交股數', f'{(i + 1) * 3:,}')])
+            for i, close in enumerate(closes)]
+
+
+def assert_same_as_reference(rows):
+    expected = calculate_volume_analysis(calculate_technical_indicators([OrderedDict(r) for r in rows]))
+
+    frame = StockFrame.from_records(rows)
+    volume_analysis(technical_indicators(frame))
+    columns = ['漲跌幅(%)', 'MA5', 'MA10', 'MA20', '量變化率(%)', '量比', '成交量(億股)']
+    actual = frame.to_records(['日期', '股票代碼'] + columns)
+
+    for exp, act in zip(expected, actual):
+        for col in columns:
+            assert exp.get(col) == act.get(col), (exp['日期'], col, exp.get(col), act.get(col))
+
+
+def test_matches_reference_on_random_data():
+    for seed in range(20):
+        assert_same_as_reference(make_rows(seed))
+
+
+def test_matches_reference_on_rounding_ties():
+    assert_same_as_reference(make_tie_rows())
+
+
+def test_matches_reference_on_short_ranges():
+    rows = make_rows(99, count=30)
+    for count in range(0, 8):
+        assert_same_as_reference(rows[:count])
+
+
+def test_custom_periods_and_extra_indicators():
+    config = parse_indicator_config({'maPeriods': [3, 60], 'extra': ['rsi', 'MACD', 'KD', 'BB']})
+    assert config == IndicatorConfig((3, 60), ('RSI', 'MACD', 'KD', 'BB'))
+
+    frame = StockFrame.from_records(make_rows(7, count=120))
+    technical_indicators(frame, config)
+    assert 'MA5' not in frame.columns
+    assert frame.column('MA60')[58] is None
+
+    rsi = [float(v) for v in frame.column('RSI') if v is not None]
+    assert rsi and all(0 <= v <= 100 for v in rsi)
+
+    k_values = [float(v) for v in frame.column('K值') if v is not None]
+    assert k_values and all(0 <= v <= 100 for v in k_values)
+
+    # 布林通道中軌即 20 日均線，上軌 >= 中軌 >= 下軌
+    ma20 = StockFrame.from_records(make_rows(7, count=120))
+    technical_indicators(ma20)
+    assert frame.column('布林中軌') == ma20.column('MA20')
+    for upper, middle, lower in zip(frame.column('布林上軌'), frame.column('布林中軌'), frame.column('布林下軌')):
+        if middle is not None:
+            assert float(upper) >= float(middle) >= float(lower)
+
+    # OSC = DIF - MACD
+    for dif, signal, osc in zip(frame.column('DIF'), frame.column('MACD'), frame.column('OSC')):
+        if osc is not None:
+            assert abs(float(dif) - float(signal) - float(osc)) <= 0.011
+
+
+def test_rejects_invalid_config():
+    for options in ({'maPeriods': [1]}, {'maPeriods': ['abc']}, {'extra': ['CCI']}):
+        try:
+            parse_indicator_config(options)
+        except ValueError:
+            continue
+        raise AssertionError(f'應該拒絕 {options}')
+
+
+ALL_TYPES = ['technical', 'volume']
+FULL_CONFIG = IndicatorConfig((5, 10, 20, 60), ('RSI', 'MACD', 'KD', 'BB'))
+
+
+def records_of(frame, config=FULL_CONFIG):
+    columns = ['日期', '股票代碼'] + indicators.technical_columns(config) + indicators.VOLUME_COLUMNS
+    return [dict(r) for r in frame.to_records(columns)]
+
+
+def frame_of(rows):
+    return StockFrame.from_records([OrderedDict(r) for r in rows])
+
+
+def test_incremental_extension_matches_full_computation():
+    rows = make_rows(3, count=200)
+    output_start = rows[100]['日期']
+    with tempfile.TemporaryDirectory() as root:
+        store = IndicatorStateStore(root)
+        for count in (150, 151, 152, 200):
+            frame = frame_of(rows[:count])
+            apply_indicators(frame, ALL_TYPES, FULL_CONFIG, store, output_start)
+
+            expected = frame_of(rows[:count])
+            apply_indicators(expected, ALL_TYPES, FULL_CONFIG, None, output_start)
+            assert records_of(frame)[100:] == records_of(expected)[100:]
+
+        assert store.get('2330', FULL_CONFIG)['dates'][-1] == rows[199]['日期']
+
+
+def test_extension_only_computes_new_days():
+    rows = make_rows(4, count=120)
+    output_start = rows[40]['日期']
+    with tempfile.TemporaryDirectory() as root:
+        store = IndicatorStateStore(root)
+        apply_indicators(frame_of(rows[:100]), ALL_TYPES, FULL_CONFIG, store, output_start)
+
+        computed = []
+        original = indicators.compute_technical
+
+        def spy(arrays, config, start=0, seeds=None):
+            computed.append(len(arrays['close']) - start)
+            return original(arrays, config, start, seeds)
+
+        indicators.compute_technical = spy
+        try:
+            # 前導資料較短的查詢（不同的暖機起點）也能沿用
+            apply_indicators(frame_of(rows[20:101]), ALL_TYPES, FULL_CONFIG, store, rows[60]['日期'])
+            # 已計算過的區間不需要重算
+            apply_indicators(frame_of(rows[30:90]), ALL_TYPES, FULL_CONFIG, store, rows[50]['日期'])
+        finally:
+            indicators.compute_technical = original
+        assert computed == [1]
+
+
+def test_stale_state_is_not_reused():
+    rows = make_rows(5, count=120)
+    with tempfile.TemporaryDirectory() as root:
+        store = IndicatorStateStore(root)
+        apply_indicators(frame_of(rows[50:120]), ALL_TYPES, FULL_CONFIG, store, rows[80]['日期'])
+
+        # 查詢起點早於先前的計算起點時需要重新計算
+        frame = frame_of(rows[:120])
+        apply_indicators(frame, ALL_TYPES, FULL_CONFIG, store, rows[40]['日期'])
+        expected = frame_of(rows[:120])
+        apply_indicators(expected, ALL_TYPES, FULL_CONFIG, None, rows[40]['日期'])
+        assert records_of(frame) == records_of(expected)
+
+
+def test_state_without_prices_is_not_reused():
+    rows = make_rows(6, count=120)
+    output_start = rows[40]['日期']
+    with tempfile.TemporaryDirectory() as root:
+        store = IndicatorStateStore(root)
+        # 只有三大法人資料（沒有股價）的查詢：指標全為空值，不保存 state
+        institutional = [OrderedDict([('日期', row['日期']), ('股票代碼', '2330'), ('外資買賣超', '1,000')])
+                         for row in rows]
+        apply_indicators(frame_of(institutional), ALL_TYPES, FULL_CONFIG, store, output_start)
+        assert store.get('2330', FULL_CONFIG) is None
+
+        # 之後同一段交易日含股價的查詢需要算出指標
+        frame = frame_of(rows)
+        apply_indicators(frame, ALL_TYPES, FULL_CONFIG, store, output_start)
+        expected = frame_of(rows)
+        apply_indicators(expected, ALL_TYPES, FULL_CONFIG, None, output_start)
+        assert records_of(frame) == records_of(expected)
+        assert records_of(frame)[100]['MA5'] is not None
+
+        # 同樣的交易日但股價不同（例如先前的資料有誤）時不沿用
+        changed = [OrderedDict(row, 收盤價='1,234.00') if i == 90 else row for i, row in enumerate(rows)]
+        frame = frame_of(changed)
+        apply_indicators(frame, ALL_TYPES, FULL_CONFIG, store, output_start)
+        expected = frame_of(changed)
+        apply_indicators(expected, ALL_TYPES, FULL_CONFIG, None, output_start)
+        assert records_of(frame) == records_of(expected)
+
+
+def test_streaming_chunks_keep_only_needed_history():
+    # 同串流輸出：每批加入新的列、計算指標、輸出後只保留之後需要的前導資料
+    rows = make_rows(7, count=280)
+    states = indicators.MemoryStateStore()
+    frame = StockFrame('2330')
+    streamed = []
+    for begin in range(0, 280, 28):
+        for row in rows[begin:begin + 28]:
+            frame.ingest(row['日期'], {name: value for name, value in row.items() if name not in ('日期', '股票代碼')})
+        since = rows[begin]['日期']
+        apply_indicators(frame, ALL_TYPES, FULL_CONFIG, states, rows[0]['日期'] if begin == 0 else since)
+        streamed += [record for record in records_of(frame) if record['日期'] >= since]
+        frame.drop_before(indicators.history_start(frame, FULL_CONFIG))
+        assert len(frame) < 28 + 2 * indicators.max_window(FULL_CONFIG)
+
+    expected = frame_of(rows)
+    apply_indicators(expected, ALL_TYPES, FULL_CONFIG, None, rows[0]['日期'])
+    assert streamed == records_of(expected)
+
+
+def test_warmup_days():
+    assert indicators.warmup_days(IndicatorConfig((5, 10, 20), ()), ['technical']) == 19
+    assert indicators.warmup_days(IndicatorConfig((5, 10, 20), ()), ['volume']) == 5
+    assert indicators.warmup_days(IndicatorConfig((5, 10, 20), ()), ['price']) == 0
+    assert indicators.warmup_days(FULL_CONFIG, ['technical']) > 60
+
+
+if __name__ == '__main__':
+    test_matches_reference_on_random_data()
+    test_matches_reference_on_rounding_ties()
+    test_matches_reference_on_short_ranges()
+    test_custom_periods_and_extra_indicators()
+    test_rejects_invalid_config()
+    test_incremental_extension_matches_full_computation()
+    test_extension_only_computes_new_days()
+    test_stale_state_is_not_reused()
+    test_state_without_prices_is_not_reused()
+    test_streaming_chunks_keep_only_needed_history()
+    test_warmup_days()
+    print("✅ 指標引擎差異測試完成！")
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""測試背景工作佇列"""
+import json
+import os
+import tempfile
+import threading
+import time
+
+from jobs import JobQueue
+
+
+def wait_for(queue, job_id, timeout=2):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'工作 {job_id} 沒有完成')
+
+
+def test_job_reports_progress_and_stores_result():
+    release = threading.Event()
+    reported = threading.Event()
+
+    def runner(params, report):
+        report('price', 3, 4)
+        report('institutional', 0, 10)
+        reported.set()
+        release.wait(1)
+        report('institutional', 10, 10)
+        report('indicators', 1, 1)
+        return {'success': True, 'count': params['n']}, 200
+
+    with tempfile.TemporaryDirectory() as root:
+        queue = JobQueue(root)
+        queue.runner = runner
+        info = queue.submit({'n': 3}, calls=120)
+        assert info['calls'] == 120
+
+        reported.wait(1)
+        progress = queue.info(queue.get(info['id']))['progress']
+        assert progress['stages'] == {'price': 75.0, 'institutional': 0.0}
+        assert progress['percent'] == 21.4
+        release.set()
+
+        job = wait_for(queue, info['id'])
+        assert job['status'] == 'done' and job['http_status'] == 200
+        assert queue.info(job)['progress']['percent'] == 100.0
+        with open(queue.result_path(info['id']), encoding='utf-8') as f:
+            assert json.load(f) == {'success': True, 'count': 3}
+
+        # 其他 worker（另一個 JobQueue）從磁碟讀取狀態
+        other = JobQueue(root)
+        assert other.get(info['id'])['status'] == 'done'
+        assert other.get('missing') is None
+        assert other.get('../etc') is None
+
+
+def test_jobs_run_in_order_and_report_position():
+    release = threading.Event()
+    order = []
+
+    def runner(params, report):
+        release.wait(1)
+        order.append(params['name'])
+        return {}, 200
+
+    with tempfile.TemporaryDirectory() as root:
+        queue = JobQueue(root, max_workers=1)
+        queue.runner = runner
+        first = queue.submit({'name': 'first'})
+        while queue.get(first['id'])['status'] == 'queued':
+            time.sleep(0.01)
+        second = queue.submit({'name': 'second'})
+        third = queue.submit({'name': 'third'})
+        assert (second['position'], third['position']) == (0, 1)
+        release.set()
+
+        for info in (first, second, third):
+            wait_for(queue, info['id'])
+        assert order == ['first', 'second', 'third']
+
+
+def test_failed_job_records_error():
+    def runner(params, report):
+        raise RuntimeError('upstream down')
+
+    with tempfile.TemporaryDirectory() as root:
+        queue = JobQueue(root)
+        queue.runner = runner
+        job = wait_for(queue, queue.submit({})['id'])
+        assert job['status'] == 'failed'
+        assert queue.info(job)['error'] == 'upstream down'
+
+
+def test_unfinished_jobs_resume_after_restart():
+    with tempfile.TemporaryDirectory() as root:
+        # 模擬程序在執行途中結束：磁碟上留下 running 狀態的工作
+        job = {'id': 'abc123', 'status': 'running', 'params': {'n': 5}, 'calls': 300,
+               'submitted': time.time() - 60, 'started': time.time() - 50, 'finished': None, 'resumed': 0,
+               'stages': {'institutional': {'done': 120, 'total': 250}}, 'http_status': None, 'error': None}
+        with open(os.path.join(root, 'abc123.json'), 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+
+        queue = JobQueue(root)
+        queue.runner = lambda params, report: ({'count': params['n']}, 200)
+        assert queue.resume() == ['abc123']
+        assert queue.resume() == []
+
+        job = wait_for(queue, 'abc123')
+        assert job['status'] == 'done' and job['resumed'] == 1
+
+
+def test_running_job_is_not_resumed_twice():
+    release = threading.Event()
+
+    def runner(params, report):
+        release.wait(1)
+        return {}, 200
+
+    with tempfile.TemporaryDirectory() as root:
+        queue = JobQueue(root)
+        queue.runner = runner
+        job_id = queue.submit({})['id']
+
+        # 另一個 worker 啟動時，工作仍由原本的程序持有檔案鎖
+        other = JobQueue(root)
+        other.runner = runner
+        assert other.resume() == []
+        release.set()
+        wait_for(queue, job_id)
+
+
+def test_finished_jobs_expire():
+    with tempfile.TemporaryDirectory() as root:
+        queue = JobQueue(root, ttl=0)
+        queue.runner = lambda params, report: ({}, 200)
+        job_id = queue.submit({})['id']
+        wait_for(queue, job_id)
+        time.sleep(0.01)
+        queue.submit({})
+        assert queue.get(job_id) is None
+        assert not os.path.exists(queue.result_path(job_id))
+
+
+if __name__ == '__main__':
+    test_job_reports_progress_and_stores_result()
+    test_jobs_run_in_order_and_report_position()
+    test_failed_job_records_error()
+    test_unfinished_jobs_resume_after_restart()
+    test_running_job_is_not_resumed_twice()
+    test_finished_jobs_expire()
+    print("✅ 背景工作測試完成！")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""測試執行指標與 Server-Timing"""
+import time
+
+import metrics
+from metrics import Registry, begin_request, end_request, request_timings, server_timing, stage
+
+
+def test_counter_and_histogram_render_prometheus_text():
+    registry = Registry()
+    calls = registry.counter('twse_upstream_requests_total', 'upstream calls', ['endpoint', 'outcome'])
+    latency = registry.histogram('twse_upstream_request_seconds', 'upstream latency', ['endpoint'],
+                                 buckets=(0.1, 1))
+    calls.inc(endpoint='T86', outcome='ok')
+    calls.inc(2, endpoint='T86', outcome='ok')
+    calls.inc(endpoint='STOCK_DAY', outcome='error')
+    latency.observe(0.05, endpoint='T86')
+    latency.observe(0.5, endpoint='T86')
+    latency.observe(3, endpoint='T86')
+    registry.add_collector(lambda: [('cache_hit_ratio', 'hit ratio', [({'dataset': 'T86'}, 0.75)])])
+
+    lines = registry.render().splitlines()
+    assert '# TYPE twse_upstream_requests_total counter' in lines
+    assert 'twse_upstream_requests_total{endpoint="T86",outcome="ok"} 3' in lines
+    assert 'twse_upstream_requests_total{endpoint="STOCK_DAY",outcome="error"} 1' in lines
+    assert '# TYPE twse_upstream_request_seconds histogram' in lines
+    assert 'twse_upstream_request_seconds_bucket{endpoint="T86",le="0.1"} 1' in lines
+    assert 'twse_upstream_request_seconds_bucket{endpoint="T86",le="1.0"} 2' in lines
+    assert 'twse_upstream_request_seconds_bucket{endpoint="T86",le="+Inf"} 3' in lines
+    assert 'twse_upstream_request_seconds_sum{endpoint="T86"} 3.55' in lines
+    assert 'twse_upstream_request_seconds_count{endpoint="T86"} 3' in lines
+    assert '# TYPE cache_hit_ratio gauge' in lines
+    assert 'cache_hit_ratio{dataset="T86"} 0.75' in lines
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter('errors_total', 'errors', ['cause']).inc(cause='say "hi"\n')
+    assert 'errors_total{cause="say \\"hi\\"\\n"} 1' in registry.render()
+
+
+def test_stages_feed_request_timings_and_histogram():
+    before = metrics.STAGE_SECONDS.count(stage='indicators')
+    begin_request()
+    with stage('fetch'):
+        time.sleep(0.01)
+    with stage('indicators'):
+        pass
+    with stage('fetch'):
+        pass
+    timings = request_timings()
+    end_request()
+
+    assert list(timings) == ['fetch', 'indicators']
+    assert timings['fetch'] >= 0.01
+    assert metrics.STAGE_SECONDS.count(stage='indicators') == before + 1
+    assert request_timings() is None
+
+    header = server_timing({'plan': 0.0012, 'fetch': 0.25}, 0.3)
+    assert header == 'plan;dur=1.2, fetch;dur=250.0, total;dur=300.0'
+
+
+def test_stage_works_as_decorator():
+    @stage('plan')
+    def plan():
+        return 'planned'
+
+    before = metrics.STAGE_SECONDS.count(stage='plan')
+    assert plan() == 'planned' and plan() == 'planned'
+    assert metrics.STAGE_SECONDS.count(stage='plan') == before + 2
+
+
+if __name__ == '__main__':
+    test_counter_and_histogram_render_prometheus_text()
+    test_label_values_are_escaped()
+    test_stages_feed_request_timings_and_histogram()
+    test_stage_works_as_decorator()
+    print("✅ 執行指標測試完成！")
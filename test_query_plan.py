@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""測試查詢計畫（上游請求數的估算）與立即處理的門檻（以空的暫存倉儲與快取代替，不連網）"""
+import os
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import stock_api
+from rate_governor import RateGovernor
+from trading_calendar import TradingCalendar
+from twse_cache import MonthBlockStore, SnapshotStore
+from warehouse import Warehouse
+
+DATA_TYPES = ['price', 'institutional', 'fundamental']
+
+
+@contextmanager
+def cold_stores():
+    """以空的暫存倉儲、快取與交易日曆執行"""
+    names = ('warehouse', 'snapshot_store', 'month_store', 'trading_calendar')
+    original = {name: getattr(stock_api, name) for name in names}
+    with tempfile.TemporaryDirectory() as root:
+        try:
+            stock_api.warehouse = Warehouse(os.path.join(root, 'warehouse.sqlite3'))
+            stock_api.snapshot_store = SnapshotStore(os.path.join(root, 'snapshots'))
+            stock_api.month_store = MonthBlockStore(os.path.join(root, 'stock_day'))
+            stock_api.trading_calendar = TradingCalendar(os.path.join(root, 'trading_calendar.json'))
+            yield
+        finally:
+            for name, value in original.items():
+                setattr(stock_api, name, value)
+
+
+def test_thirty_day_queries_stay_live():
+    # 原本的上限：三大法人查詢的日期範圍不超過 30 天
+    with cold_stores():
+        worst = max(stock_api.plan_query(['2330'], start, start + timedelta(days=30), DATA_TYPES)['calls']
+                    for start in (datetime(2023, 1, 1) + timedelta(days=offset) for offset in range(365)))
+    assert worst == 52                          # 跨三個月份：股價 3、三大法人 23、基本面 23、交易日曆 3
+
+    # 預設的速率限制（每秒 2 次、burst 5）下，立即處理的門檻涵蓋這些查詢
+    governor = RateGovernor({'STOCK_DAY': 2.0, 'T86': 2.0, 'BWIBBU_d': 2.0}, burst=5)
+    assert stock_api.live_call_budget(governor, stock_api.LIVE_MAX_SECONDS) >= worst
+    assert not stock_api.needs_job({'calls': worst})
+
+
+def test_cached_calendar_month_is_not_counted():
+    today = stock_api.taipei_now()
+    first = datetime(today.year, today.month, 1)
+    with cold_stores():
+        # 當月的交易日曆每次都要重新確認，參考股票的 STOCK_DAY 不在快取時需要一次請求
+        plan = stock_api.plan_query(['2317'], first, first, ['institutional'])
+        assert plan['calendar']['calls'] == 1
+
+        stock_api.month_store.put(stock_api.CALENDAR_REFERENCE_STOCK, today.year, today.month, [])
+        plan = stock_api.plan_query(['2317'], first, first, ['institutional'])
+        assert plan['calendar']['calls'] == 0
+        assert plan['calls'] == plan['institutional']['calls']
+
+
+def test_storage_follows_cache_dir_and_is_created_lazily():
+    with tempfile.TemporaryDirectory() as root:
+        # 匯入時不建立任何目錄或檔案
+        script = 'import stock_api, asgi, warmer, os; print(os.listdir(os.environ["TWSE_CACHE_DIR"]))'
+        env = dict(os.environ, TWSE_CACHE_DIR=root)
+        env.pop('WAREHOUSE_PATH', None)
+        output = subprocess.run([sys.executable, '-c', script], env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        assert output.strip() == '[]'
+
+        # 匯入後才設定的 TWSE_CACHE_DIR 由 open_storage 採用
+        names = ('warehouse', 'snapshot_store', 'month_store', 'indicator_store', 'single_flight',
+                 'trading_calendar', 'WARMER_STATUS_PATH')
+        saved = {name: getattr(stock_api, name) for name in names}
+        original = os.environ.get('TWSE_CACHE_DIR')
+        os.environ['TWSE_CACHE_DIR'] = os.path.join(root, 'later')
+        try:
+            stock_api.open_storage()
+            assert stock_api.warehouse.path == os.path.join(root, 'later', 'warehouse.sqlite3')
+            assert stock_api.WARMER_STATUS_PATH == os.path.join(root, 'later', 'warmer_status.json')
+            assert not os.path.exists(os.path.join(root, 'later'))
+            stock_api.warehouse.put_month('2330', 2024, 1, [])
+            assert 'warehouse.sqlite3' in os.listdir(os.path.join(root, 'later'))
+        finally:
+            if original is None:
+                os.environ.pop('TWSE_CACHE_DIR', None)
+            else:
+                os.environ['TWSE_CACHE_DIR'] = original
+            for name, value in saved.items():
+                setattr(stock_api, name, value)
+
+
+if __name__ == '__main__':
+    test_thirty_day_queries_stay_live()
+    test_cached_calendar_month_is_not_counted()
+    test_storage_follows_cache_dir_and_is_created_lazily()
+    print("✅ 查詢計畫測試完成！")
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""測試證交所請求的速率控制（token bucket、優先順序、限流降速與斷路器；以假的時鐘代替真實時間）"""
+import asyncio
+import fcntl
+import multiprocessing
+import os
+import tempfile
+import threading
+
+from rate_governor import CircuitOpen, RateGovernor, request_priority
+from stock_api import live_call_budget
+from test_twse_client import FakeResponse
+from twse_client import TWSEClient, TWSEError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_and_backfill_reserve():
+    clock = FakeClock()
+    governor = RateGovernor({'T86': 2.0}, burst=4, reserve=2, clock=clock)
+
+    # backfill 只能用到保留量以上的 token
+    assert governor.reserve('T86', 'backfill') == (0.0, False)
+    assert governor.reserve('T86', 'backfill') == (0.0, False)
+    wait, _ = governor.reserve('T86', 'backfill')
+    assert wait > 0
+
+    # 使用者查詢可以用完剩下的 token
+    assert governor.reserve('T86', 'interactive')[0] == 0
+    assert governor.reserve('T86', 'interactive')[0] == 0
+    assert governor.reserve('T86', 'interactive')[0] == 0.5   # 每秒 2 個
+
+    governor.acquire('T86', sleep=clock.sleep)
+    assert clock.now == 1000.5
+
+
+def test_throttle_halves_rate_and_recovers():
+    clock = FakeClock()
+    governor = RateGovernor({'T86': 2.0, 'STOCK_DAY': 4.0}, burst=2, pause=10, recover=0.25, clock=clock)
+    governor.report('T86', ok=False, throttled=True)
+
+    stats = governor.stats()
+    assert stats['factor'] == 0.5
+    assert stats['rates'] == {'T86': 1.0, 'STOCK_DAY': 2.0}     # 所有端點一起降速
+    assert stats['paused_seconds'] == 10
+    assert governor.reserve('STOCK_DAY')[0] == 10
+
+    # 暫停前送出的請求陸續回報限流，不再降速
+    governor.report('STOCK_DAY', ok=False, throttled=True)
+    assert governor.stats()['factor'] == 0.5
+
+    # 暫停期間不累積 token，暫停結束後依降低後的速率送出
+    clock.now += 10
+    assert governor.reserve('STOCK_DAY')[0] == 0.5
+    clock.now += 0.5
+    assert governor.reserve('STOCK_DAY')[0] == 0
+    governor.report('STOCK_DAY', ok=True)
+    governor.report('STOCK_DAY', ok=True)
+    assert governor.stats()['factor'] == 1.0
+
+
+def test_circuit_breaker_opens_and_probes():
+    clock = FakeClock()
+    governor = RateGovernor({'T86': 100.0}, failure_threshold=3, cooldown=30, clock=clock)
+    for _ in range(3):
+        governor.report('T86', ok=False)
+    assert governor.stats()['circuit'] == 'open'
+    try:
+        governor.reserve('T86')
+    except CircuitOpen:
+        pass
+    else:
+        raise AssertionError('斷路器開啟時應該拋出 CircuitOpen')
+
+    # 冷卻結束後放行一個試探請求，試探期間其他請求繼續暫停
+    clock.now += 30
+    assert governor.acquire('T86') is True
+    try:
+        governor.reserve('T86')
+    except CircuitOpen:
+        pass
+    else:
+        raise AssertionError('試探期間應該拋出 CircuitOpen')
+
+    # 試探失敗：冷卻時間加倍
+    governor.report('T86', ok=False, probe=True)
+    clock.now += 30
+    assert governor.stats()['circuit'] == 'open'
+    clock.now += 30
+    assert governor.acquire('T86') is True
+    governor.report('T86', ok=True, probe=True)
+    stats = governor.stats()
+    assert stats['circuit'] == 'closed'
+    assert stats['rejected'] == 2
+
+
+def test_state_shared_between_processes():
+    clock = FakeClock()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'governor.state')
+        first = RateGovernor({'T86': 1.0}, burst=2, reserve=0, state_path=path, clock=clock)
+        second = RateGovernor({'T86': 1.0}, burst=2, reserve=0, state_path=path, clock=clock)
+        assert first.reserve('T86')[0] == 0
+        assert second.reserve('T86')[0] == 0
+        assert first.reserve('T86')[0] == 1.0      # 兩個 worker 共用同一個 bucket
+
+        second.report('T86', ok=False, throttled=True)
+        assert first.stats()['throttled'] == 1
+
+        # fork 後的子程序（gunicorn worker）重新開啟狀態檔，與父程序共用狀態
+        context = multiprocessing.get_context('fork')
+        child = context.Process(target=first.report, args=('T86',), kwargs={'ok': False, 'throttled': True})
+        clock.now += 20
+        child.start()
+        child.join()
+        assert second.stats()['throttled'] == 2
+
+
+def test_async_acquire_does_not_block_event_loop():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'governor.state')
+        governor = RateGovernor({'T86': 1.0}, burst=2, state_path=path)
+        governor.stats()
+        # 其他程序鎖定狀態檔 0.2 秒
+        other = open(path, 'a+b')
+        fcntl.flock(other, fcntl.LOCK_EX)
+        threading.Timer(0.2, fcntl.flock, (other, fcntl.LOCK_UN)).start()
+        ticks = []
+
+        async def tick():
+            for _ in range(5):
+                ticks.append(1)
+                await asyncio.sleep(0.02)
+
+        async def acquire():
+            probe = await governor.acquire_async('T86')
+            return probe, len(ticks)
+
+        async def run():
+            return await asyncio.gather(acquire(), tick())
+
+        (probe, ticks_before), _ = asyncio.run(run())
+        other.close()
+        # 等待鎖的期間其他協程照常執行
+        assert probe is False and ticks_before == 5
+
+
+def test_client_reports_throttling_to_governor():
+    clock = FakeClock()
+    governor = RateGovernor({'T86': 100.0}, burst=10, pause=5, failure_threshold=2, clock=clock)
+    client = TWSEClient(retries=2, backoff=0, governor=governor, max_wait=1)
+    responses = [FakeResponse(200, None), FakeResponse(200, {'stat': 'OK'})]
+    client.session.get = lambda url, params=None, timeout=None: responses.pop(0)
+
+    # 被限流（HTML 頁面）後暫停 5 秒，超過使用者查詢的等待上限，不再送出
+    try:
+        client.get_json('T86', {'date': '20240102'})
+    except TWSEError as e:
+        assert '未送出' in str(e)
+    else:
+        raise AssertionError('應該拋出 TWSEError')
+    assert governor.stats()['throttled'] == 1
+    assert len(responses) == 1
+
+    # 背景工作不限等待時間（假的時鐘已過了暫停期間）
+    clock.now += 6
+    with request_priority('backfill'):
+        assert client.get_json('T86', {'date': '20240102'}) == {'stat': 'OK'}
+
+
+def test_live_call_budget_fits_in_time_limit():
+    clock = FakeClock()
+    governor = RateGovernor({'T86': 2.0, 'STOCK_DAY': 3.0}, burst=5, reserve=2, clock=clock)
+    calls = live_call_budget(governor, 20)
+    assert calls == 45                         # 以最慢的端點計算
+    for _ in range(calls):
+        governor.acquire('T86', sleep=clock.sleep)
+    assert clock.now - 1000.0 <= 20
+    assert live_call_budget(None, 20) == 60    # 不限制速率
+
+
+if __name__ == '__main__':
+    test_token_bucket_and_backfill_reserve()
+    test_throttle_halves_rate_and_recovers()
+    test_circuit_breaker_opens_and_probes()
+    test_state_shared_between_processes()
+    test_async_acquire_does_not_block_event_loop()
+    test_client_reports_throttling_to_governor()
+    test_live_call_budget_fits_in_time_limit()
+    print("✅ 速率控制測試完成！")
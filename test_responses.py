@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""測試回應的序列化、欄位式輸出、壓縮與快取標頭"""
+import gzip
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import Flask, Response, request
+
+from responses import choose_encoding, compress, dumps, from_columns, set_cache_headers, to_columns
+from twse_cache import data_ready_time
+
+RECORDS = [
+    OrderedDict([('日期', '2024-01-02'), ('股票代碼', '2330'), ('收盤價', '593.00'), ('MA5', '590.10')]),
+    OrderedDict([('日期', '2024-01-03'), ('股票代碼', '2330'), ('收盤價', '578.00'), ('本益比', '25.50')]),
+]
+COLUMN_ORDER = ['日期', '股票代碼', '開盤價', '收盤價', 'MA5', '本益比']
+
+
+def test_dumps_matches_stdlib_output():
+    data = OrderedDict([('success', True), ('data', RECORDS), ('count', 2), ('note', '引號 " 與換行\n')])
+    assert dumps(data) == json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def test_columns_round_trip():
+    columns = to_columns(RECORDS, COLUMN_ORDER)
+    # 欄位依順序、沒有任何值的欄位（開盤價）不輸出，缺值為 None
+    assert list(columns) == ['日期', '股票代碼', '收盤價', 'MA5', '本益比']
+    assert columns['MA5'] == ['590.10', None]
+    assert from_columns(columns) == RECORDS
+    assert from_columns({}) == []
+
+
+def test_choose_encoding():
+    assert choose_encoding('gzip, deflate') == 'gzip'
+    assert choose_encoding('gzip;q=0, deflate') is None
+    assert choose_encoding('GZIP; q=0.5') == 'gzip'
+    assert choose_encoding('') is None
+    assert choose_encoding(None) is None
+
+
+def test_compress_and_conditional_requests():
+    app = Flask(__name__)
+    body = dumps({'data': RECORDS * 50})
+    last_modified = data_ready_time(datetime(2024, 1, 3))
+
+    def respond(final):
+        response = Response(body, mimetype='application/json')
+        set_cache_headers(response, last_modified if final else None, 3600)
+        response.make_conditional(request)
+        return compress(response, request.headers.get('Accept-Encoding'))
+
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        response = respond(True)
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.get_data()) == body
+        assert response.headers['Cache-Control'] == 'public, max-age=3600'
+        assert response.headers['Last-Modified'] == 'Wed, 03 Jan 2024 09:00:00 GMT'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        etag = response.headers['ETag']
+
+    with app.test_request_context(headers={'If-None-Match': etag}):
+        assert respond(True).status_code == 304
+
+    with app.test_request_context(headers={'If-Modified-Since': 'Thu, 04 Jan 2024 00:00:00 GMT'}):
+        assert respond(True).status_code == 304
+
+    # 尚未定案的資料每次重新驗證；POST 不回傳 304
+    with app.test_request_context(method='POST', headers={'If-None-Match': etag}):
+        response = respond(False)
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'no-cache'
+        assert 'Last-Modified' not in response.headers
+        assert 'Content-Encoding' not in response.headers
+
+
+def test_columns_orient_is_rejected_for_streams():
+    import stock_api
+    client = stock_api.app.test_client()
+    query = {'stockCode': '2330', 'startDate': '2024-01-02', 'endDate': '2024-01-31', 'dataTypes': ['price'],
+             'orient': 'columns'}
+    # 串流逐月輸出資料列，不能轉成欄位式；在規劃與抓取之前就回絕
+    for response in (client.post('/api/stock-data', json=dict(query, stream=True)),
+                     client.post('/api/stock-data', json=query, headers={'Accept': 'application/x-ndjson'}),
+                     client.get('/api/stock-data', query_string=dict(query, dataTypes='price', stream='true'))):
+        assert response.status_code == 400
+        assert 'orient=records' in response.get_json()['error']
+
+
+def test_home_lists_every_route_with_its_methods():
+    import stock_api
+    endpoints = stock_api.app.test_client().get('/').get_json()['endpoints']
+    routes = {rule.rule: '/'.join(sorted(rule.methods - {'HEAD', 'OPTIONS'}))
+              for rule in stock_api.app.url_map.iter_rules() if rule.rule not in ('/', '/static/<path:filename>')}
+    assert {route: text.split(' - ')[0] for route, text in endpoints.items()} == routes
+
+
+if __name__ == '__main__':
+    test_dumps_matches_stdlib_output()
+    test_columns_round_trip()
+    test_choose_encoding()
+    test_compress_and_conditional_requests()
+    test_columns_orient_is_rejected_for_streams()
+    test_home_lists_every_route_with_its_methods()
+    print("✅ 回應格式測試完成！")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""測試查詢結果的記憶體快取（LRU、容量上限、到期與依標籤失效）"""
+from datetime import timedelta
+
+import stock_api
+from result_cache import ENTRY_OVERHEAD, ResultCache
+from twse_cache import taipei_now
+
+
+def test_lru_eviction_by_bytes():
+    cache = ResultCache(max_bytes=3 * (100 + ENTRY_OVERHEAD))
+    for key in ('2330', '2317', '2454'):
+        cache.put(key, key.encode(), 100)
+    assert cache.get('2330') == b'2330'       # 2330 變成最近使用
+
+    cache.put('0050', b'0050', 100)
+    assert cache.get('2317') is None          # 最久未使用的被淘汰
+    assert cache.get('2330') == b'2330'
+    assert cache.get('0050') == b'0050'
+
+    # 超過總容量的項目不快取
+    cache.put('big', b'', 10 * (100 + ENTRY_OVERHEAD))
+    assert cache.get('big') is None
+
+    stats = cache.stats()
+    assert stats['entries'] == 3
+    assert stats['bytes'] == 3 * (100 + ENTRY_OVERHEAD)
+    assert stats['evictions'] == 1
+    assert (stats['hits'], stats['misses']) == (3, 2)
+
+
+def test_expiry_and_invalidation():
+    cache = ResultCache()
+    cache.put('history', 'h', 10)
+    cache.put('today-2330', 'a', 10, expires_at=1000.0, tags=['live', 'stock:2330'])
+    cache.put('today-2317', 'b', 10, expires_at=1000.0, tags=['live', 'stock:2317'])
+
+    assert cache.get('today-2330', now=999.0) == 'a'
+    assert cache.get('today-2330', now=1000.0) is None
+
+    assert cache.invalidate('stock:2317') == 1
+    assert cache.get('today-2317', now=0) is None
+    assert cache.invalidate('live') == 0
+    assert cache.get('history', now=10 ** 12) == 'h'      # 已定案的結果不會到期
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_disabled_cache():
+    cache = ResultCache(max_bytes=0)
+    cache.put('2330', b'{}', 2)
+    assert cache.get('2330') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_unchanged_live_snapshot_keeps_results():
+    original = stock_api.result_cache
+    stock_api.result_cache = cache = ResultCache()
+    tomorrow = taipei_now() + timedelta(days=1)     # 尚未定案
+    result = {'stat': 'OK', 'data': [['2330', '台積電', '1,000']]}
+    try:
+        stock_api.store_market_snapshot('T86', tomorrow, result)
+        cache.put('today', 'a', 10, tags=['live'])
+        # 重新抓到相同的內容，查詢結果不失效
+        stock_api.store_market_snapshot('T86', tomorrow, result)
+        assert cache.get('today') == 'a'
+
+        stock_api.store_market_snapshot('T86', tomorrow, {'stat': 'OK', 'data': [['2330', '台積電', '2,000']]})
+        assert cache.get('today') is None
+    finally:
+        stock_api.result_cache = original
+        stock_api.live_snapshot_digests.clear()
+
+
+if __name__ == '__main__':
+    test_lru_eviction_by_bytes()
+    test_expiry_and_invalidation()
+    test_disabled_cache()
+    test_unchanged_live_snapshot_keeps_results()
+    print("✅ 結果快取測試完成！")
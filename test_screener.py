@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""測試全市場選股（以假的全市場表代替證交所，不連網）"""
+import os
+import tempfile
+
+from werkzeug.datastructures import MultiDict
+
+import stock_api
+from screener import parse_filters, screen
+from stock_api import screener_params
+from trading_calendar import TradingCalendar
+from twse_cache import SnapshotStore
+from warehouse import MarketTable, Warehouse, table_columns
+
+
+def t86(rows):
+    """{股票代碼: (外資買賣超, 投信買賣超)} 轉成 T86 的 MarketTable"""
+    codes = sorted(rows)
+    return MarketTable(codes, [f'股票{code}' for code in codes], {
+        'foreign_net': [rows[code][0] for code in codes],
+        'trust_net': [rows[code][1] for code in codes],
+        'dealer_net': [0 for _ in codes],
+        'total_net': [None if rows[code][0] is None else rows[code][0] + rows[code][1] for code in codes]
+    })
+
+
+def bwibbu(rows):
+    """{股票代碼: (殖利率, 本益比, 股價淨值比)} 轉成 BWIBBU_d 的 MarketTable"""
+    codes = sorted(rows)
+    return MarketTable(codes, [f'股票{code}' for code in codes], {
+        'dividend_yield': [rows[code][0] for code in codes],
+        'pe': [rows[code][1] for code in codes],
+        'pb': [rows[code][2] for code in codes]
+    })
+
+
+TABLES = [
+    ('T86', t86({'2330': (1000, 10), '2317': (-500, 20), '2454': (300, 0)})),
+    ('BWIBBU_d', bwibbu({'2330': (2.0, 25.0, 5.0), '2317': (4.5, 12.0, 1.2), '2454': (3.0, None, 4.0)})),
+    # 第二個交易日：2454 沒有三大法人資料，0050 新出現
+    ('T86', t86({'2330': (2000, -30), '2317': (800, 0), '0050': (50, 5)})),
+    ('BWIBBU_d', bwibbu({'2330': (2.1, 24.0, 5.1), '2317': (4.4, 12.5, 1.3), '2454': (3.1, None, 4.1)})),
+]
+
+
+def test_window_sums_and_latest_valuation():
+    columns, matched = screen(TABLES, limit=10)
+    assert matched == 4
+    # 買賣超為期間內加總（遞減），本益比等取最後一個交易日
+    assert columns['股票代碼'] == ['2330', '2317', '2454', '0050']    # 相同值依股票代碼
+    assert columns['外資買賣超'] == ['3,000', '300', '300', '50']
+    assert columns['投信買賣超'] == ['-20', '20', '0', '5']
+    assert columns['本益比'] == ['24.00', '12.50', None, None]
+    assert columns['殖利率(%)'] == ['2.10', '4.40', '3.10', None]
+    assert columns['股票名稱'][0] == '股票2330'
+
+
+def test_filters_sort_and_limit():
+    # 缺值的股票不符合篩選條件
+    columns, matched = screen(TABLES, parse_filters({'pe': {'max': 20}, 'dividendYield': {'min': '4'}}), 'pe')
+    assert matched == 1 and columns['股票代碼'] == ['2317']
+
+    # 遞增排序時缺值排在最後，相同值依股票代碼
+    columns, matched = screen(TABLES, sort_by='pe', descending=False)
+    assert columns['股票代碼'] == ['2317', '2330', '0050', '2454']
+    columns, _ = screen(TABLES, sort_by='foreignNet', limit=2)
+    assert columns['股票代碼'] == ['2330', '2317']
+
+    for bad in ({'eps': {'min': 1}}, {'pe': {'lt': 10}}, {'pe': {'max': 'abc'}}, ['pe']):
+        try:
+            parse_filters(bad)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f'{bad} 應該拋出 ValueError')
+
+
+def test_warehouse_columns_match_parsed_rows():
+    table = {'2330': ['2330  ', '台積電  '] + [f'{i * 1000:,}' for i in range(1, 18)],
+             '2317': ['2317  ', '鴻海  '] + ['--'] * 17}
+    with tempfile.TemporaryDirectory() as root:
+        warehouse = Warehouse(os.path.join(root, 'warehouse.sqlite3'))
+        assert warehouse.snapshot_columns('T86', '20240102') is None
+        warehouse.put_snapshot('T86', '20240102', table)
+        stored = warehouse.snapshot_columns('T86', '20240102', ['foreign_net', 'trust_net'])
+
+    parsed = table_columns('T86', table)
+    assert stored.codes == parsed.codes == ['2317', '2330']
+    assert stored.names == parsed.names == ['鴻海', '台積電']
+    assert stored.columns == {'foreign_net': [None, 3000], 'trust_net': [None, 9000]}
+    assert parsed.columns['foreign_net'] == stored.columns['foreign_net']
+
+
+def test_query_string_filters():
+    data = screener_params(MultiDict([('date', '2024-01-02'), ('pe.max', '15'), ('dividendYield.min', '4'),
+                                      ('sortBy', 'dividendYield'), ('limit', '20')]))
+    assert data['filters'] == {'pe': {'max': '15'}, 'dividendYield': {'min': '4'}}
+    assert (data['date'], data['sortBy'], data['limit']) == ('2024-01-02', 'dividendYield', '20')
+    assert parse_filters(data['filters']) == {'pe': {'max': 15.0}, 'dividendYield': {'min': 4.0}}
+
+
+class RecordingClient:
+    def __init__(self):
+        self.calls = []
+
+    def get_json(self, endpoint, params):
+        self.calls.append((endpoint, params))
+        raise AssertionError('超過上限的選股不應向證交所請求')
+
+
+def test_limits_checked_before_fetching():
+    names = ('warehouse', 'snapshot_store', 'trading_calendar', 'twse_client')
+    original = {name: getattr(stock_api, name) for name in names}
+    client = RecordingClient()
+    with tempfile.TemporaryDirectory() as root:
+        try:
+            stock_api.warehouse = Warehouse(os.path.join(root, 'warehouse.sqlite3'))
+            stock_api.snapshot_store = SnapshotStore(os.path.join(root, 'snapshots'))
+            stock_api.trading_calendar = TradingCalendar(os.path.join(root, 'trading_calendar.json'))
+            stock_api.twse_client = client
+            app = stock_api.app.test_client()
+            for start_date, end_date, message in (
+                    ('2000-01-01', '2023-12-31', '天'),          # 日曆天數就超過上限
+                    ('2023-01-01', '2023-07-31', '交易日'),      # 推估的交易日數超過上限
+                    ('2023-10-02', '2023-12-29', '請求')):       # 請求數超過上限
+                response = app.post('/api/screener', json={'startDate': start_date, 'endDate': end_date})
+                assert response.status_code == 400
+                assert message in response.get_json()['error']
+        finally:
+            for name, value in original.items():
+                setattr(stock_api, name, value)
+    assert client.calls == []
+
+
+if __name__ == '__main__':
+    test_window_sums_and_latest_valuation()
+    test_filters_sort_and_limit()
+    test_warehouse_columns_match_parsed_rows()
+    test_query_string_filters()
+    test_limits_checked_before_fetching()
+    print("✅ 選股測試完成！")
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""測試相同上游請求的合併（single-flight）"""
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_fetch():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        time.sleep(0.05)
+        return {'2330': ['2330', '台積電']}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('T86:20240102', fetch)))
+               for _ in range(8)]
+    threads[0].start()
+    started.wait(1)
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 8 and all(result is results[0] for result in results)
+    assert flight.stats() == {'executed': 1, 'shared': 7, 'shared_across_processes': 0}
+
+
+def test_different_keys_run_in_parallel_and_errors_are_shared():
+    flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        release.wait(1)
+        raise RuntimeError('HTTP 503')
+
+    def call():
+        try:
+            flight.do('STOCK_DAY:2330:202401', failing)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    # 其他 key 不需要等待
+    assert flight.do('STOCK_DAY:2317:202401', lambda: 'other') == 'other'
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 3 and all(error is errors[0] for error in errors)
+
+    # 失敗後再次呼叫會重新執行
+    assert flight.do('STOCK_DAY:2330:202401', lambda: 'ok') == 'ok'
+
+
+def fetch_in_worker(lock_dir, counter_path, results):
+    def fetch():
+        with open(counter_path, 'a') as f:
+            f.write('x')
+        time.sleep(0.3)
+        return {'rows': [['113/01/02', '1,000']]}
+
+    results.put(SingleFlight(lock_dir).do('STOCK_DAY:2330:202401', fetch))
+
+
+def test_worker_processes_share_one_fetch():
+    with tempfile.TemporaryDirectory() as root:
+        counter_path = os.path.join(root, 'counter')
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        workers = [context.Process(target=fetch_in_worker, args=(root, counter_path, results)) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        outcomes = [results.get(timeout=5) for _ in workers]
+        for worker in workers:
+            worker.join()
+
+        with open(counter_path) as f:
+            assert f.read() == 'x'
+        assert outcomes == [{'rows': [['113/01/02', '1,000']]}] * 3
+
+
+def test_finished_result_is_not_reused_by_later_calls():
+    with tempfile.TemporaryDirectory() as root:
+        flight = SingleFlight(root)
+        assert flight.do('BWIBBU_d:20240102', lambda: {'a': 1}) == {'a': 1}
+        # 之後的呼叫（不是同時進行）重新執行，由呼叫端先檢查快取
+        assert flight.do('BWIBBU_d:20240102', lambda: {'a': 2}) == {'a': 2}
+        assert flight.stats()['executed'] == 2
+
+
+def test_async_calls_share_with_threads_and_processes():
+    with tempfile.TemporaryDirectory() as root:
+        counter_path = os.path.join(root, 'counter')
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        worker = context.Process(target=fetch_in_worker, args=(root, counter_path, results))
+        worker.start()
+        time.sleep(0.1)
+
+        flight = SingleFlight(root)
+        started = threading.Event()
+
+        async def fetch():
+            with open(counter_path, 'a') as f:
+                f.write('x')
+            return {'rows': []}
+
+        def fetch_in_thread():
+            started.set()
+            return flight.do('T86:20240102', lambda: time.sleep(0.2) or {'rows': ['thread']})
+
+        async def run():
+            thread = asyncio.ensure_future(asyncio.to_thread(fetch_in_thread))
+            await asyncio.to_thread(started.wait, 1)
+            await asyncio.sleep(0.05)
+            # 其他程序進行中的請求、同一個程序的執行緒進行中的請求都共用結果，等待時事件迴圈照常運作
+            return await asyncio.gather(flight.do_async('STOCK_DAY:2330:202401', fetch),
+                                        flight.do_async('T86:20240102', fetch), thread)
+
+        outcomes = asyncio.run(run())
+        worker.join()
+        assert results.get(timeout=5) == outcomes[0] == {'rows': [['113/01/02', '1,000']]}
+        assert outcomes[1] == outcomes[2] == {'rows': ['thread']}
+        with open(counter_path) as f:
+            assert f.read() == 'x'
+        assert flight.stats() == {'executed': 1, 'shared': 1, 'shared_across_processes': 1}
+
+
+if __name__ == '__main__':
+    test_concurrent_calls_share_one_fetch()
+    test_different_keys_run_in_parallel_and_errors_are_shared()
+    test_worker_processes_share_one_fetch()
+    test_finished_result_is_not_reused_by_later_calls()
+    test_async_calls_share_with_threads_and_processes()
+    print("✅ 請求合併測試完成！")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""測試以日期為索引的欄位式資料表"""
+from stock_frame import StockFrame, parse_value
+
+COLUMN_ORDER = ['日期', '股票代碼', '開盤價', '收盤價', '外資買賣超', '本益比']
+
+
+def test_merge_by_date():
+    frame = StockFrame('2330')
+    frame.merge('2024-01-03', {'收盤價': '595'})
+    frame.merge('2024-01-02', {'收盤價': '590'})
+    # 不同資料來源寫入同一天
+    frame.merge('2024-01-03', {'外資買賣超': '1,000'})
+
+    assert len(frame) == 2
+    assert frame.column('收盤價') == ['595', '590']
+    assert frame.column('外資買賣超') == ['1,000', None]
+    assert frame.column('本益比') == [None, None]
+
+
+def test_sort_and_records():
+    frame = StockFrame('2330')
+    frame.merge('2024-01-04', {'本益比': '25.5', '收盤價': '600'})
+    frame.merge('2024-01-02', {'收盤價': '590', '開盤價': '585'})
+    frame.sort()
+
+    assert frame.dates == ['2024-01-02', '2024-01-04']
+    assert frame.index == {'2024-01-02': 0, '2024-01-04': 1}
+
+    records = frame.to_records(COLUMN_ORDER)
+    assert list(records[0].items()) == [
+        ('日期', '2024-01-02'), ('股票代碼', '2330'), ('開盤價', '585'), ('收盤價', '590')
+    ]
+    # 缺值的欄位不輸出，欄位依順序排列
+    assert list(records[1].keys()) == ['日期', '股票代碼', '收盤價', '本益比']
+
+
+def test_from_records_round_trip():
+    rows = [
+        {'日期': '2024-01-02', '股票代碼': '2330', '收盤價': '590'},
+        {'日期': '2024-01-03', '股票代碼': '2330', '收盤價': '595', '本益比': '25.5'},
+    ]
+    frame = StockFrame.from_records(rows)
+    assert [dict(r) for r in frame.to_records(COLUMN_ORDER)] == rows
+
+
+def test_ingest_parses_once_and_formats_back():
+    raw = {'開盤價': '1,085.00', '收盤價': '--', '漲跌價差': '-5.50', '成交股數': '58,041,000',
+           '外資買賣超': '-1,234', '本益比': '25.50', '股利年度': '112'}
+    frame = StockFrame('2330')
+    frame.ingest('2024-01-02', raw)
+    frame.ingest('2024-01-03', {'漲跌價差': 'X0.00', '本益比': '-', '成交股數': '1000'})
+    frame.set_column('MA5', [592.5, None])
+
+    assert frame.column('開盤價') == [1085.0, None]
+    assert frame.column('成交股數') == [58041000, '1000']     # 不是證交所的千分位格式，保留原字串
+    assert frame.column('漲跌價差') == [-5.5, 'X0.00']
+    assert frame.column('收盤價') == ['--', None]
+
+    records = frame.to_records(list(raw) + ['MA5', '日期'])
+    assert dict(records[0]) == dict(raw, MA5='592.50', 日期='2024-01-02')
+    assert dict(records[1]) == {'漲跌價差': 'X0.00', '成交股數': '1000', '本益比': '-', '日期': '2024-01-03'}
+    assert frame.to_records(['成交股數', '漲跌價差'], typed=True)[0] == {'成交股數': 58041000, '漲跌價差': -5.5}
+
+
+def test_parse_value_round_trips():
+    for name, text in [('收盤價', '593.00'), ('收盤價', '593.0'), ('漲跌價差', '+0.50'), ('漲跌價差', ' 0.00'),
+                       ('漲跌價差', '+0.00'), ('成交金額', '15,371,574,684'), ('殖利率(%)', '2.3'), ('財報年季', '112/3')]:
+        frame = StockFrame('2330')
+        frame.merge('2024-01-02', {name: parse_value(name, text)})
+        assert frame.to_records([name])[0][name] == text
+
+
+if __name__ == '__main__':
+    test_merge_by_date()
+    test_sort_and_records()
+    test_from_records_round_trip()
+    test_ingest_parses_once_and_formats_back()
+    test_parse_value_round_trips()
+    print("✅ 資料表測試完成！")
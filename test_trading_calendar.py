@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""測試交易日曆"""
+import os
+import tempfile
+from datetime import datetime
+
+from trading_calendar import TradingCalendar
+
+# 2024 年 2 月：8-14 日為春節假期
+FEB_2024_ROWS = [[f'113/02/{day:02d}', '1,000'] for day in (1, 2, 5, 6, 7, 15, 16, 19, 20, 21, 22, 23, 26, 27, 29)]
+
+
+def test_learned_month_skips_holidays():
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'calendar.json')
+        calendar = TradingCalendar(path)
+        today = datetime(2024, 5, 1)
+        assert calendar.missing_months(datetime(2024, 2, 1), datetime(2024, 2, 29), today) == [(2024, 2)]
+
+        calendar.learn_month(2024, 2, FEB_2024_ROWS, today)
+        days = TradingCalendar(path).trading_days(datetime(2024, 2, 5), datetime(2024, 2, 16))
+        assert [d.day for d in days] == [5, 6, 7, 15, 16]
+        assert TradingCalendar(path).missing_months(datetime(2024, 2, 1), datetime(2024, 2, 29), today) == []
+
+
+def test_unknown_month_falls_back_to_weekdays():
+    with tempfile.TemporaryDirectory() as root:
+        calendar = TradingCalendar(os.path.join(root, 'calendar.json'))
+        days = calendar.trading_days(datetime(2024, 3, 1), datetime(2024, 3, 10))
+        assert [d.day for d in days] == [1, 4, 5, 6, 7, 8]
+
+
+def test_current_month_is_not_persisted():
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'calendar.json')
+        calendar = TradingCalendar(path)
+        today = datetime(2024, 2, 20)
+        calendar.learn_month(2024, 2, FEB_2024_ROWS[:9], today)
+
+        # 已知交易日之後的日期以週一到週五推估
+        days = calendar.trading_days(datetime(2024, 2, 12), datetime(2024, 2, 23))
+        assert [d.day for d in days] == [15, 16, 19, 20, 21, 22, 23]
+        assert not os.path.exists(path)
+        assert calendar.missing_months(datetime(2024, 2, 1), datetime(2024, 3, 31), today) == [(2024, 2)]
+
+
+if __name__ == '__main__':
+    test_learned_month_skips_holidays()
+    test_unknown_month_falls_back_to_weekdays()
+    test_current_month_is_not_persisted()
+    print("✅ 交易日曆測試完成！")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""測試證交所資料快取（全市場每日快照、個股月資料）"""
+import os
+import tempfile
+from datetime import datetime
+
+from twse_cache import MonthBlockStore, SnapshotStore, is_day_finalized
+
+
+def test_put_and_get_indexed_by_code():
+    with tempfile.TemporaryDirectory() as root:
+        store = SnapshotStore(root)
+        table = {'2330': ['2330', '台積電', '1,000'], '2317': ['2317', '鴻海', '2,000']}
+        store.put('T86', '20240102', table)
+
+        # 新的實例只能從磁碟讀取
+        reloaded = SnapshotStore(root)
+        assert reloaded.get('T86', '20240102')['2330'][1] == '台積電'
+        assert reloaded.get('T86', '20240103') is None
+        assert reloaded.get('BWIBBU_d', '20240102') is None
+
+
+def test_empty_table_means_no_trading():
+    with tempfile.TemporaryDirectory() as root:
+        store = SnapshotStore(root)
+        store.put('T86', '20240106', {})
+        assert SnapshotStore(root).get('T86', '20240106') == {}
+
+
+def test_eviction_keeps_total_size_bounded():
+    with tempfile.TemporaryDirectory() as root:
+        row = ['2330', '台積電'] + ['1,234,567'] * 17
+        table = {f'{code:04d}': row for code in range(20)}
+
+        store = SnapshotStore(root, max_bytes=10 * 1024, memory_items=2)
+        for day in range(1, 10):
+            store.put('T86', f'202401{day:02d}', table)
+
+        assert store.stats()['bytes'] <= 10 * 1024
+        # 最早寫入的快照應已被淘汰，最新的仍在
+        assert store.get('T86', '20240101') is None
+        assert store.get('T86', '20240109') is not None
+        assert not os.path.exists(os.path.join(root, 'T86', '20240101.json'))
+
+
+def test_day_finalized():
+    now = datetime(2024, 1, 10, 12, 0)
+    assert is_day_finalized(datetime(2024, 1, 9), now)
+    assert not is_day_finalized(datetime(2024, 1, 10), now)
+    assert is_day_finalized(datetime(2024, 1, 10), datetime(2024, 1, 10, 18, 0))
+    assert not is_day_finalized(datetime(2024, 1, 11), now)
+
+
+def test_closed_month_is_permanent():
+    with tempfile.TemporaryDirectory() as root:
+        now = datetime(2024, 3, 15, 10, 0)
+        store = MonthBlockStore(root, ttl=600)
+        store.put('2330', 2024, 1, [['113/01/02', '1,000']], now=now)
+
+        later = datetime(2030, 1, 1)
+        assert MonthBlockStore(root).get('2330', 2024, 1, now=later) == [['113/01/02', '1,000']]
+
+
+def test_current_month_expires():
+    with tempfile.TemporaryDirectory() as root:
+        store = MonthBlockStore(root, ttl=600)
+        store.put('2330', 2024, 3, [], now=datetime(2024, 3, 15, 10, 0))
+
+        assert store.get('2330', 2024, 3, now=datetime(2024, 3, 15, 10, 5)) == []
+        # 超過 ttl
+        assert store.get('2330', 2024, 3, now=datetime(2024, 3, 15, 10, 11)) is None
+
+        # 收盤資料公布前抓取的當月資料，過了公布時間就失效
+        store = MonthBlockStore(root, ttl=24 * 3600)
+        store.put('2330', 2024, 3, [], now=datetime(2024, 3, 15, 16, 30))
+        assert store.get('2330', 2024, 3, now=datetime(2024, 3, 15, 16, 59)) == []
+        assert store.get('2330', 2024, 3, now=datetime(2024, 3, 15, 17, 0)) is None
+
+
+def test_future_month_not_cached():
+    with tempfile.TemporaryDirectory() as root:
+        store = MonthBlockStore(root)
+        store.put('2330', 2024, 4, [], now=datetime(2024, 3, 15))
+        assert store.get('2330', 2024, 4, now=datetime(2024, 3, 15)) is None
+
+
+def test_put_reports_changed_content():
+    with tempfile.TemporaryDirectory() as root:
+        store = MonthBlockStore(root, ttl=600)
+        now = datetime(2024, 3, 15, 10, 0)
+        assert store.put('2330', 2024, 3, [['113/03/14', '1,000']], now=now)
+        assert not store.put('2330', 2024, 3, [['113/03/14', '1,000']], now=now)
+        # 過期後重新抓到相同的內容也不算變動
+        assert not MonthBlockStore(root, ttl=600).put('2330', 2024, 3, [['113/03/14', '1,000']],
+                                                      now=datetime(2024, 3, 15, 11, 0))
+        assert store.put('2330', 2024, 3, [['113/03/14', '1,000'], ['113/03/15', '2,000']], now=now)
+        assert not store.put('2330', 2024, 4, [], now=now)
+
+
+if __name__ == '__main__':
+    test_put_and_get_indexed_by_code()
+    test_empty_table_means_no_trading()
+    test_eviction_keeps_total_size_bounded()
+    test_day_finalized()
+    test_closed_month_is_permanent()
+    test_current_month_expires()
+    test_future_month_not_cached()
+    test_put_reports_changed_content()
+    print("✅ 快取測試完成！")
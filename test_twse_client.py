@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""測試證交所客戶端的重試與延遲統計（不連網）"""
+from twse_client import TWSEClient, TWSEError
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, payload=None):
+        self.status_code = status_code
+        self._payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        if self._payload is None:
+            raise ValueError('not json')
+        return self._payload
+
+
+def make_client(responses):
+    client = TWSEClient(retries=2, backoff=0)
+    calls = []
+
+    def fake_get(url, params=None, timeout=None):
+        calls.append((url, params, timeout))
+        return responses.pop(0)
+
+    client.session.get = fake_get
+    return client, calls
+
+
+def test_retry_then_success():
+    client, calls = make_client([
+        FakeResponse(503),
+        FakeResponse(200, None),          # 限流時的 HTML 頁面
+        FakeResponse(200, {'stat': 'OK'})
+    ])
+    assert client.get_json('T86', {'date': '20240102'}) == {'stat': 'OK'}
+    assert len(calls) == 3
+    assert calls[0][0] == 'https://www.twse.com.tw/rwd/zh/fund/T86'
+    assert calls[0][2] == 15
+
+    stats = client.latency_stats()['T86']
+    assert stats['calls'] == 3
+    assert stats['errors'] == 2
+
+
+def test_gives_up_after_retries():
+    client, calls = make_client([FakeResponse(503)] * 3)
+    try:
+        client.get_json('STOCK_DAY', {'date': '20240101', 'stockNo': '2330'})
+    except TWSEError as e:
+        assert 'STOCK_DAY' in str(e)
+    else:
+        raise AssertionError('應該拋出 TWSEError')
+    assert len(calls) == 3
+
+
+def test_session_negotiates_gzip():
+    client = TWSEClient()
+    assert 'gzip' in client.session.headers['Accept-Encoding']
+
+
+if __name__ == '__main__':
+    test_retry_then_success()
+    test_gives_up_after_retries()
+    test_session_negotiates_gzip()
+    print("✅ 客戶端測試完成！")
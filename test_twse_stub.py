@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""測試證交所替身伺服器與效能基準的比較邏輯（不連網）"""
+import json
+import os
+import tempfile
+from datetime import date, datetime
+
+from benchmark import compare
+from stock_api import parse_market_prices
+from twse_client import TWSEClient, TWSEError
+from twse_stub import StubTWSE, fixture_name, record, start_server
+
+
+def with_stub(stub, test):
+    server, base_url = start_server(stub)
+    try:
+        test(TWSEClient(base_url=base_url, retries=1, backoff=0))
+    finally:
+        server.shutdown()
+
+
+def test_payloads_match_twse_format():
+    stub = StubTWSE(universe=['2330', '2317'], today=date(2024, 6, 30))
+
+    def check(client):
+        month = client.get_json('STOCK_DAY', {'response': 'json', 'date': '20240101', 'stockNo': '2330'})
+        assert month['stat'] == 'OK'
+        assert month['data'][0][0] == '113/01/02'       # 元旦休市
+        assert len(month['data'][0]) == 9
+        # 同樣的請求得到相同的內容
+        assert client.get_json('STOCK_DAY', {'response': 'json', 'date': '20240101', 'stockNo': '2330'}) == month
+
+        assert client.get_json('STOCK_DAY', {'response': 'json', 'date': '20240801', 'stockNo': '2330'})['stat'] != 'OK'
+        assert client.get_json('T86', {'response': 'json', 'date': '20240106'})['stat'] != 'OK'   # 週六
+
+        t86 = client.get_json('T86', {'response': 'json', 'date': '20240102'})
+        assert [row[0] for row in t86['data']] == ['2330', '2317']
+        assert len(t86['data'][0]) == 19
+
+        bwibbu = client.get_json('BWIBBU_d', {'response': 'json', 'date': '20240102'})
+        assert len(bwibbu['data'][0]) == 7
+
+        # MI_INDEX 的收盤行情與 STOCK_DAY 同一天的資料一致
+        prices = parse_market_prices(client.get_json('MI_INDEX', {'response': 'json', 'date': '20240102'}),
+                                     datetime(2024, 1, 2))
+        assert prices['2330'][:7] == month['data'][0][:7]
+
+    with_stub(stub, check)
+    assert stub.requests['STOCK_DAY'] == 3
+
+
+def test_replays_fixtures():
+    with tempfile.TemporaryDirectory() as fixtures:
+        params = {'response': 'json', 'date': '20240102', 'stockNo': '2330'}
+        with open(os.path.join(fixtures, fixture_name('STOCK_DAY', params)), 'w', encoding='utf-8') as f:
+            json.dump({'stat': 'OK', 'data': [['recorded']]}, f)
+
+        def check(client):
+            assert client.get_json('STOCK_DAY', params) == {'stat': 'OK', 'data': [['recorded']]}
+            # 沒有錄製的請求改用模擬資料
+            assert client.get_json('STOCK_DAY', dict(params, date='20240201'))['data'][0][0] == '113/02/01'
+
+        with_stub(StubTWSE(fixtures), check)
+
+
+def test_record_includes_market_snapshots():
+    stub = StubTWSE(universe=['2330', '2317'], today=date(2024, 6, 30))
+    with tempfile.TemporaryDirectory() as fixtures:
+        # 2024-01-05（週五）到 01-08（週一）：一個月的 STOCK_DAY，兩個平日的 T86、BWIBBU_d、MI_INDEX
+        with_stub(stub, lambda client: record(['2330'], date(2024, 1, 5), date(2024, 1, 8), fixtures, rate=1000,
+                                              client=client))
+        assert sorted(os.listdir(fixtures)) == sorted(
+            [fixture_name('STOCK_DAY', {'date': '20240101', 'stockNo': '2330'})] +
+            [fixture_name(endpoint, {'date': day}) for endpoint in ('T86', 'BWIBBU_d', 'MI_INDEX')
+             for day in ('20240105', '20240108')])
+
+        # 重播錄製的全市場收盤行情（模擬資料的股票清單不同）
+        def check(client):
+            prices = parse_market_prices(client.get_json('MI_INDEX', {'response': 'json', 'date': '20240105'}),
+                                         datetime(2024, 1, 5))
+            assert sorted(prices) == ['2317', '2330']
+
+        with_stub(StubTWSE(fixtures, universe=['1101']), check)
+
+
+def test_throttle_returns_html_page():
+    stub = StubTWSE(universe=['2330'], throttle=2)
+
+    def check(client):
+        for _ in range(2):
+            client.get_json('BWIBBU_d', {'response': 'json', 'date': '20240102'})
+        try:
+            client.get_json('BWIBBU_d', {'response': 'json', 'date': '20240102'})
+        except TWSEError:
+            pass
+        else:
+            raise AssertionError('超過每秒請求數上限應被限流')
+
+    with_stub(stub, check)
+    assert stub.throttled == 2    # 第三次請求與它的重試
+
+
+def test_compare_flags_regressions():
+    baseline = {'30d': {'cold_seconds': 1.0, 'cold_upstream_calls': 25, 'rows': 22},
+                'micro': {'ingest_seconds': 0.001}}
+    assert compare({'30d': {'cold_seconds': 1.2, 'cold_upstream_calls': 25, 'rows': 20},
+                    'micro': {'ingest_seconds': 0.005}}, baseline, 0.25) == []
+    assert compare({'30d': {'cold_seconds': 1.3, 'cold_upstream_calls': 26}}, baseline, 0.25) == [
+        ('30d', 'cold_seconds', 1.0, 1.3), ('30d', 'cold_upstream_calls', 25, 26)]
+
+
+if __name__ == '__main__':
+    test_payloads_match_twse_format()
+    test_replays_fixtures()
+    test_record_includes_market_snapshots()
+    test_throttle_returns_html_page()
+    test_compare_flags_regressions()
+    print("✅ 替身伺服器測試完成！")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""測試本機歷史資料倉儲"""
+import os
+import sqlite3
+import tempfile
+
+from warehouse import Warehouse, month_key
+
+STOCK_DAY_ROWS = [
+    ['113/01/02', '26,059,058', '15,371,574,684', '590.00', '593.00', '589.00', '593.00', '+0.00', '23,502'],
+    ['113/01/03', '37,106,763', '21,542,102,536', '584.00', '585.00', '578.00', '578.00', 'X0.00', '64,880'],
+]
+T86_TABLE = {'2330': ['2330  ', '台積電'] + [f'{i * 1000:,}' for i in range(1, 18)]}
+BWIBBU_TABLE = {'2330': ['2330', '台積電', '2.34', '112', '25.50', '5.20', '112/3'],
+                '9999': ['9999', '測試', '-', '112', '-', '-', '112/3']}
+
+
+def test_month_rows_round_trip_and_typed_columns():
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'warehouse.sqlite3')
+        warehouse = Warehouse(path)
+        assert warehouse.month_rows('2330', 2024, 1) is None
+
+        warehouse.put_month('2330', 2024, 1, STOCK_DAY_ROWS)
+        # 原始資料列完整保留，輸出與即時抓取相同
+        assert Warehouse(path).month_rows('2330', 2024, 1) == STOCK_DAY_ROWS
+        assert Warehouse(path).month_rows('2330', 2024, 2) is None
+
+        rows = sqlite3.connect(path).execute(
+            'SELECT date, volume, close, change FROM stock_day ORDER BY date').fetchall()
+        assert rows == [('2024-01-02', 26059058, 593.0, 0.0), ('2024-01-03', 37106763, 578.0, None)]
+
+
+def test_snapshots_and_coverage():
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'warehouse.sqlite3')
+        warehouse = Warehouse(path)
+        warehouse.put_snapshot('T86', '20240102', T86_TABLE)
+        warehouse.put_snapshot('BWIBBU_d', '20240102', BWIBBU_TABLE)
+        # 假日以空表記錄，之後不再請求
+        warehouse.put_snapshot('T86', '20240106', {})
+
+        assert warehouse.snapshot('T86', '20240102') == T86_TABLE
+        assert warehouse.snapshot('T86', '20240106') == {}
+        assert warehouse.snapshot('T86', '20240103') is None
+        # 只讀取需要的股票
+        assert warehouse.snapshot('BWIBBU_d', '20240102', ['9999', '0000']) == {'9999': BWIBBU_TABLE['9999']}
+        assert warehouse.snapshot('T86', '20240106', ['2330']) == {}
+        assert warehouse.snapshot('T86', '20240103', ['2330']) is None
+        assert warehouse.covered('T86', ['20240102', '20240103', '20240106']) == {'20240102', '20240106'}
+        assert warehouse.covered('BWIBBU_d', ['20240106']) == set()
+
+        pe = dict(sqlite3.connect(path).execute('SELECT stock_code, pe FROM fundamental'))
+        assert pe == {'2330': 25.5, '9999': None}
+        assert warehouse.stats()['coverage'] == {'BWIBBU_d': 1, 'T86': 2}
+
+
+def test_month_coverage_is_per_stock():
+    with tempfile.TemporaryDirectory() as root:
+        warehouse = Warehouse(os.path.join(root, 'warehouse.sqlite3'))
+        warehouse.put_month('2330', 2024, 1, [])
+        assert warehouse.month_rows('2330', 2024, 1) == []
+        assert warehouse.month_rows('2317', 2024, 1) is None
+        assert warehouse.covered('STOCK_DAY', [month_key('2330', 2024, 1), month_key('2317', 2024, 1)]) == {'2330:202401'}
+
+
+def test_market_prices_share_stock_day_table():
+    with tempfile.TemporaryDirectory() as root:
+        warehouse = Warehouse(os.path.join(root, 'warehouse.sqlite3'))
+        warehouse.put_snapshot('MI_INDEX', '20240102', {'2330': STOCK_DAY_ROWS[0], '2317': STOCK_DAY_ROWS[0]})
+        assert warehouse.snapshot('MI_INDEX', '20240102')['2330'] == STOCK_DAY_ROWS[0]
+        # 逐日載入的股價不算完整月份，個股月份仍需另外載入
+        assert warehouse.month_rows('2330', 2024, 1) is None
+
+        warehouse.put_month('2330', 2024, 1, STOCK_DAY_ROWS)
+        assert warehouse.month_rows('2330', 2024, 1) == STOCK_DAY_ROWS
+        assert warehouse.stats()['stock_day'] == 3
+
+
+if __name__ == '__main__':
+    test_month_rows_round_trip_and_typed_columns()
+    test_snapshots_and_coverage()
+    test_month_coverage_is_per_stock()
+    test_market_prices_share_stock_day_table()
+    print("✅ 倉儲測試完成！")
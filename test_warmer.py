@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""測試盤後預先抓取的排程"""
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import stock_api
+from twse_cache import taipei_now
+from warmer import hold_lock, in_window, next_run_time, plan_warm, schedule_status
+
+
+def test_next_run_time_within_trading_days():
+    # 週一 16:00 -> 當天 17:10
+    assert next_run_time(datetime(2024, 1, 8, 16, 0), '17:10', '23:00', 50) == datetime(2024, 1, 8, 17, 10)
+    # 時段中依間隔重複執行
+    assert next_run_time(datetime(2024, 1, 8, 17, 10), '17:10', '23:00', 50) == datetime(2024, 1, 8, 18, 0)
+    # 週五晚上 -> 下週一
+    assert next_run_time(datetime(2024, 1, 12, 23, 30), '17:10', '23:00', 50) == datetime(2024, 1, 15, 17, 10)
+
+
+def test_in_window():
+    assert in_window(datetime(2024, 1, 8, 18, 0), '17:10', '23:00')
+    assert not in_window(datetime(2024, 1, 8, 9, 0), '17:10', '23:00')
+    assert not in_window(datetime(2024, 1, 13, 18, 0), '17:10', '23:00')
+
+
+def test_plan_includes_snapshots_only_after_close():
+    labels = [label for label, _ in plan_warm(datetime(2024, 2, 1, 17, 30), ['2330', '2317'])]
+    assert labels[:2] == ['T86 20240201', 'BWIBBU_d 20240201']
+    assert 'STOCK_DAY 2317 202402' in labels and 'STOCK_DAY 2317 202401' in labels
+
+    labels = [label for label, _ in plan_warm(datetime(2024, 2, 1, 15, 0), ['2330'])]
+    assert not any(label.startswith(('T86', 'BWIBBU_d')) for label in labels)
+
+
+def test_only_one_process_holds_the_lock():
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'warmer.lock')
+        first = hold_lock(path)
+        # 其他 worker 取不到鎖，等待接手
+        assert hold_lock(path, blocking=False) is None
+        first.close()
+        second = hold_lock(path, blocking=False)
+        assert second is not None
+        second.close()
+
+
+def test_health_reports_schedule():
+    original = stock_api.WARMER_STATUS_PATH
+    with tempfile.TemporaryDirectory() as root:
+        try:
+            stock_api.WARMER_STATUS_PATH = os.path.join(root, 'warmer_status.json')
+            assert stock_api.warmer_status() == {'configured': False, 'stale': False}
+
+            # 啟動排程時就記錄下一次執行時間，尚未執行過也不會被當成已停止
+            schedule_status(taipei_now() + timedelta(hours=3))
+            status = stock_api.warmer_status()
+            assert status['configured'] and not status['stale'] and status['last_run'] is None
+
+            schedule_status(taipei_now() - timedelta(hours=1))
+            assert stock_api.warmer_status()['stale']
+        finally:
+            stock_api.WARMER_STATUS_PATH = original
+
+
+if __name__ == '__main__':
+    test_next_run_time_within_trading_days()
+    test_in_window()
+    test_plan_includes_snapshots_only_after_close()
+    test_only_one_process_holds_the_lock()
+    test_health_reports_schedule()
+    print("✅ 預先抓取排程測試完成！")
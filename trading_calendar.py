@@ -0,0 +1,88 @@
+"""交易日曆：從 STOCK_DAY 資料列學習實際交易日，避免查詢假日、颱風假等非交易日"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+
+def iter_months(start_date, end_date):
+    """列出期間內的 (年, 月)"""
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+class TradingCalendar:
+    """交易日曆
+
+    已結束月份的交易日寫入本機檔案永久保存；當月只記錄到最後一個已知交易日，
+    之後的日期與尚未學習的月份一律以「週一到週五」推估。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._months = None     # 'YYYYMM' -> [日, ...]（已結束月份）
+        self._current = {}      # 'YYYYMM' -> [日, ...]（當月，只存記憶體）
+
+    def _load(self):
+        if self._months is not None:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._months = json.load(f)
+        except (OSError, ValueError):
+            self._months = {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._months, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def missing_months(self, start_date, end_date, today):
+        """期間內仍需學習的月份（當月每次都重新確認，未來月份略過）"""
+        with self._lock:
+            self._load()
+            return [
+                (year, month) for year, month in iter_months(start_date, end_date)
+                if (year, month) <= (today.year, today.month)
+                and ((year, month) == (today.year, today.month) or f'{year}{month:02d}' not in self._months)
+            ]
+
+    def learn_month(self, year, month, rows, today):
+        """從某個月的 STOCK_DAY 資料列記錄交易日（rows[i][0] 為民國日期）"""
+        days = sorted({int(row[0].split('/')[2]) for row in rows})
+        if not days:
+            return
+        key = f'{year}{month:02d}'
+        with self._lock:
+            self._load()
+            if (year, month) < (today.year, today.month):
+                if self._months.get(key) != days:
+                    self._months[key] = days
+                    self._save()
+            else:
+                self._current[key] = days
+
+    def trading_days(self, start_date, end_date):
+        """列出期間內的交易日"""
+        with self._lock:
+            self._load()
+            days = []
+            for year, month in iter_months(start_date, end_date):
+                key = f'{year}{month:02d}'
+                known = self._months.get(key) or self._current.get(key) or []
+                last_known = known[-1] if key not in self._months and known else 0
+                known = set(known)
+
+                current = max(start_date, datetime(year, month, 1))
+                while current <= end_date and current.month == month:
+                    if current.day in known:
+                        days.append(current)
+                    elif key not in self._months and current.day > last_known and current.weekday() < 5:
+                        days.append(current)
+                    current += timedelta(days=1)
+            return days
@@ -0,0 +1,215 @@
+"""證交所資料快取（全市場每日快照、個股月資料）"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+
+
+def cache_dir():
+    """快取根目錄，可用環境變數 TWSE_CACHE_DIR 覆寫（例如部署時指到持久化磁碟）；每次呼叫時讀取"""
+    return os.environ.get('TWSE_CACHE_DIR', DEFAULT_CACHE_DIR)
+
+
+TAIPEI_TZ = timezone(timedelta(hours=8))
+
+# 證交所盤後資料公布時間（T86 約 16:00、BWIBBU_d 約 14:30），保守取 17:00
+MARKET_DATA_READY_HOUR = 17
+
+
+def taipei_now():
+    """取得台北時間（不含時區資訊，方便與查詢日期比較）"""
+    return datetime.now(TAIPEI_TZ).replace(tzinfo=None)
+
+
+def is_day_finalized(date, now=None):
+    """判斷某交易日的盤後資料是否已定案（之後不會再變動）"""
+    now = now or taipei_now()
+    day = datetime(date.year, date.month, date.day)
+    today = datetime(now.year, now.month, now.day)
+    if day < today:
+        return True
+    return day == today and now.hour >= MARKET_DATA_READY_HOUR
+
+
+def is_month_closed(year, month, now=None):
+    """判斷某月份是否已結束（資料不會再變動）"""
+    now = now or taipei_now()
+    return (year, month) < (now.year, now.month)
+
+
+def data_ready_time(date):
+    """某交易日盤後資料公布（定案）的時間點（台北時間，含時區資訊）"""
+    return datetime(date.year, date.month, date.day, MARKET_DATA_READY_HOUR, tzinfo=TAIPEI_TZ)
+
+
+def next_data_ready_time(now):
+    """下一次盤後資料公布的時間點"""
+    ready = now.replace(hour=MARKET_DATA_READY_HOUR, minute=0, second=0, microsecond=0)
+    if now >= ready:
+        ready += timedelta(days=1)
+    return ready
+
+
+def content_digest(value):
+    """資料內容的雜湊，用來判斷重新抓取的資料是否有變動"""
+    payload = json.dumps(value, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class JsonFileStore:
+    """以 JSON 檔案存放的磁碟快取，記憶體保留最近使用的項目，總容量超過上限時依 LRU 淘汰"""
+
+    def __init__(self, root, max_bytes=200 * 1024 * 1024, memory_items=64):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()   # 鍵 -> 已解析的內容
+        self._files = None             # 路徑 -> 檔案大小（依使用順序）
+        self._total_bytes = 0
+
+    def _path(self, key):
+        return os.path.join(self.root, *key[:-1], f'{key[-1]}.json')
+
+    def _key(self, path):
+        relative = os.path.relpath(path, self.root)[:-len('.json')]
+        return tuple(relative.split(os.sep))
+
+    def _load_file_index(self):
+        """首次使用時掃描磁碟，依修改時間重建 LRU 順序"""
+        if self._files is not None:
+            return
+        entries = []
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith('.json'):
+                    path = os.path.join(folder, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, path, stat.st_size))
+        entries.sort()
+        self._files = OrderedDict((path, size) for _, path, size in entries)
+        self._total_bytes = sum(self._files.values())
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _read(self, key):
+        """讀取項目，沒有快取時回傳 None"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            self._load_file_index()
+            path = self._path(key)
+            if path not in self._files:
+                return None
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    value = json.load(f)
+                os.utime(path)
+            except (OSError, ValueError):
+                self._total_bytes -= self._files.pop(path, 0)
+                return None
+
+            self._files.move_to_end(path)
+            self._remember(key, value)
+            return value
+
+    def _write(self, key, value):
+        path = self._path(key)
+        payload = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+        with self._lock:
+            self._load_file_index()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+
+            size = os.path.getsize(path)
+            self._total_bytes += size - self._files.pop(path, 0)
+            self._files[path] = size
+            self._remember(key, value)
+            self._evict()
+
+    def _evict(self):
+        """超過容量上限時，刪除最久未使用的檔案"""
+        while self._total_bytes > self.max_bytes and len(self._files) > 1:
+            path, size = self._files.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._memory.pop(self._key(path), None)
+
+    def stats(self):
+        with self._lock:
+            self._load_file_index()
+            return {
+                'files': len(self._files),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+
+class SnapshotStore(JsonFileStore):
+    """全市場每日快照（T86、BWIBBU_d）的磁碟快取
+
+    以 (endpoint, 日期) 為鍵，每個檔案存一天的整張表並以股票代碼建立索引，
+    查詢單一股票為 O(1)。
+    """
+
+    def get(self, endpoint, date_param):
+        """讀取快照，回傳 {股票代碼: row}；沒有快取時回傳 None（空 dict 代表當日無資料）"""
+        value = self._read((endpoint, date_param))
+        return None if value is None else value['rows']
+
+    def put(self, endpoint, date_param, table):
+        """寫入一天的快照（table 為 {股票代碼: row}）"""
+        self._write((endpoint, date_param), {'rows': table})
+
+
+class MonthBlockStore(JsonFileStore):
+    """個股月資料（STOCK_DAY）快取
+
+    已結束的月份資料不會再變動，永久保存；當月資料只在下一次盤後資料公布前有效，
+    並以 ttl 秒數為上限。
+    """
+
+    def __init__(self, root, ttl=3600, **kwargs):
+        super().__init__(root, **kwargs)
+        self.ttl = ttl
+
+    def get(self, stock_code, year, month, now=None):
+        """讀取月資料列，沒有快取或已過期時回傳 None"""
+        value = self._read((stock_code, f'{year}{month:02d}'))
+        if value is None:
+            return None
+        expires_at = value.get('expires_at')
+        if expires_at is not None and (now or taipei_now()).timestamp() >= expires_at:
+            return None
+        return value['rows']
+
+    def put(self, stock_code, year, month, rows, now=None):
+        """寫入月資料列，回傳內容是否與先前保存的不同（包括已過期的項目）；未來的月份不快取"""
+        now = now or taipei_now()
+        if (year, month) > (now.year, now.month):
+            return False
+        key = (stock_code, f'{year}{month:02d}')
+        previous = self._read(key)
+        value = {'rows': rows, 'expires_at': None, 'digest': content_digest(rows)}
+        if (year, month) == (now.year, now.month):
+            value['expires_at'] = min(now.timestamp() + self.ttl,
+                                      next_data_ready_time(now).timestamp())
+        self._write(key, value)
+        return previous is None or previous.get('digest') != value['digest']
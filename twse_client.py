@@ -0,0 +1,246 @@
+"""共用的證交所 HTTP 客戶端（連線池、壓縮、逾時、重試）"""
+import asyncio
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_governor import CircuitOpen, RateGovernor, RateLimited, current_priority
+from twse_cache import cache_dir
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - 選用套件（非同步模式，見 asgi.py）
+    httpx = None
+
+# 證交所各端點的路徑與逾時秒數（全市場表較大，給較長的逾時）
+ENDPOINTS = {
+    'STOCK_DAY': ('/exchangeReport/STOCK_DAY', 10),
+    'T86': ('/rwd/zh/fund/T86', 15),
+    'BWIBBU_d': ('/rwd/zh/afterTrading/BWIBBU_d', 15),
+    'MI_INDEX': ('/rwd/zh/afterTrading/MI_INDEX', 20),
+}
+
+# 這些狀態碼代表暫時性錯誤，可以重試
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TWSEError(Exception):
+    """證交所請求在重試後仍然失敗"""
+
+
+class TWSEThrottled(TWSEError):
+    """被證交所限流（HTTP 429 或回傳 HTML 頁面）"""
+
+
+class TWSEUnavailable(TWSEError):
+    """速率控制暫停中或等待時間過長，請求沒有送出（稍後再試即可）"""
+
+
+class TWSEClient:
+    """所有抓取函式共用的證交所客戶端
+
+    使用同一個 Session 保持 keep-alive 連線，避免每次請求都重新建立 TLS 連線；
+    暫時性錯誤以指數退避重試，並記錄每個端點的請求延遲。有 governor（RateGovernor）時每次送出前
+    依目前的優先順序取得 token，使用者查詢（interactive）最多等待 max_wait 秒。
+    """
+
+    def __init__(self, base_url='https://www.twse.com.tw', pool_size=16,
+                 retries=3, backoff=0.5, timeouts=None, governor=None, max_wait=None):
+        self.base_url = base_url.rstrip('/')
+        self.retries = retries
+        self.backoff = backoff
+        self.timeouts = timeouts or {}
+        self.governor = governor
+        self.max_wait = max_wait
+        self.listeners = []   # 每次請求後呼叫 listener(endpoint, 秒數, 是否成功)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate'
+        })
+
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def get_json(self, endpoint, params):
+        """請求證交所端點並回傳解析後的 JSON，重試後仍失敗時拋出 TWSEError"""
+        path, default_timeout = ENDPOINTS[endpoint]
+        url = self.base_url + path
+        timeout = self.timeouts.get(endpoint, default_timeout)
+
+        priority = current_priority()
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+
+            probe = False
+            if self.governor is not None:
+                try:
+                    probe = self.governor.acquire(endpoint, priority, self._max_wait(priority))
+                except (CircuitOpen, RateLimited) as e:
+                    raise TWSEUnavailable(f'{endpoint} {params} 未送出：{e}')
+
+            started = time.perf_counter()
+            try:
+                result = parse_response(self.session.get(url, params=params, timeout=timeout))
+            except (requests.RequestException, ValueError, TWSEError) as e:
+                self._record(endpoint, time.perf_counter() - started, False, e, probe)
+                last_error = e
+                continue
+
+            self._record(endpoint, time.perf_counter() - started, True, None, probe)
+            return result
+
+        raise TWSEError(f'{endpoint} {params} 請求失敗（已重試 {self.retries} 次）：{last_error}')
+
+    def _max_wait(self, priority):
+        """使用者查詢等待 token 的上限（背景工作不限）"""
+        return self.max_wait if priority == 'interactive' else None
+
+    def _record(self, endpoint, elapsed, ok, error=None, probe=False):
+        if self.governor is not None:
+            self.governor.report(endpoint, ok, isinstance(error, TWSEThrottled), probe)
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {
+                'calls': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0
+            })
+            stats['calls'] += 1
+            stats['total_seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            if not ok:
+                stats['errors'] += 1
+
+        for listener in self.listeners:
+            listener(endpoint, elapsed, ok)
+
+    def latency_stats(self):
+        """各端點的請求次數、錯誤次數與延遲（毫秒）"""
+        with self._lock:
+            return {
+                endpoint: {
+                    'calls': stats['calls'],
+                    'errors': stats['errors'],
+                    'avg_ms': round(stats['total_seconds'] / stats['calls'] * 1000, 1),
+                    'max_ms': round(stats['max_seconds'] * 1000, 1)
+                }
+                for endpoint, stats in self._stats.items()
+            }
+
+
+def parse_response(response):
+    """檢查狀態碼並解析 JSON（requests 與 httpx 的回應介面相同）；暫時性錯誤拋出 TWSEError
+
+    被證交所限流時會回傳 HTML 頁面（或 HTTP 429），拋出 TWSEThrottled。
+    """
+    if response.status_code == 429:
+        raise TWSEThrottled('HTTP 429')
+    if response.status_code in RETRY_STATUS:
+        raise TWSEError(f'HTTP {response.status_code}')
+    response.raise_for_status()
+    try:
+        return response.json()
+    except ValueError:
+        raise TWSEThrottled('回應不是 JSON（可能被限流）')
+
+
+class AsyncTWSEClient:
+    """非阻塞的證交所客戶端（httpx.AsyncClient，非同步模式使用）
+
+    網址、逾時、重試與標頭沿用 client（TWSEClient），請求次數與延遲也記錄在 client 上，
+    /health 與 /metrics 合併回報。httpx.AsyncClient 綁定事件迴圈，第一次請求時才建立。
+    """
+
+    def __init__(self, client, pool_size=100):
+        self.client = client
+        self.pool_size = pool_size
+        self._http = None
+
+    def _session(self):
+        if httpx is None:
+            raise RuntimeError('非同步模式需要安裝 httpx（pip install httpx）')
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                headers=dict(self.client.session.headers),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            )
+        return self._http
+
+    async def get_json(self, endpoint, params):
+        """同 TWSEClient.get_json，等待回應與重試間隔時不阻塞事件迴圈"""
+        path, default_timeout = ENDPOINTS[endpoint]
+        url = self.client.base_url + path
+        timeout = self.client.timeouts.get(endpoint, default_timeout)
+        session = self._session()
+
+        priority = current_priority()
+        governor = self.client.governor
+        last_error = None
+        for attempt in range(self.client.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.client.backoff * (2 ** (attempt - 1)))
+
+            probe = False
+            if governor is not None:
+                try:
+                    probe = await governor.acquire_async(endpoint, priority, self.client._max_wait(priority))
+                except (CircuitOpen, RateLimited) as e:
+                    raise TWSEUnavailable(f'{endpoint} {params} 未送出：{e}')
+
+            started = time.perf_counter()
+            try:
+                result = parse_response(await session.get(url, params=params, timeout=timeout))
+            except (httpx.HTTPError, ValueError, TWSEError) as e:
+                # 回報結果會鎖定速率控制的狀態檔，不在事件迴圈中執行
+                await asyncio.to_thread(self.client._record, endpoint, time.perf_counter() - started, False, e, probe)
+                last_error = e
+                continue
+
+            await asyncio.to_thread(self.client._record, endpoint, time.perf_counter() - started, True, None, probe)
+            return result
+
+        raise TWSEError(f'{endpoint} {params} 請求失敗（已重試 {self.client.retries} 次）：{last_error}')
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+def governor_from_env():
+    """依環境變數建立速率控制；TWSE_RATE_PER_SECOND 為 0 時不限制
+
+    每個端點每秒的請求數上限預設為 TWSE_RATE_PER_SECOND，可用 TWSE_RATE_<端點>（例如 TWSE_RATE_T86）個別設定；
+    狀態檔（TWSE_GOVERNOR_STATE）由同一台機器上的所有 worker、warmer 與 backfill 共用。
+    """
+    rate = float(os.environ.get('TWSE_RATE_PER_SECOND', 2))
+    if rate <= 0:
+        return None
+    return RateGovernor(
+        {endpoint: float(os.environ.get(f'TWSE_RATE_{endpoint}', rate)) for endpoint in ENDPOINTS},
+        burst=int(os.environ.get('TWSE_RATE_BURST', 5)),
+        reserve=int(os.environ.get('TWSE_INTERACTIVE_RESERVE', 2)),
+        state_path=os.environ.get('TWSE_GOVERNOR_STATE', os.path.join(cache_dir(), 'rate_governor.state')),
+        failure_threshold=int(os.environ.get('TWSE_BREAKER_FAILURES', 5)),
+        cooldown=float(os.environ.get('TWSE_BREAKER_COOLDOWN', 30))
+    )
+
+
+def client_from_env():
+    """依環境變數建立客戶端"""
+    return TWSEClient(
+        base_url=os.environ.get('TWSE_BASE_URL', 'https://www.twse.com.tw'),
+        pool_size=int(os.environ.get('TWSE_POOL_SIZE', 16)),
+        retries=int(os.environ.get('TWSE_RETRIES', 3)),
+        backoff=float(os.environ.get('TWSE_RETRY_BACKOFF', 0.5)),
+        governor=governor_from_env(),
+        max_wait=float(os.environ.get('TWSE_MAX_WAIT', 30))
+    )
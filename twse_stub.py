@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""本機的證交所替身伺服器（效能測試、離線開發用）
+
+提供與證交所相同路徑與格式的 STOCK_DAY、T86、BWIBBU_d、MI_INDEX，
+以 TWSE_BASE_URL 指向這個伺服器即可離線執行整個 API：
+
+    python twse_stub.py --port 8765 --latency 0.05 --throttle 5
+    TWSE_BASE_URL=http://127.0.0.1:8765 python stock_api.py
+
+回應優先從 --fixtures 目錄重播已錄製的資料（以 record 子命令向證交所錄製），
+沒有錄製的請求依股票代碼與日期產生固定的模擬資料（同樣的請求每次都得到相同的內容）。
+可設定每個請求的延遲（latency、jitter）與限流（throttle：每秒請求數上限，超過時與證交所一樣回傳 HTML 頁面）。
+
+    python twse_stub.py record --stocks 2330 --start 2024-01-01 --end 2024-03-31 --out fixtures
+"""
+import argparse
+import calendar
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from twse_client import ENDPOINTS
+
+PATHS = {path: endpoint for endpoint, (path, _) in ENDPOINTS.items()}
+
+NO_DATA = {'stat': '很抱歉，沒有符合條件的資料!'}
+
+# 證交所限流時回傳的頁面（不是 JSON）
+THROTTLED_PAGE = '<html><body>您的查詢過於頻繁，請稍後再試</body></html>'
+
+# 模擬的國定假日（週末以外沒有交易的日期）
+HOLIDAYS = {date(2024, 1, 1), date(2024, 2, 8), date(2024, 2, 9), date(2024, 2, 12), date(2024, 2, 13),
+            date(2024, 2, 14), date(2024, 2, 28), date(2024, 4, 4), date(2024, 4, 5), date(2024, 5, 1),
+            date(2024, 6, 10), date(2024, 9, 17), date(2024, 10, 10)}
+
+T86_FIELDS = ['證券代號', '證券名稱', '外陸資買進股數(不含外資自營商)', '外陸資賣出股數(不含外資自營商)',
+              '外陸資買賣超股數(不含外資自營商)', '外資自營商買進股數', '外資自營商賣出股數', '外資自營商買賣超股數',
+              '投信買進股數', '投信賣出股數', '投信買賣超股數', '自營商買賣超股數', '自營商買進股數(自行買賣)',
+              '自營商賣出股數(自行買賣)', '自營商買賣超股數(自行買賣)', '自營商買進股數(避險)',
+              '自營商賣出股數(避險)', '自營商買賣超股數(避險)', '三大法人買賣超股數']
+MI_INDEX_FIELDS = ['證券代號', '證券名稱', '成交股數', '成交筆數', '成交金額', '開盤價', '最高價', '最低價', '收盤價',
+                   '漲跌(+/-)', '漲跌價差', '最後揭示買價', '最後揭示買量', '最後揭示賣價', '最後揭示賣量', '本益比']
+
+
+def default_universe(size=1000):
+    """模擬的上市股票代碼（包含常用的權值股）"""
+    codes = ['2330', '2317', '2454', '2308', '2881', '2882', '2303', '1301', '2002', '0050']
+    number = 1101
+    while len(codes) < size:
+        if str(number) not in codes:
+            codes.append(str(number))
+        number += 7
+    return codes
+
+
+def is_trading_day(day):
+    return day.weekday() < 5 and day not in HOLIDAYS
+
+
+def roc_date(day):
+    return f'{day.year - 1911}/{day.month:02d}/{day.day:02d}'
+
+
+def _rng(*parts):
+    return random.Random('|'.join(str(part) for part in parts))
+
+
+def _price(stock_code, day):
+    """以股票代碼決定起始價，每日依固定的亂數漲跌（同一天同一檔股票的價格每次都相同）"""
+    base = 20 + _rng(stock_code).random() * 600
+    drift = sum(_rng(stock_code, 'drift', day.year, day.month).uniform(-0.02, 0.02) for _ in range(day.day % 5 + 1))
+    return round(base * (1 + drift) * (1 + (day.toordinal() % 23 - 11) / 300), 2)
+
+
+def _day_row(stock_code, day):
+    """(成交股數, 成交金額, 開, 高, 低, 收, 漲跌價差, 成交筆數)"""
+    rng = _rng(stock_code, day.isoformat())
+    close = _price(stock_code, day)
+    previous = _price(stock_code, day - timedelta(days=1))
+    volume = rng.randint(1, 60000) * 1000
+    return (volume, int(volume * close), round(close * rng.uniform(0.99, 1.01), 2),
+            round(close * 1.015, 2), round(close * 0.985, 2), close, round(close - previous, 2),
+            rng.randint(100, 90000))
+
+
+def stock_day_payload(stock_code, year, month, today=None):
+    today = today or date.today()
+    days = [date(year, month, d) for d in range(1, calendar.monthrange(year, month)[1] + 1)]
+    rows = []
+    for day in days:
+        if day > today or not is_trading_day(day):
+            continue
+        volume, turnover, open_, high, low, close, change, transactions = _day_row(stock_code, day)
+        sign = 'X' if _rng(stock_code, 'ex', day).random() < 0.005 else ('+' if change >= 0 else '-')
+        rows.append([roc_date(day), f'{volume:,}', f'{turnover:,}', f'{open_:,.2f}', f'{high:,.2f}',
+                     f'{low:,.2f}', f'{close:,.2f}', f'{sign}{abs(change):.2f}', f'{transactions:,}'])
+    if not rows:
+        return NO_DATA
+    return {'stat': 'OK', 'date': f'{year}{month:02d}01', 'title': f'{year - 1911}年{month:02d}月 {stock_code} 各日成交資訊',
+            'fields': ['日期', '成交股數', '成交金額', '開盤價', '最高價', '最低價', '收盤價', '漲跌價差', '成交筆數'],
+            'data': rows}
+
+
+def t86_payload(day, universe):
+    rows = []
+    for stock_code in universe:
+        rng = _rng('T86', stock_code, day.isoformat())
+        values = [rng.randint(0, 5000) * 1000 for _ in range(4)]
+        foreign_buy, foreign_sell, trust_buy, trust_sell = values
+        dealer_net = rng.randint(-2000, 2000) * 1000
+        row = [stock_code, f'股票{stock_code}', foreign_buy, foreign_sell, foreign_buy - foreign_sell, 0, 0, 0,
+               trust_buy, trust_sell, trust_buy - trust_sell, dealer_net, 0, 0, 0, 0, 0, 0,
+               foreign_buy - foreign_sell + trust_buy - trust_sell + dealer_net]
+        rows.append([row[0], row[1]] + [f'{value:,}' for value in row[2:]])
+    return {'stat': 'OK', 'date': day.strftime('%Y%m%d'), 'fields': T86_FIELDS, 'data': rows}
+
+
+def bwibbu_payload(day, universe):
+    rows = []
+    for stock_code in universe:
+        rng = _rng('BWIBBU', stock_code, day.year, day.month)
+        pe = '-' if rng.random() < 0.1 else f'{rng.uniform(5, 60):.2f}'
+        rows.append([stock_code, f'股票{stock_code}', f'{rng.uniform(0, 8):.2f}', str(day.year - 1912), pe,
+                     f'{rng.uniform(0.5, 8):.2f}', f'{day.year - 1912}/4'])
+    return {'stat': 'OK', 'date': day.strftime('%Y%m%d'),
+            'fields': ['證券代號', '證券名稱', '殖利率(%)', '股利年度', '本益比', '股價淨值比', '財報年/季'], 'data': rows}
+
+
+def mi_index_payload(day, universe):
+    rows = []
+    for stock_code in universe:
+        volume, turnover, open_, high, low, close, change, transactions = _day_row(stock_code, day)
+        color = 'red' if change >= 0 else 'green'
+        sign = f'<p style= color:{color}>{"+" if change >= 0 else "-"}</p>' if change else ''
+        rows.append([stock_code, f'股票{stock_code}', f'{volume:,}', f'{transactions:,}', f'{turnover:,}',
+                     f'{open_:,.2f}', f'{high:,.2f}', f'{low:,.2f}', f'{close:,.2f}', sign, f'{abs(change):.2f}',
+                     '', '', '', '', ''])
+    return {'stat': 'OK', 'date': day.strftime('%Y%m%d'),
+            'tables': [{'title': '價格指數(臺灣證券交易所)', 'fields': ['指數', '收盤指數'], 'data': []},
+                       {'title': '每日收盤行情(全部(不含權證、牛熊證))', 'fields': MI_INDEX_FIELDS, 'data': rows}]}
+
+
+def fixture_name(endpoint, params):
+    """錄製檔的檔名：端點_日期[_股票代碼].json"""
+    parts = [endpoint, params.get('date', '')]
+    if params.get('stockNo'):
+        parts.append(params['stockNo'])
+    return '_'.join(parts) + '.json'
+
+
+class StubTWSE:
+    """替身伺服器的狀態：資料來源、延遲、限流設定與請求統計"""
+
+    def __init__(self, fixtures=None, latency=0.0, jitter=0.0, throttle=0, universe=None, today=None):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle = throttle
+        self.universe = universe or default_universe()
+        self.today = today or date.today()
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self.requests = {}
+        self.throttled = 0
+
+    def payload(self, endpoint, params):
+        if self.fixtures:
+            path = os.path.join(self.fixtures, fixture_name(endpoint, params))
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+
+        day = datetime.strptime(params['date'], '%Y%m%d').date()
+        if endpoint == 'STOCK_DAY':
+            return stock_day_payload(params.get('stockNo', ''), day.year, day.month, self.today)
+        if day > self.today or not is_trading_day(day):
+            return NO_DATA
+        if endpoint == 'T86':
+            return t86_payload(day, self.universe)
+        if endpoint == 'BWIBBU_d':
+            return bwibbu_payload(day, self.universe)
+        return mi_index_payload(day, self.universe)
+
+    def admit(self):
+        """記錄請求；超過每秒請求數上限時回傳 False"""
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and self._recent[0] <= now - 1:
+                self._recent.popleft()
+            if self.throttle and len(self._recent) >= self.throttle:
+                self.throttled += 1
+                return False
+            self._recent.append(now)
+            return True
+
+    def count(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def total_requests(self):
+        with self._lock:
+            return sum(self.requests.values())
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+
+def make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            endpoint = PATHS.get(url.path)
+            if endpoint is None:
+                self._send(404, 'text/plain', b'not found')
+                return
+
+            stub.count(endpoint)
+            stub.delay()
+            if not stub.admit():
+                self._send(200, 'text/html; charset=utf-8', THROTTLED_PAGE.encode('utf-8'))
+                return
+
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            try:
+                body = json.dumps(stub.payload(endpoint, params), ensure_ascii=False).encode('utf-8')
+            except (KeyError, ValueError):
+                self._send(400, 'text/plain', b'bad request')
+                return
+            self._send(200, 'application/json; charset=utf-8', body)
+
+        def _send(self, status, content_type, body):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_server(stub, host='127.0.0.1', port=0):
+    """在背景執行緒啟動替身伺服器，回傳 (server, base_url)；結束時呼叫 server.shutdown()"""
+    server = ThreadingHTTPServer((host, port), make_handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+def record(stock_codes, start_date, end_date, out_dir, rate=1.0, client=None):
+    """向證交所錄製期間內的 STOCK_DAY（每檔股票每月）與 T86、BWIBBU_d、MI_INDEX（每個平日），供替身伺服器重播"""
+    from stock_api import MARKET_SNAPSHOT_PARAMS
+    from trading_calendar import iter_months
+    from twse_client import client_from_env
+
+    client = client or client_from_env()
+    os.makedirs(out_dir, exist_ok=True)
+    requests_to_make = [('STOCK_DAY', {'response': 'json', 'date': f'{year}{month:02d}01', 'stockNo': stock_code})
+                        for year, month in iter_months(start_date, end_date) for stock_code in stock_codes]
+    day = start_date
+    while day <= end_date:
+        if day.weekday() < 5:
+            # 全市場每日表使用與 API 相同的查詢參數（MI_INDEX 為全市場收盤行情）
+            requests_to_make.extend((endpoint, dict(params, date=day.strftime('%Y%m%d')))
+                                    for endpoint, params in MARKET_SNAPSHOT_PARAMS.items())
+        day += timedelta(days=1)
+
+    for i, (endpoint, params) in enumerate(requests_to_make, 1):
+        path = os.path.join(out_dir, fixture_name(endpoint, params))
+        if os.path.exists(path):
+            continue
+        payload = client.get_json(endpoint, params)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False)
+        print(f'📼 {i}/{len(requests_to_make)} {os.path.basename(path)}')
+        time.sleep(1.0 / rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本機的證交所替身伺服器')
+    subparsers = parser.add_subparsers(dest='command')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fixtures', help='已錄製資料的目錄（沒有錄製的請求改用模擬資料）')
+    parser.add_argument('--latency', type=float, default=0.0, help='每個請求的延遲秒數')
+    parser.add_argument('--jitter', type=float, default=0.0, help='額外的隨機延遲秒數上限')
+    parser.add_argument('--throttle', type=int, default=0, help='每秒請求數上限（0 為不限流）')
+
+    recorder = subparsers.add_parser('record', help='向證交所錄製資料')
+    recorder.add_argument('--stocks', required=True, help='股票代碼，以逗號分隔')
+    recorder.add_argument('--start', required=True, help='開始日期 YYYY-MM-DD')
+    recorder.add_argument('--end', required=True, help='結束日期 YYYY-MM-DD')
+    recorder.add_argument('--out', required=True, help='輸出目錄')
+    recorder.add_argument('--rate', type=float, default=0.5, help='每秒請求數（預設 0.5）')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record([code.strip() for code in args.stocks.split(',') if code.strip()],
+               datetime.strptime(args.start, '%Y-%m-%d'), datetime.strptime(args.end, '%Y-%m-%d'),
+               args.out, args.rate)
+        return
+
+    stub = StubTWSE(args.fixtures, args.latency, args.jitter, args.throttle)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(stub))
+    print(f'🧪 證交所替身伺服器：http://{args.host}:{args.port}（TWSE_BASE_URL 指向此位址）')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
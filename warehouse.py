@@ -0,0 +1,224 @@
+"""本機歷史資料倉儲（SQLite）
+
+股價（STOCK_DAY）、三大法人（T86）、基本面（BWIBBU_d）各一張表，以 (股票代碼, 日期) 為主鍵，
+數值欄位以 INTEGER / REAL 存放，方便直接查詢與篩選；另外保留證交所原始資料列（raw），
+API 輸出時沿用原始字串，格式與即時抓取完全相同。
+
+coverage 表記錄已經載入的範圍（個股月份、全市場日期，包含沒有資料的假日），
+查詢時只有倉儲沒有的日期才需要向證交所請求。只存放已定案的資料（已結束的月份、盤後已公布的日期）。
+"""
+import json
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+# 各資料表的欄位：(欄位名稱, SQL 型別, 原始資料列的位置)
+STOCK_DAY_FIELDS = [
+    ('volume', 'INTEGER', 1),        # 成交股數
+    ('turnover', 'INTEGER', 2),      # 成交金額
+    ('open', 'REAL', 3),             # 開盤價
+    ('high', 'REAL', 4),             # 最高價
+    ('low', 'REAL', 5),              # 最低價
+    ('close', 'REAL', 6),            # 收盤價
+    ('change', 'REAL', 7),           # 漲跌價差（除權息 X0.00 為 NULL）
+    ('transactions', 'INTEGER', 8),  # 成交筆數
+]
+
+SNAPSHOT_FIELDS = {
+    'T86': [
+        ('foreign_buy', 'INTEGER', 2),    # 外陸資買進股數(不含外資自營商)
+        ('foreign_sell', 'INTEGER', 3),   # 外陸資賣出股數(不含外資自營商)
+        ('foreign_net', 'INTEGER', 4),    # 外陸資買賣超股數(不含外資自營商)
+        ('trust_buy', 'INTEGER', 8),      # 投信買進股數
+        ('trust_sell', 'INTEGER', 9),     # 投信賣出股數
+        ('trust_net', 'INTEGER', 10),     # 投信買賣超股數
+        ('dealer_net', 'INTEGER', 11),    # 自營商買賣超股數
+        ('total_net', 'INTEGER', 18),     # 三大法人買賣超股數
+    ],
+    'BWIBBU_d': [
+        ('dividend_yield', 'REAL', 2),    # 殖利率(%)
+        ('dividend_year', 'TEXT', 3),     # 股利年度
+        ('pe', 'REAL', 4),                # 本益比
+        ('pb', 'REAL', 5),                # 股價淨值比
+        ('fiscal_quarter', 'TEXT', 6),    # 財報年/季
+    ],
+}
+
+# MI_INDEX（全市場每日收盤行情）轉成與 STOCK_DAY 相同的資料列後存進同一張表，
+# coverage 分開記錄（STOCK_DAY 以個股月份、MI_INDEX 以日期）
+TABLES = {'STOCK_DAY': ('stock_day', STOCK_DAY_FIELDS),
+          'MI_INDEX': ('stock_day', STOCK_DAY_FIELDS),
+          'T86': ('institutional', SNAPSHOT_FIELDS['T86']),
+          'BWIBBU_d': ('fundamental', SNAPSHOT_FIELDS['BWIBBU_d'])}
+
+
+def parse_value(value, sql_type):
+    """將證交所字串轉成欄位型別，無法解析（--、X0.00 等）時為 None"""
+    if sql_type == 'TEXT':
+        return value
+    try:
+        number = float(str(value).replace(',', ''))
+    except ValueError:
+        return None
+    return int(number) if sql_type == 'INTEGER' else number
+
+
+# 某日全市場表按欄位存放：股票代碼、股票名稱與 {欄位名稱: [值, ...]}（數值已解析，無法解析時為 None）
+MarketTable = namedtuple('MarketTable', ['codes', 'names', 'columns'])
+
+
+def table_columns(endpoint, table):
+    """全市場表 {股票代碼: 原始資料列} 轉成 MarketTable（依股票代碼排序）"""
+    _, fields = TABLES[endpoint]
+    codes = sorted(table)
+    return MarketTable(codes, [table[code][1].strip() for code in codes],
+                       {name: [parse_value(table[code][i], sql_type) for code in codes]
+                        for name, sql_type, i in fields})
+
+
+def roc_to_iso(roc_date_str):
+    """民國日期（113/01/02）轉為 2024-01-02"""
+    year, month, day = (int(part) for part in roc_date_str.split('/'))
+    return f'{year + 1911:04d}-{month:02d}-{day:02d}'
+
+
+def month_key(stock_code, year, month):
+    return f'{stock_code}:{year}{month:02d}'
+
+
+class Warehouse:
+    """SQLite 歷史資料倉儲，每個執行緒使用自己的連線（WAL 模式，可多程序同時讀取）"""
+
+    def __init__(self, path, mmap_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.mmap_bytes = mmap_bytes
+        self._local = threading.local()
+        self._ready = False
+
+    def _conn(self):
+        """這個執行緒的連線；資料庫檔與資料表在第一次使用時才建立"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if not self._ready:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA mmap_size={int(self.mmap_bytes)}')
+            if not self._ready:
+                self._create_tables(conn)
+                self._ready = True
+            self._local.conn = conn
+        return conn
+
+    def _create_tables(self, conn):
+        with conn:
+            for table, fields in TABLES.values():
+                columns = ', '.join(f'{name} {sql_type}' for name, sql_type, _ in fields)
+                conn.execute(f'CREATE TABLE IF NOT EXISTS {table} ('
+                             f'stock_code TEXT NOT NULL, date TEXT NOT NULL, {columns}, raw TEXT NOT NULL, '
+                             f'PRIMARY KEY (stock_code, date)) WITHOUT ROWID')
+                conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_date ON {table} (date)')
+            conn.execute('CREATE TABLE IF NOT EXISTS coverage ('
+                         'dataset TEXT NOT NULL, key TEXT NOT NULL, loaded_at TEXT NOT NULL, '
+                         'PRIMARY KEY (dataset, key)) WITHOUT ROWID')
+
+    def _insert(self, conn, endpoint, rows):
+        """rows 為 [(股票代碼, 日期, 原始資料列)]"""
+        table, fields = TABLES[endpoint]
+        names = ', '.join(name for name, _, _ in fields)
+        marks = ', '.join('?' for _ in fields)
+        conn.executemany(
+            f'INSERT OR REPLACE INTO {table} (stock_code, date, {names}, raw) VALUES (?, ?, {marks}, ?)',
+            [(stock_code, date_str, *(parse_value(row[i], sql_type) for _, sql_type, i in fields),
+              json.dumps(row, ensure_ascii=False))
+             for stock_code, date_str, row in rows]
+        )
+
+    def _cover(self, conn, dataset, key):
+        conn.execute('INSERT OR REPLACE INTO coverage (dataset, key, loaded_at) VALUES (?, ?, ?)',
+                     (dataset, key, datetime.now().isoformat(timespec='seconds')))
+
+    def covered(self, dataset, keys):
+        """回傳 keys 中已載入的部分"""
+        keys = list(keys)
+        found = set()
+        conn = self._conn()
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            marks = ', '.join('?' for _ in part)
+            found.update(key for (key,) in conn.execute(
+                f'SELECT key FROM coverage WHERE dataset = ? AND key IN ({marks})', (dataset, *part)))
+        return found
+
+    def month_rows(self, stock_code, year, month):
+        """個股單月的 STOCK_DAY 原始資料列；尚未載入時回傳 None"""
+        if not self.covered('STOCK_DAY', [month_key(stock_code, year, month)]):
+            return None
+        prefix = f'{year:04d}-{month:02d}-'
+        return [json.loads(raw) for (raw,) in self._conn().execute(
+            'SELECT raw FROM stock_day WHERE stock_code = ? AND date >= ? AND date < ? ORDER BY date',
+            (stock_code, prefix + '01', prefix + '32'))]
+
+    def put_month(self, stock_code, year, month, rows):
+        """寫入個股單月的 STOCK_DAY 資料列（只應寫入已結束的月份）"""
+        conn = self._conn()
+        with conn:
+            self._insert(conn, 'STOCK_DAY', [(stock_code, roc_to_iso(row[0]), row) for row in rows])
+            self._cover(conn, 'STOCK_DAY', month_key(stock_code, year, month))
+
+    def snapshot(self, endpoint, date_param, stock_codes=None):
+        """某日全市場表 {股票代碼: 原始資料列}；尚未載入時回傳 None
+
+        stock_codes 為股票代碼清單時只讀取這些股票（以主鍵查詢，不解析其他股票的資料列）。
+        """
+        if not self.covered(endpoint, [date_param]):
+            return None
+        table, _ = TABLES[endpoint]
+        date_str = f'{date_param[:4]}-{date_param[4:6]}-{date_param[6:]}'
+        if stock_codes is None:
+            return {stock_code: json.loads(raw) for stock_code, raw in self._conn().execute(
+                f'SELECT stock_code, raw FROM {table} WHERE date = ?', (date_str,))}
+
+        stock_codes = list(stock_codes)
+        rows = {}
+        for i in range(0, len(stock_codes), 500):
+            part = stock_codes[i:i + 500]
+            marks = ', '.join('?' for _ in part)
+            rows.update((stock_code, json.loads(raw)) for stock_code, raw in self._conn().execute(
+                f'SELECT stock_code, raw FROM {table} WHERE date = ? AND stock_code IN ({marks})', (date_str, *part)))
+        return rows
+
+    def snapshot_columns(self, endpoint, date_param, names=None):
+        """某日全市場表的 MarketTable（直接讀取數值欄位，不解析原始資料列）；尚未載入時回傳 None
+
+        names 為欄位名稱清單時只讀取這些欄位。
+        """
+        if not self.covered(endpoint, [date_param]):
+            return None
+        table, fields = TABLES[endpoint]
+        names = list(names or (name for name, _, _ in fields))
+        date_str = f'{date_param[:4]}-{date_param[4:6]}-{date_param[6:]}'
+        rows = self._conn().execute(
+            f"SELECT stock_code, json_extract(raw, '$[1]'), {', '.join(names)} FROM {table} "
+            f'WHERE date = ? ORDER BY stock_code', (date_str,)).fetchall()
+        columns = list(zip(*rows)) or [()] * (len(names) + 2)
+        return MarketTable(list(columns[0]), [name.strip() for name in columns[1]],
+                           {name: list(values) for name, values in zip(names, columns[2:])})
+
+    def put_snapshot(self, endpoint, date_param, table):
+        """寫入某日全市場表（空表代表當天沒有交易，同樣記錄為已載入）"""
+        date_str = f'{date_param[:4]}-{date_param[4:6]}-{date_param[6:]}'
+        conn = self._conn()
+        with conn:
+            self._insert(conn, endpoint, [(stock_code, date_str, row) for stock_code, row in table.items()])
+            self._cover(conn, endpoint, date_param)
+
+    def stats(self):
+        conn = self._conn()
+        stats = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                 for table, _ in TABLES.values()}
+        stats['coverage'] = dict(conn.execute('SELECT dataset, COUNT(*) FROM coverage GROUP BY dataset'))
+        return stats
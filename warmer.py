@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""盤後預先抓取（cache warming）
+
+交易日收盤後先把當天的全市場表（T86、BWIBBU_d）載入倉儲，並更新觀察清單中每檔股票的當月 STOCK_DAY，
+讓使用者查詢時幾乎都直接讀到快取。當月資料的快取有時效（CURRENT_MONTH_TTL），所以在 WARM_START 到
+WARM_END 之間每 WARM_EVERY_MINUTES 分鐘重新整理一次；已經在倉儲或快取中的資料不會重複請求。
+執行狀態寫入 WARMER_STATUS_PATH，由 /health 回報。
+
+預設在 web 程序中以背景執行緒執行（gunicorn.conf.py 與 asgi.py 啟動時呼叫 start_background，WARM_IN_WEB=false
+時停用），與 API 使用同一個快取目錄。同一台機器上以檔案鎖（WARMER_LOCK_PATH）確保只有一個程序執行排程，
+其他 worker 等待，執行中的 worker 結束時由其中一個接手。
+
+用法：
+    python warmer.py          # 依排程持續執行（web 程序已在執行時等待接手）
+    python warmer.py --once   # 只執行一次（例如交給同一台機器上的 cron）
+"""
+import argparse
+import fcntl
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import partial
+
+import stock_api
+from rate_governor import request_priority
+from twse_cache import is_day_finalized, taipei_now
+
+WARM_START = os.environ.get('WARM_START', '17:10')
+WARM_END = os.environ.get('WARM_END', '23:00')
+WARM_EVERY_MINUTES = int(os.environ.get('WARM_EVERY_MINUTES', 50))
+
+# 觀察清單：需要預先更新當月股價的股票（交易日曆的參考股票一定包含在內）
+WARM_WATCHLIST = [code.strip() for code in os.environ.get('WARM_WATCHLIST', '2330,2317,2454,0050').split(',')
+                  if code.strip()]
+
+# 是否在 web 程序中執行排程，以及確保只有一個程序執行的檔案鎖
+WARM_IN_WEB = os.environ.get('WARM_IN_WEB', 'true').lower() == 'true'
+# 未設定時使用狀態檔旁的 .lock
+WARMER_LOCK_PATH = os.environ.get('WARMER_LOCK_PATH')
+
+_background = None
+
+
+def parse_clock(text):
+    hour, minute = (int(part) for part in text.split(':'))
+    return hour, minute
+
+
+def next_run_time(now, start=WARM_START, end=WARM_END, every=WARM_EVERY_MINUTES):
+    """下一次執行時間：交易日（週一到週五）的 start 到 end 之間，每 every 分鐘一次"""
+    day = datetime(now.year, now.month, now.day)
+    for offset in range(8):
+        current = day + timedelta(days=offset)
+        if current.weekday() >= 5:
+            continue
+        run = current.replace(hour=parse_clock(start)[0], minute=parse_clock(start)[1])
+        until = current.replace(hour=parse_clock(end)[0], minute=parse_clock(end)[1])
+        while run <= until:
+            if run > now:
+                return run
+            run += timedelta(minutes=every)
+    return None
+
+
+def in_window(now, start=WARM_START, end=WARM_END):
+    """是否在交易日的預先抓取時段內"""
+    clock = (now.hour, now.minute)
+    return now.weekday() < 5 and parse_clock(start) <= clock <= parse_clock(end)
+
+
+def plan_warm(now, watchlist):
+    """列出要預先抓取的項目 [(說明, 抓取函式)]"""
+    today = datetime(now.year, now.month, now.day)
+    items = []
+    if today.weekday() < 5 and is_day_finalized(today, now):
+        for endpoint in ('T86', 'BWIBBU_d'):
+            items.append((f'{endpoint} {today.strftime("%Y%m%d")}',
+                          partial(stock_api.fetch_market_snapshot, endpoint, today)))
+
+    # 當月資料有時效，重新整理；上個月在月初剛結束，順便存進倉儲（已存在時不會請求）
+    last_month = today.replace(day=1) - timedelta(days=1)
+    codes = list(dict.fromkeys([stock_api.CALENDAR_REFERENCE_STOCK] + watchlist))
+    for year, month in ((today.year, today.month), (last_month.year, last_month.month)):
+        for stock_code in codes:
+            items.append((f'STOCK_DAY {stock_code} {year}{month:02d}',
+                          partial(stock_api.fetch_month_prices, stock_code, year, month)))
+    return items
+
+
+def warm(now=None, watchlist=WARM_WATCHLIST):
+    """執行一次預先抓取，寫入並回傳狀態"""
+    now = now or taipei_now()
+    started = time.time()
+    items = plan_warm(now, watchlist)
+    # 預先抓取不急，使用者查詢優先取得證交所的請求額度
+    with request_priority('backfill'):
+        outcomes = stock_api.scheduler.map([fetch for _, fetch in items])
+    errors = {label: str(error) for (label, _), (_, error) in zip(items, outcomes) if error is not None}
+
+    status = {
+        'last_run': now.strftime('%Y-%m-%d %H:%M:%S'),
+        'trade_date': now.strftime('%Y-%m-%d'),
+        'snapshots_ready': is_day_finalized(now, now) and not any(label.startswith(('T86', 'BWIBBU_d'))
+                                                                  for label in errors),
+        'items': len(items),
+        'errors': errors,
+        'duration_ms': round((time.time() - started) * 1000),
+        'watchlist': watchlist,
+        'next_run': None
+    }
+    following = next_run_time(now)
+    if following:
+        status['next_run'] = following.strftime('%Y-%m-%d %H:%M:%S')
+    write_status(status)
+    return status
+
+
+def write_status(status):
+    path = stock_api.WARMER_STATUS_PATH
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(status, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def schedule_status(next_run):
+    """開始排程時更新狀態檔的下一次執行時間（/health 依此判斷 warmer 是否已停止）"""
+    status = stock_api.warmer_status()
+    if not status.get('configured'):
+        status = {'last_run': None}
+    status.pop('configured', None)
+    status.pop('stale', None)
+    status['next_run'] = next_run.strftime('%Y-%m-%d %H:%M:%S') if next_run else None
+    write_status(status)
+
+
+def hold_lock(path=None, blocking=True):
+    """取得 warmer 的檔案鎖，回傳開啟的鎖檔（程序結束時自動釋放）；blocking 為 False 且已被佔用時回傳 None"""
+    path = path or WARMER_LOCK_PATH or f'{stock_api.WARMER_STATUS_PATH}.lock'
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    lock_file = open(path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def run_forever():
+    """取得檔案鎖後依排程持續執行（鎖被其他程序佔用時等待接手）"""
+    lock_file = hold_lock(blocking=False)
+    if lock_file is None:
+        print("⏳ 其他程序正在執行預先抓取排程，等待接手")
+        lock_file = hold_lock()     # 排程期間保持開啟，程序結束時釋放給其他程序接手
+
+    print(f"🔥 預先抓取排程（pid {os.getpid()}）：交易日 {WARM_START}-{WARM_END}，每 {WARM_EVERY_MINUTES} 分鐘，"
+          f"觀察清單 {', '.join(WARM_WATCHLIST)}")
+    # 在時段內啟動（例如重新部署、接手）時立即執行一次
+    now = taipei_now()
+    run_now = in_window(now)
+    schedule_status(now if run_now else next_run_time(now))
+    while True:
+        if not run_now:
+            now = taipei_now()
+            time.sleep(max((next_run_time(now) - now).total_seconds(), 0))
+        run_now = False
+        try:
+            status = warm()
+            print(f"✅ {status['last_run']} 預先抓取完成，失敗 {len(status['errors'])} 項")
+        except Exception as e:
+            print(f"❌ 預先抓取失敗：{e}")
+
+
+def start_background():
+    """在 web 程序中以背景執行緒執行排程（每個 worker 都可呼叫，只有取得檔案鎖的一個執行）"""
+    global _background
+    if not WARM_IN_WEB or _background is not None:
+        return _background
+    _background = threading.Thread(target=run_forever, name='warmer', daemon=True)
+    _background.start()
+    return _background
+
+
+def main():
+    parser = argparse.ArgumentParser(description='盤後預先抓取當日資料')
+    parser.add_argument('--once', action='store_true', help='只執行一次')
+    args = parser.parse_args()
+
+    if args.once:
+        status = warm()
+        print(f"✅ 預先抓取完成：{status['items']} 項，失敗 {len(status['errors'])} 項")
+        return
+    run_forever()
+
+
+if __name__ == '__main__':
+    main()